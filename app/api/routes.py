@@ -1,7 +1,11 @@
 from fastapi import APIRouter, HTTPException, UploadFile, File, Form, BackgroundTasks, Body
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Dict, Any, Optional, List
+import io
 import os
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from app.config import settings
 import shutil
 from datetime import datetime
@@ -11,15 +15,14 @@ import uuid
 import requests
 import hashlib
 import tempfile
-import librosa
+from collections import OrderedDict
 import soundfile as sf
-from base64 import b64encode
 from dotenv import load_dotenv
 
 # 导入模型服务
 from app.services.whisper_service import transcribe_audio, get_model_status as get_whisper_status, load_model as load_whisper_model
-from app.services.qwen_service import get_model_status as get_qwen_status, chat_with_model as qwen_chat
-from app.services.uncensored_service import chat_with_uncensored as uncensored_chat, get_uncensored_status as get_uncensored_status
+from app.services.qwen_service import get_model_status as get_qwen_status, chat_with_model as qwen_chat, load_model as load_qwen_model, MAX_NEW_TOKENS
+from app.services.uncensored_service import chat_with_uncensored as uncensored_chat, get_uncensored_status as get_uncensored_status, load_uncensored_model
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -29,6 +32,80 @@ router = APIRouter()
 # 加载.env文件
 load_dotenv()
 
+# 上传文件分块读取大小
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# 小于该大小的上传文件直接在内存中处理，不写临时文件
+SMALL_UPLOAD_SIZE = 1 << 20
+
+# 允许的音频文件扩展名
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.ogg', '.flac', '.m4a', '.aac')
+
+# 转写结果缓存，按音频内容摘要和语言去重，客户端重试上传同一段音频时直接返回结果
+TRANSCRIPTION_CACHE_SIZE = 256
+_transcription_cache = OrderedDict()
+
+def _get_cached_transcription(key):
+    """查询转写结果缓存"""
+    transcription = _transcription_cache.get(key)
+    if transcription is not None:
+        _transcription_cache.move_to_end(key)
+    return transcription
+
+def _cache_transcription(key, transcription):
+    """写入转写结果缓存，超出容量时淘汰最久未使用的条目"""
+    _transcription_cache[key] = transcription
+    _transcription_cache.move_to_end(key)
+    if len(_transcription_cache) > TRANSCRIPTION_CACHE_SIZE:
+        _transcription_cache.popitem(last=False)
+
+# 模型状态缓存时间（秒）
+STATUS_CACHE_TTL = 1.0
+
+def _ttl_cached(fn, ttl=STATUS_CACHE_TTL):
+    """为无参数的状态查询函数添加短时间缓存，合并前端轮询产生的重复调用"""
+    cache = {}
+    
+    def wrapper():
+        bucket = int(time.monotonic() / ttl)
+        if cache.get("bucket") != bucket:
+            cache["value"] = fn()
+            cache["bucket"] = bucket
+        # 返回副本，调用方修改状态字段不会影响缓存
+        return dict(cache["value"])
+    
+    return wrapper
+
+cached_whisper_status = _ttl_cached(get_whisper_status)
+cached_qwen_status = _ttl_cached(get_qwen_status)
+cached_uncensored_status = _ttl_cached(get_uncensored_status)
+
+class ChatRequest(BaseModel):
+    """对话请求"""
+    model_config = ConfigDict(extra="forbid")
+    
+    prompt: str
+    history: Optional[List[Dict[str, str]]] = None
+    # 生成长度同时决定静态KV缓存的大小，限制上限避免请求触发过大的显存分配
+    max_length: int = Field(2048, ge=1, le=MAX_NEW_TOKENS)
+    temperature: float = 0.7
+    top_p: float = 0.9
+
+# 临时文件清理线程池，删除操作不占用事件循环线程
+_CLEANUP_POOL = ThreadPoolExecutor(max_workers=8)
+
+def _unlink_quietly(path):
+    """删除文件，文件不存在时忽略"""
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+async def _aunlink(path):
+    """在清理线程池中异步删除文件"""
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(_CLEANUP_POOL, _unlink_quietly, path)
+
 @router.post("/speech-to-text")
 async def speech_to_text(
     background_tasks: BackgroundTasks,
@@ -38,35 +115,60 @@ async def speech_to_text(
     try:
         if file.content_type is not None:
             if not file.content_type.startswith('audio/'):
-                filename = file.filename.lower()
-                audio_extensions = ['.wav', '.mp3', '.ogg', '.flac', '.m4a', '.aac']
-                is_audio = any(filename.endswith(ext) for ext in audio_extensions)
+                is_audio = (file.filename or "").lower().endswith(AUDIO_EXTENSIONS)
                 
                 if not is_audio:
                     raise HTTPException(status_code=400, detail="只接受音频文件")
         else:
             # 当 content_type 为 None 时，检查文件扩展名
-            filename = file.filename.lower() if file.filename else ""
-            audio_extensions = ['.wav', '.mp3', '.ogg', '.flac', '.m4a', '.aac']
-            is_audio = any(filename.endswith(ext) for ext in audio_extensions)
+            is_audio = (file.filename or "").lower().endswith(AUDIO_EXTENSIONS)
             
             if not is_audio:
                 raise HTTPException(status_code=400, detail="只接受音频文件且未提供内容类型")
         
-        # 创建临时文件
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as temp_file:
+        temp_file_path = None
+        if file.size is not None and file.size < SMALL_UPLOAD_SIZE:
+            # 小文件直接在内存中交给Whisper解码，省去临时文件的写入、读取和删除
             content = await file.read()
             if not content:
                 raise HTTPException(status_code=400, detail="上传的文件为空")
-                
-            temp_file.write(content)
-            temp_file_path = temp_file.name
+            
+            digest = hashlib.blake2b(content, digest_size=16)
+            audio_source = io.BytesIO(content)
+        else:
+            # 创建临时文件，分块写入，避免整个文件读入内存，同时计算内容摘要
+            digest = hashlib.blake2b(digest_size=16)
+            with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as temp_file:
+                temp_file_path = temp_file.name
+                while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                    temp_file.write(chunk)
+                    digest.update(chunk)
+                is_empty = temp_file.tell() == 0
+            
+            if is_empty:
+                await _aunlink(temp_file_path)
+                raise HTTPException(status_code=400, detail="上传的文件为空")
+            
+            audio_source = temp_file_path
         
-        # 进行语音转文字
-        transcription = await transcribe_audio(temp_file_path, language)
+        # 相同内容的音频直接返回缓存的转写结果
+        cache_key = (digest.digest(), language)
+        transcription = _get_cached_transcription(cache_key)
+        if transcription is None:
+            # 进行语音转文字，失败时立即清理临时文件
+            try:
+                audio_format = os.path.splitext(file.filename or "")[1].lstrip(".").lower() or None
+                transcription = await transcribe_audio(audio_source, language, audio_format=audio_format)
+            except Exception:
+                if temp_file_path is not None:
+                    await _aunlink(temp_file_path)
+                raise
+            
+            _cache_transcription(cache_key, transcription)
         
-        # 在后台任务中删除临时文件
-        background_tasks.add_task(os.unlink, temp_file_path)
+        # 响应发送后在后台删除临时文件
+        if temp_file_path is not None:
+            background_tasks.add_task(_aunlink, temp_file_path)
         
         return {
             "code": 0,
@@ -84,7 +186,7 @@ async def speech_to_text(
 
 @router.get("/speech-to-text/status")
 async def speech_to_text_status(background_tasks: BackgroundTasks):
-    status_info = get_whisper_status()
+    status_info = cached_whisper_status()
     
     if status_info["status"] == "not_loaded":
         background_tasks.add_task(load_whisper_model)
@@ -124,12 +226,11 @@ async def qwen_status(background_tasks: BackgroundTasks):
     """
     检查Qwen模型加载状态
     """
-    status_info = get_qwen_status()
+    status_info = cached_qwen_status()
     
     # 尝试触发模型加载（如果尚未加载）
     if status_info["status"] == "not_loaded":
-        from app.services.qwen_service import load_model
-        background_tasks.add_task(load_model)
+        background_tasks.add_task(load_qwen_model)
         status_info["status"] = "loading"
     
     return status_info
@@ -161,11 +262,10 @@ async def uncensored_status(background_tasks: BackgroundTasks):
     """
     检查Gryphe/MythoMax-L2-13b模型加载状态
     """
-    status_info = get_uncensored_status()
+    status_info = cached_uncensored_status()
 
     # 尝试触发模型加载（如果尚未加载）
     if status_info["status"] == "not_loaded":
-        from app.services.uncensored_service import load_uncensored_model
         background_tasks.add_task(load_uncensored_model)
         status_info["status"] = "loading"
 
@@ -13,8 +13,16 @@ APP_PORT = int(os.getenv("APP_PORT", 8000))
 # gRPC服务端口
 GRPC_PORT = int(os.getenv("GRPC_PORT", 50051))
 
+# gRPC单条消息大小上限（字节），音频和长提示词需要较大的上限
+GRPC_MAX_MESSAGE_LENGTH = int(os.getenv("GRPC_MAX_MESSAGE_LENGTH", 64 * 1024 * 1024))
+
+# gRPC流式消息的发送间隔（毫秒）
+STREAM_INTERVAL_MS = int(os.getenv("STREAM_INTERVAL_MS", 500))
+
 # WebSocket服务端口
 WEBSOCKET_PORT = int(os.getenv("WEBSOCKET_PORT", 8001))
+# WebSocket是否协商permessage-deflate压缩，音频帧基本无法压缩，默认关闭
+WS_PER_MESSAGE_DEFLATE = os.getenv("WS_PER_MESSAGE_DEFLATE", "").lower() in ("1", "true", "yes")
 
 # 日志配置
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
@@ -23,6 +31,18 @@ LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 API_PREFIX = "/api/v1"
 WEBSOCKET_PATH = "/ws"
 
+# 启动时预加载的模型，逗号分隔，可选: whisper, qwen, uncensored, deepseek
+# 默认不预加载，模型在首次请求时加载；多个大模型同时预加载可能超出单卡显存，按部署的显存大小选择
+PRELOAD_MODELS = [name.strip() for name in os.getenv("PRELOAD_MODELS", "").split(",") if name.strip()]
+
+# 推理动态批处理：单批最大请求数，以及收到第一个请求后最多等待的时间（毫秒）
+INFERENCE_MAX_BATCH_SIZE = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", 8))
+INFERENCE_MAX_WAIT_MS = int(os.getenv("INFERENCE_MAX_WAIT_MS", 10))
+
+# Qwen编译推理复用的静态KV缓存长度（提示词加生成的token数），缓存按INFERENCE_MAX_BATCH_SIZE个请求一次性分配，
+# 显存占用与两者的乘积成正比；同时限制了Qwen可用的上下文长度
+QWEN_STATIC_CACHE_LEN = int(os.getenv("QWEN_STATIC_CACHE_LEN", 16384))
+
 # API密钥配置
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY", "")
 
@@ -35,11 +55,23 @@ os.makedirs(DATA_DIR, exist_ok=True)
 AUDIO_DIR = os.path.join(DATA_DIR, "audio")
 IMU_DIR = os.path.join(DATA_DIR, "imu")
 PROCESSED_DIR = os.path.join(DATA_DIR, "processed")
+# 按内容哈希命名的临时WAV文件目录，相同音频直接复用已保存的文件
+TEMP_AUDIO_DIR = os.getenv("TEMP_AUDIO_DIR", "/tmp/secretgarden")
 
 # 确保目录存在
 os.makedirs(AUDIO_DIR, exist_ok=True)
 os.makedirs(IMU_DIR, exist_ok=True)
 os.makedirs(PROCESSED_DIR, exist_ok=True)
+os.makedirs(TEMP_AUDIO_DIR, exist_ok=True)
+
+# 过期文件清理配置（只清理AUDIO_DIR、PROCESSED_DIR和TEMP_AUDIO_DIR顶层的文件，不进入子目录）
+CLEANUP_INTERVAL_MINUTES = int(os.getenv("CLEANUP_INTERVAL_MINUTES", 30))  # 清理间隔
+CLEANUP_FILE_TTL_HOURS = int(os.getenv("CLEANUP_FILE_TTL_HOURS", 24))      # 文件保留时长
+CLEANUP_BATCH_SIZE = int(os.getenv("CLEANUP_BATCH_SIZE", 100))            # 每批删除的文件数
+CLEANUP_PAUSE_MS = int(os.getenv("CLEANUP_PAUSE_MS", 50))                 # 批次之间的暂停时间
+
+# 调试用：把FreeSwitch呼叫收到的PCM音频追加保存到./input/{call_id}.pcm
+DEBUG_DUMP_AUDIO = os.getenv("DEBUG_DUMP_AUDIO", "").lower() in ("1", "true", "yes")
 
 # ESP32音频参数设置
 ESP32_SAMPLE_RATE = int(os.getenv("ESP32_SAMPLE_RATE", 44100))  # ESP32使用的采样率，需匹配ESP32的I2S配置
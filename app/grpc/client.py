@@ -1,5 +1,9 @@
+import asyncio
 import logging
+import itertools
+from typing import Optional
 import grpc
+import grpc.aio
 
 from app.config import settings
 
@@ -11,76 +15,336 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+# 通道参数：每条连接允许的并发流数量及保活设置
+# use_local_subchannel_pool 保证池中每个通道使用独立的TCP连接，而不是共享全局子通道
+CHANNEL_OPTIONS = [
+    ("grpc.max_concurrent_streams", 100),
+    ("grpc.keepalive_time_ms", 30000),
+    ("grpc.use_local_subchannel_pool", 1),
+    # 允许空闲时发送保活ping，使常驻连接池在请求间隔期间不被断开
+    ("grpc.keepalive_permit_without_calls", 1),
+    ("grpc.http2.max_pings_without_data", 0),
+    ("grpc.http2.min_time_between_pings_ms", 10000),
+    # 增大HTTP/2帧和流控窗口，减少大消息传输时的WINDOW_UPDATE往返
+    ("grpc.http2.max_frame_size", (1 << 24) - 1),
+    ("grpc.http2.lookahead_bytes", 4 * 1024 * 1024),
+    ("grpc.max_send_message_length", settings.GRPC_MAX_MESSAGE_LENGTH),
+    ("grpc.max_receive_message_length", settings.GRPC_MAX_MESSAGE_LENGTH),
+]
+
+class ChannelPool:
+    """gRPC通道池，多条HTTP/2连接轮询使用，避免单连接的队头阻塞和并发流上限"""
+
+    def __init__(self, target, pool_size=4, options=None):
+        """初始化通道池，为每个通道预先创建stub"""
+        self.target = target
+        self.options = options or CHANNEL_OPTIONS
+        self.channels = [
+            grpc.aio.insecure_channel(target, options=self.options)
+            for _ in range(max(1, pool_size))
+        ]
+        self.stubs = [service_pb2_grpc.MessageServiceStub(channel) for channel in self.channels]
+        self._cycle = itertools.cycle(self.stubs)
+
+    def next_stub(self):
+        """轮询获取下一个stub"""
+        return next(self._cycle)
+
+    async def close(self):
+        """关闭所有通道"""
+        for channel in self.channels:
+            await channel.close()
+
+class BatchStream:
+    """单条BatchStream双向流，多个逻辑请求复用该流，通过correlation_id对应响应"""
+
+    def __init__(self, stub):
+        """打开双向流并启动响应读取任务"""
+        self.closed = False
+        self._pending = {}
+        self._counter = itertools.count()
+        self._write_lock = asyncio.Lock()
+        self._call = stub.BatchStream()
+        self._reader = asyncio.create_task(self._read_loop())
+
+    @property
+    def in_flight(self):
+        """当前等待响应的请求数量"""
+        return len(self._pending)
+
+    async def _read_loop(self):
+        """读取响应并唤醒对应的等待方"""
+        error = None
+        try:
+            while True:
+                response = await self._call.read()
+                if response is grpc.aio.EOF:
+                    break
+                future = self._pending.pop(response.correlation_id, None)
+                if future is not None and not future.done():
+                    future.set_result(response)
+        except grpc.RpcError as e:
+            error = e
+        
+        # 流已结束，通知所有仍在等待的请求
+        self.closed = True
+        pending = list(self._pending.values())
+        self._pending.clear()
+        for future in pending:
+            if not future.done():
+                future.set_exception(error or ConnectionError("BatchStream已关闭"))
+
+    async def submit(self, request):
+        """登记请求并写入流，返回等待响应的Future"""
+        if self.closed:
+            raise ConnectionError("BatchStream已关闭")
+        
+        # 先登记再写入，保证写入期间该流不会被视为空闲
+        request.correlation_id = str(next(self._counter))
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request.correlation_id] = future
+        try:
+            async with self._write_lock:
+                await self._call.write(request)
+        except Exception:
+            self._pending.pop(request.correlation_id, None)
+            raise
+        return future
+
+    def discard(self, correlation_id):
+        """放弃等待指定请求的响应（例如超时）"""
+        self._pending.pop(correlation_id, None)
+
+    async def close(self):
+        """结束请求流"""
+        if self.closed:
+            return
+        self.closed = True
+        async with self._write_lock:
+            await self._call.done_writing()
+
+class StreamPool:
+    """BatchStream流池，按在途请求数量动态增减流"""
+
+    def __init__(self, channel_pool, max_in_flight=64):
+        """初始化流池，流在首次使用时创建"""
+        self.channel_pool = channel_pool
+        self.max_in_flight = max_in_flight
+        self.min_streams = len(channel_pool.channels)
+        self._streams = []
+
+    def _acquire(self):
+        """选择在途请求最少的流，全部繁忙时新建一条"""
+        self._streams = [stream for stream in self._streams if not stream.closed]
+        
+        available = [stream for stream in self._streams if stream.in_flight < self.max_in_flight]
+        if available:
+            return min(available, key=lambda stream: stream.in_flight)
+        
+        stream = BatchStream(self.channel_pool.next_stub())
+        self._streams.append(stream)
+        return stream
+
+    async def _shrink(self):
+        """关闭超出最小数量的空闲流"""
+        idle = [stream for stream in self._streams if stream.in_flight == 0]
+        for stream in idle[:max(0, len(self._streams) - self.min_streams)]:
+            self._streams.remove(stream)
+            await stream.close()
+
+    async def put_and_await(self, request, timeout=None):
+        """通过池中的流发送请求并等待响应"""
+        stream = self._acquire()
+        future = await stream.submit(request)
+        await self._shrink()
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            stream.discard(request.correlation_id)
+            raise
+
+    async def close(self):
+        """关闭所有流"""
+        streams, self._streams = self._streams, []
+        for stream in streams:
+            await stream.close()
+
+class RequestBatcher:
+    """在短时间窗口内合并并发的发送请求，通过一次SendMessageBatch调用发出"""
+
+    def __init__(self, channel_pool, window=0.001, timeout=10.0):
+        """初始化合并器，后台任务在首次提交时启动"""
+        self.channel_pool = channel_pool
+        self.window = window
+        self.timeout = timeout
+        self._queue = asyncio.Queue()
+        self._task = None
+
+    def submit(self, request):
+        """提交请求，返回等待响应的Future，后台任务未启动或已退出时重新启动"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((request, future))
+        return future
+
+    async def _run(self):
+        """等待首个请求后停顿一个窗口，再取出队列中积累的全部请求一并发送"""
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            await asyncio.sleep(self.window)
+            
+            batch = [item]
+            stopping = False
+            for _ in range(self._queue.qsize()):
+                item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            
+            await self._send_batch(batch)
+            if stopping:
+                return
+
+    async def _send_batch(self, batch):
+        """发送一批请求并将响应逐一分发给等待方，任何异常都只让本批请求失败，不会结束后台任务"""
+        request = service_pb2.BatchMessageRequest(requests=[request for request, _ in batch])
+        try:
+            response = await self.channel_pool.next_stub().SendMessageBatch(request, timeout=self.timeout)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        responses = response.responses
+        if len(responses) < len(batch):
+            logger.error(f"SendMessageBatch响应数量不足: 请求 {len(batch)} 个, 响应 {len(responses)} 个")
+        for index, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+            if index < len(responses):
+                future.set_result(responses[index])
+            else:
+                future.set_exception(ConnectionError("SendMessageBatch缺少对应的响应"))
+
+    async def close(self):
+        """停止后台任务，已入队的请求会先被发送"""
+        task, self._task = self._task, None
+        if task is not None and not task.done():
+            self._queue.put_nowait(None)
+            await task
+
 class GrpcClient:
     """gRPC客户端示例"""
     
-    def __init__(self, host="localhost", port=None):
+    def __init__(self, host="localhost", port=None, pool_size=4, timeout=10.0, batch_window=0.001):
         """初始化客户端"""
         self.port = port or settings.GRPC_PORT
-        self.channel = grpc.insecure_channel(f"{host}:{self.port}")
-        self.stub = service_pb2_grpc.MessageServiceStub(self.channel)
+        self.timeout = timeout
+        self.pool = ChannelPool(f"{host}:{self.port}", pool_size=pool_size)
+        self.streams = StreamPool(self.pool)
+        self.batcher = RequestBatcher(self.pool, window=batch_window, timeout=timeout)
     
-    def send_message(self, content, broadcast=False):
-        """发送消息"""
+    async def _call_batch_stream(self, request):
+        """通过复用流发送请求，将响应中的状态码转换为返回值"""
         try:
-            request = service_pb2.MessageRequest(
-                content=content,
-                broadcast=broadcast
-            )
-            response = self.stub.SendMessage(request)
-            return response
+            response = await self.streams.put_and_await(request, self.timeout)
         except grpc.RpcError as e:
             logger.error(f"gRPC错误: {e.code()}: {e.details()}")
             return None
+        except Exception as e:
+            logger.error(f"gRPC复用流错误: {str(e)}")
+            return None
+        
+        if response.code != grpc.StatusCode.OK.value[0]:
+            logger.error(f"gRPC错误: {response.code}: {response.details}")
+            return None
+        return response.response
     
-    def get_message(self, message_id):
-        """获取消息"""
+    async def send_message(self, content, broadcast=False):
+        """发送消息，并发的发送请求会被合并为一次批量调用"""
+        request = service_pb2.MessageRequest(
+            content=content,
+            broadcast=broadcast
+        )
         try:
-            request = service_pb2.GetMessageRequest(message_id=message_id)
-            response = self.stub.GetMessage(request)
-            return response
+            return await asyncio.wait_for(self.batcher.submit(request), self.timeout)
         except grpc.RpcError as e:
             logger.error(f"gRPC错误: {e.code()}: {e.details()}")
             return None
+        except asyncio.TimeoutError:
+            logger.error("gRPC批量发送超时")
+            return None
+        except Exception as e:
+            logger.error(f"gRPC批量发送失败: {str(e)}")
+            return None
+    
+    async def get_message(self, message_id):
+        """获取消息"""
+        request = service_pb2.BatchRequest(
+            get=service_pb2.GetMessageRequest(message_id=message_id)
+        )
+        return await self._call_batch_stream(request)
     
-    def stream_messages(self, count=5):
+    async def stream_messages(self, count=5):
         """接收流式消息"""
         try:
             request = service_pb2.StreamRequest(count=count)
-            responses = self.stub.StreamMessages(request)
-            
-            for response in responses:
+            async for response in self.pool.next_stub().StreamMessages(request):
                 yield response
                 
         except grpc.RpcError as e:
             logger.error(f"gRPC错误: {e.code()}: {e.details()}")
-            return None
     
-    def close(self):
+    async def close(self):
         """关闭连接"""
-        self.channel.close()
+        await self.batcher.close()
+        await self.streams.close()
+        await self.pool.close()
+
+# 进程级共享的客户端实例，需在事件循环中创建和使用
+_CLIENT: Optional[GrpcClient] = None
+
+def get_grpc_client() -> GrpcClient:
+    """获取进程级共享的gRPC客户端，首次调用时创建"""
+    global _CLIENT
+    if _CLIENT is None:
+        _CLIENT = GrpcClient()
+    return _CLIENT
+
+async def close_grpc_client():
+    """关闭共享的gRPC客户端（如果已创建）"""
+    global _CLIENT
+    if _CLIENT is not None:
+        client, _CLIENT = _CLIENT, None
+        await client.close()
 
-def example_usage():
+async def example_usage():
     """gRPC客户端使用示例"""
-    client = GrpcClient()
+    client = get_grpc_client()
     
     # 发送消息示例
     print("发送消息:")
-    response = client.send_message("Hello, gRPC!", broadcast=True)
+    response = await client.send_message("Hello, gRPC!", broadcast=True)
     print(f"响应: {response}")
     
     # 获取消息示例
     print("\n获取消息:")
-    response = client.get_message("msg_123456")
+    response = await client.get_message("msg_123456")
     print(f"响应: {response}")
     
     # 流式消息示例
     print("\n接收流式消息:")
-    for response in client.stream_messages(3):
+    async for response in client.stream_messages(3):
         print(f"流式响应: {response}")
     
     # 关闭连接
-    client.close()
+    await close_grpc_client()
 
 if __name__ == "__main__":
     # 配置日志
@@ -89,4 +353,4 @@ if __name__ == "__main__":
         format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
     )
     
-    example_usage() 
\ No newline at end of file
+    asyncio.run(example_usage())
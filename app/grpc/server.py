@@ -1,7 +1,8 @@
 import time
+import asyncio
 import logging
 import grpc
-from concurrent import futures
+import grpc.aio
 
 from app.config import settings
 
@@ -21,6 +22,14 @@ except ImportError:
             pass
         class MessageResponse:
             pass
+        class BatchRequest:
+            pass
+        class BatchResponse:
+            pass
+        class BatchMessageRequest:
+            pass
+        class BatchMessageResponse:
+            pass
     
     class service_pb2_grpc:
         class MessageServiceServicer:
@@ -33,17 +42,37 @@ logger = logging.getLogger(__name__)
 class MessageServicer(service_pb2_grpc.MessageServiceServicer):
     """gRPC服务实现"""
     
-    def SendMessage(self, request, context):
-        """实现发送消息方法"""
-        logger.info(f"收到发送消息请求: {request.content}")
+    def __init__(self, stream_interval=None):
+        """初始化服务，stream_interval为流式消息的发送间隔（秒）"""
+        if stream_interval is None:
+            stream_interval = settings.STREAM_INTERVAL_MS / 1000
+        self.stream_interval = stream_interval
         
-        # 创建响应
-        response = service_pb2.MessageResponse(
-            id="msg_" + str(int(time.time())),
-            content=request.content,
+        # 响应模板，固定字段只构造一次，每次调用复制后再填充可变字段
+        self._response_template = service_pb2.MessageResponse(
             created_at="2023-10-28T12:00:00Z",
             status="success"
         )
+    
+    async def SendMessage(self, request, context):
+        """实现发送消息方法"""
+        return self._create_message(request)
+    
+    async def SendMessageBatch(self, request, context):
+        """实现批量发送消息方法，响应顺序与请求一致"""
+        return service_pb2.BatchMessageResponse(
+            responses=[self._create_message(item) for item in request.requests]
+        )
+    
+    def _create_message(self, request):
+        """处理发送消息请求，供单次调用和复用流共用"""
+        logger.info(f"收到发送消息请求: {request.content}")
+        
+        # 基于模板创建响应
+        response = service_pb2.MessageResponse()
+        response.CopyFrom(self._response_template)
+        response.id = "msg_" + str(int(time.time()))
+        response.content = request.content
         
         # 如果是广播消息，可以在这里调用WebSocket连接管理器进行广播
         if request.broadcast:
@@ -53,8 +82,19 @@ class MessageServicer(service_pb2_grpc.MessageServiceServicer):
             
         return response
     
-    def GetMessage(self, request, context):
+    async def GetMessage(self, request, context):
         """实现获取消息方法"""
+        response = self._lookup_message(request)
+        if response is None:
+            # 设置gRPC错误
+            context.set_code(grpc.StatusCode.NOT_FOUND)
+            context.set_details(f"消息ID {request.message_id} 不存在")
+            return service_pb2.MessageResponse()
+            
+        return response
+    
+    def _lookup_message(self, request):
+        """查询消息，不存在时返回None"""
         logger.info(f"收到获取消息请求: {request.message_id}")
         
         # 这里可以从数据库查询消息
@@ -62,26 +102,61 @@ class MessageServicer(service_pb2_grpc.MessageServiceServicer):
         
         # 创建响应
         if request.message_id == "msg_123456":
-            response = service_pb2.MessageResponse(
+            return service_pb2.MessageResponse(
                 id=request.message_id,
                 content="示例消息内容",
                 created_at="2023-10-28T12:00:00Z",
                 status="success"
             )
-        else:
-            # 设置gRPC错误
-            context.set_code(grpc.StatusCode.NOT_FOUND)
-            context.set_details(f"消息ID {request.message_id} 不存在")
-            return service_pb2.MessageResponse()
-            
-        return response
+        return None
+    
+    async def BatchStream(self, request_iterator, context):
+        """实现双向复用流，按correlation_id逐条返回响应"""
+        async for request in request_iterator:
+            yield self._handle_batch_request(request)
+    
+    def _handle_batch_request(self, request):
+        """将复用流中的单个请求分派到对应的处理方法"""
+        payload = request.WhichOneof("payload")
+        
+        if payload == "send":
+            return service_pb2.BatchResponse(
+                correlation_id=request.correlation_id,
+                response=self._create_message(request.send),
+                code=grpc.StatusCode.OK.value[0]
+            )
+        
+        if payload == "get":
+            response = self._lookup_message(request.get)
+            if response is None:
+                return service_pb2.BatchResponse(
+                    correlation_id=request.correlation_id,
+                    code=grpc.StatusCode.NOT_FOUND.value[0],
+                    details=f"消息ID {request.get.message_id} 不存在"
+                )
+            return service_pb2.BatchResponse(
+                correlation_id=request.correlation_id,
+                response=response,
+                code=grpc.StatusCode.OK.value[0]
+            )
+        
+        return service_pb2.BatchResponse(
+            correlation_id=request.correlation_id,
+            code=grpc.StatusCode.INVALID_ARGUMENT.value[0],
+            details="复用流请求缺少payload"
+        )
     
-    def StreamMessages(self, request, context):
+    async def StreamMessages(self, request, context):
         """实现流式响应方法"""
         logger.info(f"收到流式消息请求，数量: {request.count}")
         
         # 生成指定数量的消息
         for i in range(request.count):
+            # 客户端已取消时停止生成
+            if context.cancelled():
+                logger.info("流式消息请求已被客户端取消")
+                return
+            
             # 创建响应
             response = service_pb2.MessageResponse(
                 id=f"msg_{i}",
@@ -91,28 +166,51 @@ class MessageServicer(service_pb2_grpc.MessageServiceServicer):
             )
             
             yield response
-            time.sleep(0.5)  # 间隔发送
+            await asyncio.sleep(self.stream_interval)  # 间隔发送
+
+# 服务端通道参数，与客户端的帧大小、流控窗口和消息大小上限保持一致
+SERVER_OPTIONS = [
+    ("grpc.http2.max_frame_size", (1 << 24) - 1),
+    ("grpc.http2.lookahead_bytes", 4 * 1024 * 1024),
+    ("grpc.max_send_message_length", settings.GRPC_MAX_MESSAGE_LENGTH),
+    ("grpc.max_receive_message_length", settings.GRPC_MAX_MESSAGE_LENGTH),
+    # 接受客户端连接池在空闲期间发送的保活ping
+    ("grpc.keepalive_permit_without_calls", 1),
+    ("grpc.http2.min_ping_interval_without_data_ms", 10000),
+]
+
+# 运行中的gRPC服务器
+grpc_server = None
 
-def serve_grpc():
-    """启动gRPC服务器"""
+async def serve_grpc():
+    """启动gRPC服务器，运行在调用方的事件循环中"""
+    global grpc_server
+    
     # 创建gRPC服务器
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    grpc_server = grpc.aio.server(options=SERVER_OPTIONS)
     
     # 添加服务实现
     service_pb2_grpc.add_MessageServiceServicer_to_server(
-        MessageServicer(), server
+        MessageServicer(), grpc_server
     )
     
     # 添加安全凭证（如需要）
     # credentials = grpc.ssl_server_credentials(...)
-    # server.add_secure_port(f'[::]:{settings.GRPC_PORT}', credentials)
+    # grpc_server.add_secure_port(f'[::]:{settings.GRPC_PORT}', credentials)
     
     # 添加不安全端口（开发环境）
-    server.add_insecure_port(f'[::]:{settings.GRPC_PORT}')
+    grpc_server.add_insecure_port(f'[::]:{settings.GRPC_PORT}')
     
     # 启动服务器
     logger.info(f"gRPC服务器启动在端口 {settings.GRPC_PORT}")
-    server.start()
+    await grpc_server.start()
     
     # 保持服务器运行
-    server.wait_for_termination() 
\ No newline at end of file
+    await grpc_server.wait_for_termination()
+
+async def stop_grpc(grace=5.0):
+    """停止gRPC服务器，等待进行中的调用完成"""
+    global grpc_server
+    if grpc_server is not None:
+        await grpc_server.stop(grace)
+        grpc_server = None
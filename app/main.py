@@ -1,20 +1,31 @@
+import queue
+import asyncio
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 
 from app.config import settings
-from app.api.routes import router as api_router
+from app.api.routes import router as api_router, load_whisper_model, load_qwen_model, load_uncensored_model
 from app.services import init_services
+from app.grpc.client import close_grpc_client
+from app.grpc.server import serve_grpc, stop_grpc
+from app.utils.cleanup import sweep_loop
 
-# 配置日志
+# 配置日志：请求路径上只把日志记录放入队列，由后台线程写控制台和文件
+log_formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+console_handler = logging.StreamHandler()  # 输出到控制台
+console_handler.setFormatter(log_formatter)
+file_handler = RotatingFileHandler('app.log', maxBytes=10*1024*1024, backupCount=5)  # 轮转日志文件
+file_handler.setFormatter(log_formatter)
+
+log_queue = queue.Queue(-1)
+log_listener = QueueListener(log_queue, console_handler, file_handler, respect_handler_level=True)
 logging.basicConfig(
     level=getattr(logging, settings.LOG_LEVEL),
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.StreamHandler(),  # 输出到控制台
-        RotatingFileHandler('app.log', maxBytes=10*1024*1024, backupCount=5)  # 轮转日志文件
-    ]
+    handlers=[QueueHandler(log_queue)]
 )
+log_listener.start()
 
 # 获取应用日志记录器
 logger = logging.getLogger("app")
@@ -24,11 +35,26 @@ app = FastAPI(
     title="model access server",
     description="支持REST API的模型访问服务器",
     version="0.1.0",
+    default_response_class=ORJSONResponse,
 )
 
 # 注册REST API路由
 app.include_router(api_router, prefix=settings.API_PREFIX)
 
+# 可在启动时预加载的模型
+MODEL_LOADERS = {
+    "whisper": load_whisper_model,
+    "qwen": load_qwen_model,
+    "uncensored": load_uncensored_model,
+}
+
+# 过期文件清理任务
+sweeper_task = None
+# 与FastAPI共用事件循环的gRPC服务任务
+grpc_task = None
+# 模型预加载任务
+preload_tasks = []
+
 @app.on_event("startup")
 async def startup_event():
     """应用启动时执行的操作"""
@@ -37,12 +63,47 @@ async def startup_event():
     # 初始化服务目录
     init_services()
     
+    # 启动过期文件定期清理任务
+    global sweeper_task, grpc_task
+    sweeper_task = asyncio.create_task(sweep_loop())
+    
+    # 在同一事件循环中启动gRPC服务
+    grpc_task = asyncio.create_task(serve_grpc())
+    
+    # 在后台线程中预加载模型，首个请求无需等待模型加载
+    for name in settings.PRELOAD_MODELS:
+        if name == "deepseek":
+            # DeepSeek依赖vLLM，仅在配置了预加载时才导入
+            from app.services.deepseek_service import warm_models
+            preload_tasks.append(asyncio.create_task(warm_models()))
+            continue
+        loader = MODEL_LOADERS.get(name)
+        if loader is None:
+            logger.warning(f"未知的预加载模型: {name}")
+            continue
+        preload_tasks.append(asyncio.create_task(asyncio.to_thread(loader)))
+    
     logger.info(f"REST API available at http://localhost:{settings.APP_PORT}{settings.API_PREFIX}")
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """应用关闭时执行的操作"""
     logger.info("Shutting down application...")
+    
+    # 停止过期文件清理任务
+    if sweeper_task is not None:
+        sweeper_task.cancel()
+    
+    # 关闭共享的gRPC客户端连接池
+    await close_grpc_client()
+    
+    # 停止gRPC服务
+    await stop_grpc()
+    if grpc_task is not None:
+        grpc_task.cancel()
+    
+    # 停止日志后台线程，写完队列中剩余的日志
+    log_listener.stop()
 
 # def main():
 #     """应用主入口"""
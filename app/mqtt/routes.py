@@ -1,12 +1,14 @@
-import json
+import io
+import orjson
 import logging
 import os
 import uuid
 import asyncio
+import socket
 import time
-from queue import Queue
-from typing import Dict, Set
-from fastapi import APIRouter, WebSocket
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 import paho.mqtt.client as mqtt
 from paho.mqtt.client import MQTTv5
 from app.utils.audio import save_raw_to_wav, get_touch_audio_data
@@ -15,11 +17,21 @@ router = APIRouter()
 logger = logging.getLogger(__name__)
 
 # ===== 前端WebSocket连接管理 =====
-frontend_clients: Dict[str, WebSocket] = {}
-session_to_client: Dict[str, str] = {}
-client_to_session: Dict[str, str] = {}
-session_audio_buffers: Dict[str, bytearray] = {}
-pending_sessions: Set[str] = set()
+@dataclass(slots=True)
+class Session:
+    """前端会话状态，一个会话对应一个前端WebSocket连接"""
+    ws: WebSocket
+    client_id: str
+    audio_buf: io.BytesIO = field(default_factory=io.BytesIO)
+    pending: bool = False  # 是否有等待AI后端处理的请求
+    # AI后端分块返回的音频，缓存直到收到done消息
+    incoming_chunks: Dict[int, bytes] = field(default_factory=dict)
+    last_activity: float = field(default_factory=time.monotonic)  # 最近一次收到前端消息或收到AI后端消息的时间
+
+sessions: Dict[str, Session] = {}
+SESSION_IDLE_TIMEOUT = 300  # 会话空闲超时（秒），超时后由清理任务回收
+SESSION_SWEEP_INTERVAL = 60  # 空闲会话清理间隔（秒）
+session_sweeper_task: Optional[asyncio.Task] = None
 
 # ===== MQTT配置 =====
 MQTT_BROKER = os.environ.get("MQTT_BROKER", "localhost")
@@ -27,14 +39,38 @@ MQTT_PORT = int(os.environ.get("MQTT_PORT", "1883"))
 MQTT_CLIENT_ID = f"secretgarden_proxy_{uuid.uuid4().hex[:8]}"
 MQTT_TOPICS = {
     "ai_audio": "secretgarden/ai/audio/+",  # + 是通配符，表示任意会话ID
+    "ai_audio_chunk": "secretgarden/ai/audio/+/+",  # 分块音频: 会话ID/分块序号，最后以 done 结束
     "ai_text": "secretgarden/ai/text/+",
     "proxy_audio": "secretgarden/proxy/audio/",  # 发送到AI后端的音频数据
     "heartbeat": "secretgarden/heartbeat"
 }
-MQTT_QOS = 1  # 至少一次传递
+MQTT_QOS = 1  # 至少一次传递，用于文本、控制和心跳消息
+MQTT_QOS_AUDIO = 0  # 音频分块最多一次传递，省去每条消息的PUBACK往返；完整性由done消息中的分块数校验
+MQTT_MAX_INFLIGHT = 200  # QoS>0消息的在途窗口，paho默认仅20条
+MQTT_AUDIO_CHUNK_SIZE = 4096  # 音频分块发布的块大小，避免单条大消息在代理端分片
+
+# ===== 固定内容的前端消息，预先序列化避免每次发送时重复序列化 =====
+def _frame(message_type, content):
+    """序列化一条发往前端的消息"""
+    return orjson.dumps({"type": message_type, "content": content}).decode()
+
+STATUS_DONE = _frame("status", "处理完成")
+STATUS_CANCELLED = _frame("status", "处理请求已取消")
+ERR_MQTT_INIT_FAILED = _frame("error", "MQTT客户端初始化失败")
+ERR_MISSING_CLIENT_TYPE = _frame("error", "缺少客户端类型标识")
+ERR_FRONTEND_ONLY = _frame("error", "MQTT模式只支持前端客户端连接")
+ERR_NO_MQTT = _frame("error", "MQTT服务未连接，无法发送音频数据")
+ERR_NO_AUDIO = _frame("error", "没有接收到音频数据")
+ERR_TOUCH_AUDIO = _frame("error", "无法加载触摸音效")
+# 会话信息结构固定，session_id和client_id仅含ASCII字符，直接格式化即可
+SESSION_INFO_TEMPLATE = '{{"type": "session_info", "content": {{"session_id": "{session_id}", "client_id": "{client_id}", "mode": "mqtt"}}}}'
+# 发往AI后端的取消命令和音频结束消息同样只替换动态字段
+CANCEL_COMMAND_TEMPLATE = '{{"command": "cancel_processing", "session_id": "{session_id}"}}'
+AUDIO_DONE_TEMPLATE = b'{"done": true, "chunks": %d}'
 
-# 存储从MQTT接收的消息的队列
-mqtt_message_queue = Queue()
+# 存储从MQTT接收的消息的队列，由paho线程通过事件循环的线程安全接口投递
+mqtt_message_queue: asyncio.Queue = asyncio.Queue()
+mqtt_loop: Optional[asyncio.AbstractEventLoop] = None
 mqtt_client = None
 mqtt_connected = False
 
@@ -44,8 +80,14 @@ def on_mqtt_connect(client, userdata, flags, rc, properties=None):
     if rc == 0:
         mqtt_connected = True
         logger.info("已连接到MQTT代理")
+        # 关闭Nagle算法，避免小的控制消息被延迟发送（每次重连都会创建新的socket）
+        try:
+            client.socket().setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (AttributeError, OSError) as e:
+            logger.warning(f"设置MQTT socket TCP_NODELAY失败: {e}")
         # 订阅音频和文本主题
-        client.subscribe(MQTT_TOPICS["ai_audio"], qos=MQTT_QOS)
+        client.subscribe(MQTT_TOPICS["ai_audio"], qos=MQTT_QOS_AUDIO)
+        client.subscribe(MQTT_TOPICS["ai_audio_chunk"], qos=MQTT_QOS_AUDIO)
         client.subscribe(MQTT_TOPICS["ai_text"], qos=MQTT_QOS)
         client.subscribe(MQTT_TOPICS["heartbeat"], qos=MQTT_QOS)
     else:
@@ -68,48 +110,42 @@ def on_mqtt_disconnect(client, userdata, rc, properties=None):
 def on_mqtt_message(client, userdata, message):
     """MQTT消息接收回调"""
     try:
-        # 解析主题以确定消息类型和会话ID
-        topic_parts = message.topic.split('/')
-        if len(topic_parts) < 3:
-            logger.warning(f"收到格式不正确的MQTT主题: {message.topic}")
-            return
-            
-        message_type = topic_parts[1]  # ai 或 proxy
-        data_type = topic_parts[2]     # audio 或 text
+        topic = message.topic
         
-        if len(topic_parts) > 3:
-            session_id = topic_parts[3]  # 会话ID
-        else:
-            session_id = None
-            
-        # 将消息放入队列，以便异步处理
-        mqtt_message_queue.put({
-            "message_type": message_type,
-            "data_type": data_type,
-            "session_id": session_id,
-            "payload": message.payload,
-            "timestamp": time.time()
-        })
+        # 按主题前缀查找处理函数，前缀之后的部分（会话ID及分块序号）原样交给处理函数
+        for prefix, handler in MQTT_DISPATCH:
+            if topic.startswith(prefix):
+                # 将(处理函数, 主题后缀, 负载)放入队列，以便异步处理（回调运行在paho线程中，需切换到事件循环线程）
+                mqtt_loop.call_soon_threadsafe(mqtt_message_queue.put_nowait, (handler, topic[len(prefix):], message.payload))
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"MQTT消息已入队: {topic}, 大小: {len(message.payload)} 字节")
+                return
         
-        if data_type != "heartbeat":  # 不记录心跳消息
-            logger.debug(f"MQTT消息已入队: {message_type}/{data_type}, 会话ID: {session_id}, 大小: {len(message.payload)} 字节")
+        logger.warning(f"收到未知的MQTT主题: {topic}")
     except Exception as e:
         logger.error(f"处理MQTT消息时出错: {str(e)}")
 
 def initialize_mqtt_client():
     """初始化MQTT客户端"""
-    global mqtt_client
+    global mqtt_client, mqtt_loop
     try:
+        # 记录事件循环，供paho线程中的回调投递消息
+        mqtt_loop = asyncio.get_running_loop()
+        
         # 创建MQTT客户端
         mqtt_client = mqtt.Client(client_id=MQTT_CLIENT_ID, protocol=MQTTv5)
         
+        # 扩大在途消息窗口，发送队列不限长度，避免代理响应慢时publish阻塞
+        mqtt_client.max_inflight_messages_set(MQTT_MAX_INFLIGHT)
+        mqtt_client.max_queued_messages_set(0)
+        
         # 设置回调
         mqtt_client.on_connect = on_mqtt_connect
         mqtt_client.on_disconnect = on_mqtt_disconnect
         mqtt_client.on_message = on_mqtt_message
         
         # 设置遗嘱消息（当客户端意外断开时发送）
-        will_msg = json.dumps({
+        will_msg = orjson.dumps({
             "status": "offline",
             "client_id": MQTT_CLIENT_ID,
             "timestamp": time.time()
@@ -134,7 +170,10 @@ def initialize_mqtt_client():
         return False
 
 async def publish_audio_to_mqtt(session_id, audio_data):
-    """通过MQTT发布音频数据到AI后端"""
+    """
+    通过MQTT发布音频数据到AI后端
+    音频按MQTT_AUDIO_CHUNK_SIZE分块发布到 {主题}/{序号}，最后在 {主题}/done 发送分块总数，由AI后端按序号重组
+    """
     if not mqtt_connected:
         logger.warning("MQTT未连接，无法发送音频数据")
         return False
@@ -143,79 +182,106 @@ async def publish_audio_to_mqtt(session_id, audio_data):
         # 构建完整的主题，包含会话ID
         topic = f"{MQTT_TOPICS['proxy_audio']}{session_id}"
         
-        # 发布音频数据
+        # 分块发布音频数据
+        chunk_count = 0
+        for i in range(0, len(audio_data), MQTT_AUDIO_CHUNK_SIZE):
+            mqtt_client.publish(
+                topic=f"{topic}/{chunk_count}",
+                payload=bytes(audio_data[i:i + MQTT_AUDIO_CHUNK_SIZE]),  # paho不接受memoryview
+                qos=MQTT_QOS_AUDIO
+            )
+            chunk_count += 1
+        
+        # 发送结束消息：done是AI后端开始重组和处理的控制消息，使用QoS 1保证送达；
+        # MQTT不保证不同主题之间的到达顺序，AI后端按done中的分块数校验完整性，而不是依赖到达顺序
         mqtt_client.publish(
-            topic=topic,
-            payload=audio_data,
+            topic=f"{topic}/done",
+            payload=AUDIO_DONE_TEMPLATE % chunk_count,
             qos=MQTT_QOS
         )
-        logger.info(f"已通过MQTT发送音频数据: {len(audio_data)} 字节, 会话ID: {session_id}")
+        logger.info(f"已通过MQTT发送音频数据: {len(audio_data)} 字节, {chunk_count} 个分块, 会话ID: {session_id}")
         return True
     except Exception as e:
         logger.error(f"通过MQTT发送音频数据失败: {str(e)}")
         return False
 
 async def process_mqtt_messages():
-    """异步处理MQTT消息队列中的消息"""
+    """异步处理MQTT消息队列中的消息，队列为空时挂起等待"""
     while True:
+        handler, topic_suffix, payload = await mqtt_message_queue.get()
         try:
-            # 检查队列是否有消息
-            if not mqtt_message_queue.empty():
-                message = mqtt_message_queue.get()
-                
-                message_type = message["message_type"]
-                data_type = message["data_type"]
-                session_id = message["session_id"]
-                payload = message["payload"]
-                
-                # 处理不同类型的消息
-                if message_type == "ai" and session_id:
-                    if data_type == "audio":
-                        # 处理来自AI后端的音频数据
-                        await handle_mqtt_audio_message(session_id, payload)
-                    elif data_type == "text":
-                        # 处理来自AI后端的文本消息
-                        try:
-                            text_data = json.loads(payload)
-                            await handle_mqtt_text_message(session_id, text_data)
-                        except json.JSONDecodeError:
-                            logger.error("无法解析MQTT文本消息的JSON内容")
-                elif data_type == "heartbeat":
-                    # 处理心跳消息
-                    if mqtt_client:
-                        mqtt_client.publish(
-                            topic=f"{MQTT_TOPICS['heartbeat']}_ack",
-                            payload=json.dumps({"timestamp": time.time()}),
-                            qos=0
-                        )
-                
-                # 标记消息已处理
-                mqtt_message_queue.task_done()
-            
-            # 短暂休眠以避免CPU占用过高
-            await asyncio.sleep(0.01)
+            await handler(topic_suffix, payload)
         except Exception as e:
             logger.error(f"处理MQTT消息时出错: {str(e)}")
-            await asyncio.sleep(1)  # 出错时稍微长一点的休眠
+        finally:
+            # 标记消息已处理
+            mqtt_message_queue.task_done()
+
+async def dispatch_ai_audio(topic_suffix, payload):
+    """处理来自AI后端的音频数据，主题后缀为 会话ID 或 会话ID/分块序号"""
+    session_id, _, chunk = topic_suffix.partition("/")
+    if not session_id:
+        return
+    if chunk:
+        await handle_mqtt_audio_chunk(session_id, chunk, payload)
+    else:
+        await handle_mqtt_audio_message(session_id, payload)
+
+async def dispatch_ai_text(session_id, payload):
+    """处理来自AI后端的文本消息，主题后缀为会话ID"""
+    if not session_id:
+        return
+    try:
+        text_data = orjson.loads(payload)
+    except orjson.JSONDecodeError:
+        logger.error("无法解析MQTT文本消息的JSON内容")
+        return
+    await handle_mqtt_text_message(session_id, text_data)
+
+async def dispatch_heartbeat(topic_suffix, payload):
+    """处理心跳消息"""
+    if mqtt_client:
+        mqtt_client.publish(
+            topic=f"{MQTT_TOPICS['heartbeat']}_ack",
+            payload=orjson.dumps({"timestamp": time.time()}),
+            qos=0
+        )
 
 async def handle_mqtt_audio_message(session_id, audio_data):
     """处理从MQTT接收的音频数据"""
-    if session_id in session_to_client:
-        client_id = session_to_client[session_id]
-        
-        if client_id in frontend_clients:
-            frontend_ws = frontend_clients[client_id]
-            
-            try:
-                # 直接转发音频数据到前端WebSocket
-                await frontend_ws.send_bytes(audio_data)
-                logger.info(f"已将MQTT音频数据转发至前端客户端 {client_id}, 大小: {len(audio_data)} 字节")
-            except Exception as e:
-                logger.error(f"向前端发送MQTT音频数据失败: {str(e)}")
-        else:
-            logger.warning(f"找不到客户端ID: {client_id}")
-    else:
+    session = sessions.get(session_id)
+    if session is None:
         logger.warning(f"转发MQTT音频数据失败,找不到会话ID: {session_id}")
+        return
+    
+    session.last_activity = time.monotonic()
+    try:
+        # 直接转发音频数据到前端WebSocket
+        await session.ws.send_bytes(audio_data)
+        logger.info(f"已将MQTT音频数据转发至前端客户端 {session.client_id}, 大小: {len(audio_data)} 字节")
+    except Exception as e:
+        logger.error(f"向前端发送MQTT音频数据失败: {str(e)}")
+
+async def handle_mqtt_audio_chunk(session_id, chunk, payload):
+    """缓存AI后端分块返回的音频，收到done消息后按序号重组并转发"""
+    session = sessions.get(session_id)
+    if session is None:
+        logger.warning(f"缓存MQTT分块音频失败,找不到会话ID: {session_id}")
+        return
+    
+    session.last_activity = time.monotonic()
+    chunks = session.incoming_chunks
+    if chunk != "done":
+        chunks[int(chunk)] = payload
+        return
+    
+    session.incoming_chunks = {}
+    expected = orjson.loads(payload).get("chunks", len(chunks))
+    if len(chunks) != expected:
+        logger.warning(f"MQTT分块音频不完整: 收到 {len(chunks)}/{expected} 个分块, 会话ID: {session_id}")
+    
+    audio_data = b"".join(chunks[index] for index in sorted(chunks))
+    await handle_mqtt_audio_message(session_id, audio_data)
 
 async def handle_mqtt_text_message(session_id, data):
     """处理从MQTT接收的文本消息"""
@@ -223,68 +289,96 @@ async def handle_mqtt_text_message(session_id, data):
         logger.warning("MQTT文本消息缺少type字段")
         return
         
-    if session_id in session_to_client:
-        client_id = session_to_client[session_id]
-        
-        if client_id in frontend_clients:
-            frontend_ws = frontend_clients[client_id]
+    session = sessions.get(session_id)
+    if session is None:
+        logger.warning(f"转发MQTT文本消息失败,找不到会话ID: {session_id}")
+        return
+    
+    session.last_activity = time.monotonic()
+    try:
+        if data["type"] == "text":
+            # 文本消息
+            await session.ws.send_text(orjson.dumps({
+                "type": "text",
+                "content": data["content"]
+            }).decode())
+        elif data["type"] == "processing_complete":
+            # 处理完成消息
+            session.pending = False
             
+            # 通知前端处理完成
+            await session.ws.send_text(STATUS_DONE)
+        
+        logger.info(f"已将MQTT文本消息转发至前端客户端 {session.client_id}")
+    except Exception as e:
+        logger.error(f"向前端发送MQTT文本消息失败: {str(e)}")
+
+# MQTT主题前缀到处理函数的分发表
+MQTT_DISPATCH = (
+    ("secretgarden/ai/audio/", dispatch_ai_audio),
+    ("secretgarden/ai/text/", dispatch_ai_text),
+    (MQTT_TOPICS["heartbeat"], dispatch_heartbeat),
+)
+
+def publish_cancel(session_id):
+    """通知AI后端取消会话正在处理的请求"""
+    try:
+        mqtt_client.publish(
+            topic=f"secretgarden/ai/control/{session_id}",
+            payload=CANCEL_COMMAND_TEMPLATE.format(session_id=session_id),
+            qos=MQTT_QOS
+        )
+    except Exception as e:
+        logger.warning(f"发送取消命令失败: {str(e)}, 会话ID: {session_id}")
+
+async def sweep_idle_sessions():
+    """定期回收长时间既没有收到前端消息、也没有收到AI后端消息的会话，防止异常断开的连接残留缓冲区"""
+    while True:
+        await asyncio.sleep(SESSION_SWEEP_INTERVAL)
+        now = time.monotonic()
+        expired = [
+            session_id for session_id, session in sessions.items()
+            if now - session.last_activity > SESSION_IDLE_TIMEOUT
+        ]
+        for session_id in expired:
+            session = sessions.pop(session_id, None)
+            if session is None:
+                continue
+            logger.info(f"回收空闲会话(MQTT模式): 客户端ID={session.client_id}, 会话ID={session_id}")
+            # 会话已从表中移除，处理协程的清理不会再发送取消命令，由这里通知AI后端停止处理
+            if session.pending and mqtt_connected:
+                publish_cancel(session_id)
             try:
-                if data["type"] == "text":
-                    # 文本消息
-                    await frontend_ws.send_text(json.dumps({
-                        "type": "text",
-                        "content": data["content"]
-                    }))
-                elif data["type"] == "processing_complete":
-                    # 处理完成消息
-                    if session_id in pending_sessions:
-                        pending_sessions.remove(session_id)
-                    
-                    # 通知前端处理完成
-                    await frontend_ws.send_text(json.dumps({
-                        "type": "status",
-                        "content": "处理完成"
-                    }))
-                
-                logger.info(f"已将MQTT文本消息转发至前端客户端 {client_id}")
-            except Exception as e:
-                logger.error(f"向前端发送MQTT文本消息失败: {str(e)}")
-        else:
-            logger.warning(f"找不到客户端ID: {client_id}")
-    else:
-        logger.warning(f"转发MQTT文本消息失败,找不到会话ID: {session_id}")
+                await session.ws.close()
+            except Exception:
+                pass
 
 @router.websocket("/mqtt_proxy")
 async def mqtt_proxy_websocket_endpoint(websocket: WebSocket):
     """MQTT版本的WebSocket端点，只处理前端客户端连接，后端通过MQTT通信"""
+    global session_sweeper_task
     await websocket.accept()
     
     # 启动MQTT客户端
     if not mqtt_client:
         mqtt_initialized = initialize_mqtt_client()
         if not mqtt_initialized:
-            await websocket.send_text(json.dumps({
-                "type": "error",
-                "content": "MQTT客户端初始化失败"
-            }))
+            await websocket.send_text(ERR_MQTT_INIT_FAILED)
             await websocket.close()
             return
     
-    # 启动MQTT消息处理任务
-    mqtt_processor_task = asyncio.create_task(process_mqtt_messages())
+    # 启动空闲会话清理任务
+    if session_sweeper_task is None or session_sweeper_task.done():
+        session_sweeper_task = asyncio.create_task(sweep_idle_sessions())
     
     try:
         # 等待连接标识消息
         init_message = await websocket.receive_text()
         logger.info(f"初始化消息: {init_message}")
-        init_data = json.loads(init_message)
+        init_data = orjson.loads(init_message)
         
         if "client_type" not in init_data:
-            await websocket.send_text(json.dumps({
-                "type": "error",
-                "content": "缺少客户端类型标识"
-            }))
+            await websocket.send_text(ERR_MISSING_CLIENT_TYPE)
             await websocket.close()
             return
             
@@ -292,10 +386,7 @@ async def mqtt_proxy_websocket_endpoint(websocket: WebSocket):
         
         if client_type != "frontend":
             # MQTT模式只支持前端客户端
-            await websocket.send_text(json.dumps({
-                "type": "error",
-                "content": "MQTT模式只支持前端客户端连接"
-            }))
+            await websocket.send_text(ERR_FRONTEND_ONLY)
             await websocket.close()
             return
             
@@ -303,98 +394,86 @@ async def mqtt_proxy_websocket_endpoint(websocket: WebSocket):
         client_id = f"client_{id(websocket)}"
         session_id = str(uuid.uuid4())
         
-        # 记录映射关系
-        frontend_clients[client_id] = websocket
-        session_to_client[session_id] = client_id
-        client_to_session[client_id] = session_id
-        
-        # 初始化音频缓冲区
-        session_audio_buffers[session_id] = bytearray()
+        # 记录会话（包含音频缓冲区）
+        session = Session(ws=websocket, client_id=client_id)
+        sessions[session_id] = session
         
         logger.info(f"前端客户端已连接(MQTT模式): ID={client_id}, 会话ID={session_id}")
         
-        # 向前端发送会话信息
-        await websocket.send_text(json.dumps({
-            "type": "session_info",
-            "content": {
-                "session_id": session_id,
-                "client_id": client_id,
-                "mode": "mqtt"
-            }
-        }))
+        # 启动MQTT消息处理任务
+        mqtt_processor_task = asyncio.create_task(process_mqtt_messages())
         
         try:
+            # 向前端发送会话信息（放在try内，发送失败时会话同样会被清理）
+            await websocket.send_text(SESSION_INFO_TEMPLATE.format(session_id=session_id, client_id=client_id))
+            
             # 监听来自前端的消息
             while True:
                 try:
                     message = await websocket.receive()
+                    session.last_activity = time.monotonic()
                     
                     # 检查消息类型
+                    if message["type"] == "websocket.disconnect":
+                        logger.info(f"前端客户端断开连接(MQTT模式): {client_id}")
+                        break
+                    
                     if "bytes" in message:
                         # 接收音频数据块
                         audio_data = message["bytes"]
-                        session_audio_buffers[session_id].extend(audio_data)
+                        session.audio_buf.write(audio_data)
                         
                     elif "text" in message:
                         # 解析JSON消息
                         try:
-                            data = json.loads(message["text"])
+                            data = orjson.loads(message["text"])
                             
                             if "command" in data:
                                 command = data["command"]
                                 
                                 if command == "audio_complete":
                                     # 前端发送完所有音频数据
-                                    if len(session_audio_buffers[session_id]) > 0:
-                                        logger.info(f"前端音频传输完成，准备通过MQTT转发，总大小: {len(session_audio_buffers[session_id])} 字节")
-                                        wav_file_path = await save_raw_to_wav(session_audio_buffers[session_id])
-                                        logger.info(f"音频数据已保存为WAV文件: {wav_file_path}")
-
-                                        # 通过MQTT发送音频数据
-                                        complete_audio_data = bytes(session_audio_buffers[session_id])
+                                    audio_buffer = session.audio_buf
+                                    if audio_buffer.tell() > 0:
+                                        logger.info(f"前端音频传输完成，准备通过MQTT转发，总大小: {audio_buffer.tell()} 字节")
                                         
-                                        # 发送数据
-                                        mqtt_sent = await publish_audio_to_mqtt(session_id, complete_audio_data)
+                                        # 使用缓冲区的memoryview，保存和发送都不复制整段音频
+                                        # WAV写盘在线程池中执行，与MQTT发送并行进行
+                                        with audio_buffer.getbuffer() as audio_view:
+                                            wav_file_path, mqtt_sent = await asyncio.gather(
+                                                save_raw_to_wav(audio_view),
+                                                publish_audio_to_mqtt(session_id, audio_view)
+                                            )
+                                        logger.info(f"音频数据已保存为WAV文件: {wav_file_path}")
                                         
                                         if not mqtt_sent:
-                                            await websocket.send_text(json.dumps({
-                                                "type": "error",
-                                                "content": "MQTT服务未连接，无法发送音频数据"
-                                            }))
+                                            await websocket.send_text(ERR_NO_MQTT)
                                             continue
                                         
                                         # 加入等待处理队列
-                                        pending_sessions.add(session_id)
+                                        session.pending = True
                                         
                                         # 清空缓冲区，准备下一次录音
-                                        session_audio_buffers[session_id] = bytearray()
+                                        audio_buffer.seek(0)
+                                        audio_buffer.truncate(0)
                                         
                                     else:
-                                        await websocket.send_text(json.dumps({
-                                            "type": "error",
-                                            "content": "没有接收到音频数据"
-                                        }))
+                                        await websocket.send_text(ERR_NO_AUDIO)
                                 
                                 elif command == "cancel_processing":
                                     # 取消正在处理的请求
-                                    if session_id in pending_sessions:
+                                    if session.pending:
                                         # 通知AI后端取消处理
                                         if mqtt_connected:
                                             mqtt_client.publish(
                                                 topic=f"secretgarden/ai/control/{session_id}",
-                                                payload=json.dumps({
-                                                    "command": "cancel_processing",
-                                                    "session_id": session_id
-                                                }),
+                                                payload=CANCEL_COMMAND_TEMPLATE.format(session_id=session_id),
                                                 qos=MQTT_QOS
                                             )
                                             
-                                        pending_sessions.remove(session_id)
+                                        session.pending = False
                                         
-                                        await websocket.send_text(json.dumps({
-                                            "type": "status",
-                                            "content": "处理请求已取消"
-                                        }))
+                                        await websocket.send_text(STATUS_CANCELLED)
                                         
                                 elif command == "touch":
                                     # 触摸事件处理
@@ -404,20 +483,13 @@ async def mqtt_proxy_websocket_endpoint(websocket: WebSocket):
                                     audio_data = await get_touch_audio_data(amount)
                                     
                                     if audio_data:
-                                        # 发送音频数据，分块发送
-                                        chunk_size = 5120  # 大约5KB
-                                        for i in range(0, len(audio_data), chunk_size):
-                                            audio_chunk = audio_data[i:i+chunk_size]
-                                            await websocket.send_bytes(audio_chunk)
-                                            await asyncio.sleep(0.05)  # 短暂延迟，控制发送速率
+                                        # 一次性发送完整音频，由TCP自行控制发送速率
+                                        await websocket.send_bytes(audio_data)
                                         logger.info(f"触摸音频发送完成，总大小: {len(audio_data)} 字节")
                                     else:
-                                        await websocket.send_text(json.dumps({
-                                            "type": "error",
-                                            "content": "无法加载触摸音效"
-                                        }))
+                                        await websocket.send_text(ERR_TOUCH_AUDIO)
                                     
-                        except json.JSONDecodeError:
+                        except orjson.JSONDecodeError:
                             logger.error("无法解析前端发送的JSON消息")
                 except WebSocketDisconnect:
                     logger.info(f"前端客户端断开连接(MQTT模式): {client_id}")
@@ -429,36 +501,11 @@ async def mqtt_proxy_websocket_endpoint(websocket: WebSocket):
             logger.error(f"前端客户端连接错误(MQTT模式): {str(e)}, 出错行号: {line_number}")
         finally:
             # 清理前端客户端资源
-            if client_id in frontend_clients:
-                del frontend_clients[client_id]
+            session = sessions.pop(session_id, None)
             
-            if client_id in client_to_session:
-                session_id = client_to_session[client_id]
-                
-                # 如果会话还在处理队列中，通知AI后端取消处理
-                if session_id in pending_sessions and mqtt_connected:
-                    try:
-                        mqtt_client.publish(
-                            topic=f"secretgarden/ai/control/{session_id}",
-                            payload=json.dumps({
-                                "command": "cancel_processing",
-                                "session_id": session_id
-                            }),
-                            qos=MQTT_QOS
-                        )
-                    except:
-                        pass
-                        
-                    pending_sessions.remove(session_id)
-                
-                # 清理会话相关资源
-                if session_id in session_to_client:
-                    del session_to_client[session_id]
-                
-                if session_id in session_audio_buffers:
-                    del session_audio_buffers[session_id]
-                    
-                del client_to_session[client_id]
+            # 如果会话还在处理队列中，通知AI后端取消处理
+            if session is not None and session.pending and mqtt_connected:
+                publish_cancel(session_id)
             
             logger.info(f"前端客户端资源已清理(MQTT模式): {client_id}")
             
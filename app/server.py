@@ -1,19 +1,27 @@
+import queue
 import logging
+from logging.handlers import QueueHandler, QueueListener
 from fastapi import FastAPI
 from app.config import settings
 from app.services import init_services
 import os
 from dotenv import load_dotenv
 
-# 配置日志
+# 配置日志：请求路径上只把日志记录放入队列，由后台线程写控制台和文件
+log_formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+console_handler = logging.StreamHandler()  # 输出到控制台
+console_handler.setFormatter(log_formatter)
+file_handler = logging.FileHandler('websocket.log')  # 输出到单独的日志文件
+file_handler.setFormatter(log_formatter)
+
+log_queue = queue.Queue(-1)
+log_listener = QueueListener(log_queue, console_handler, file_handler, respect_handler_level=True)
 logging.basicConfig(
     level=getattr(logging, settings.LOG_LEVEL),
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.StreamHandler(),  # 输出到控制台
-        logging.FileHandler('websocket.log')  # 输出到单独的日志文件
-    ]
+    handlers=[QueueHandler(log_queue)]
 )
+log_listener.start()
+
 logger = logging.getLogger("websocket")
 
 # 加载.env文件
@@ -31,11 +39,11 @@ COMMUNICATION_MODE = os.getenv("COMMUNICATION_MODE", "websocket").lower()
 if COMMUNICATION_MODE == "mqtt":
     from app.mqtt.routes import router as mqtt_router
     ws_app.include_router(mqtt_router)
-    print("已启用MQTT通信模式，前端可连接到 /mqtt_proxy 端点")
+    logger.info("已启用MQTT通信模式，前端可连接到 /mqtt_proxy 端点")
 else:
     from app.websocket.routes import router as ws_router
     ws_app.include_router(ws_router, prefix=settings.WEBSOCKET_PATH)
-    print("已启用WebSocket通信模式，前端可连接到 /ws/proxy 端点")
+    logger.info("已启用WebSocket通信模式，前端可连接到 /ws/proxy 端点")
 
 @ws_app.on_event("startup")
 async def startup_event():
@@ -47,3 +55,6 @@ async def startup_event():
 @ws_app.on_event("shutdown")
 async def shutdown_event():
     logger.info("Shutting down WebSocket server...")
+    
+    # 停止日志后台线程，写完队列中剩余的日志
+    log_listener.stop()
@@ -7,7 +7,7 @@ import logging
 import traceback
 import torch
 from fastapi import HTTPException
-from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
+from transformers import AutoTokenizer
 from typing import List, Dict, Any
 import uuid
 from vllm import AsyncLLMEngine, SamplingParams
@@ -16,7 +16,7 @@ from vllm.engine.arg_utils import AsyncEngineArgs
 # 配置日志
 logger = logging.getLogger(__name__)
 
-# 全局变量存储加载的DeepSeek模型和tokenizer
+# 全局变量存储加载的DeepSeek-R1引擎和tokenizer
 model = None
 tokenizer = None
 loading = False
@@ -27,11 +27,11 @@ model_v3 = None
 tokenizer_v3 = None
 loading_v3 = False
 
-def load_model():
+async def load_model():
     """
-    加载DeepSeek-R1模型和tokenizer，只在第一次调用时初始化
+    使用vLLM加载DeepSeek-R1模型和tokenizer，只在第一次调用时初始化
     """
-    global model, tokenizer, loading, device
+    global model, tokenizer, loading
 
     # 避免并发初始化
     if loading:
@@ -42,7 +42,7 @@ def load_model():
         
     try:
         loading = True
-        logger.info("开始加载DeepSeek-R1模型...")
+        logger.info("使用vLLM加载DeepSeek-R1模型...")
         
         # 使用绝对路径加载本地模型
         model_path = "/data/api-secretgarden/models"
@@ -53,30 +53,30 @@ def load_model():
         n_gpus = torch.cuda.device_count()
         logger.info(f"可用 GPU 数量: {n_gpus}")
         
-        # 使用量化配置减少内存占用
-        quantization_config = BitsAndBytesConfig(
-            load_in_8bit=True,
-            llm_int8_threshold=6.0,
-            llm_int8_has_fp16_weight=False
+        # vLLM引擎配置，使用bitsandbytes 4bit量化减少显存占用
+        engine_args = AsyncEngineArgs(
+            model=model_path,
+            tokenizer=model_path,
+            trust_remote_code=True,
+            tensor_parallel_size=max(1, n_gpus),
+            quantization="bitsandbytes",
+            load_format="bitsandbytes",
+            dtype="bfloat16",
+            max_model_len=8192,
+            gpu_memory_utilization=0.9
         )
         
-        # 首先加载tokenizer
+        # 初始化异步引擎
+        model = AsyncLLMEngine.from_engine_args(engine_args)
+        
+        # 加载tokenizer用于模板处理
         tokenizer = AutoTokenizer.from_pretrained(
             model_path, 
             trust_remote_code=True,
             local_files_only=True
         )
         
-        # 加载模型，使用多 GPU 和量化减少内存占用
-        model = AutoModelForCausalLM.from_pretrained(
-            model_path,
-            trust_remote_code=True,
-            device_map=device,  # 自动分配到可用 GPU
-            quantization_config=quantization_config,
-            local_files_only=True
-        )
-        
-        logger.info(f"DeepSeek-R1模型已加载到多个 GPU")
+        logger.info("DeepSeek-R1模型(vLLM)加载完成")
         loading = False
         return True
     except Exception as e:
@@ -121,18 +121,45 @@ async def load_model_v3():
         )
         
         logger.info("DeepSeek-V3-0324模型(vLLM)加载完成")
+        loading_v3 = False
         return True
     except Exception as e:
         logger.error(f"vLLM加载失败: {str(e)}\n{traceback.format_exc()}")
         loading_v3 = False
         return False
 
+async def _generate(engine, engine_tokenizer, messages: List[Dict[str, str]], sampling_params: SamplingParams) -> str:
+    """
+    通过vLLM异步引擎生成回复，R1和V3共用
+    引擎内部使用分页KV缓存并对并发请求进行连续批处理
+    """
+    # 生成对话模板
+    input_text = engine_tokenizer.apply_chat_template(
+        messages,
+        tokenize=False,
+        add_generation_prompt=True
+    )
+
+    # 创建异步生成任务
+    result_generator = engine.generate(
+        input_text,
+        sampling_params,
+        request_id=str(uuid.uuid4())
+    )
+
+    # 流式获取结果
+    full_output = ""
+    async for output in result_generator:
+        full_output = output.outputs[0].text
+
+    return full_output.strip()
+
 async def chat_with_model(prompt: str, history: List[Dict[str, str]] = None, max_length: int = 2048, 
                          temperature: float = 0.7, top_p: float = 0.9) -> Dict[str, Any]:
     """
-    与DeepSeek模型进行对话
+    与DeepSeek-R1模型进行对话
     """
-    if not load_model():
+    if not await load_model():
         raise HTTPException(status_code=500, detail="无法加载DeepSeek-R1模型")
     
     try:
@@ -148,43 +175,25 @@ async def chat_with_model(prompt: str, history: List[Dict[str, str]] = None, max
         # 添加当前用户的消息
         messages.append({"role": "user", "content": prompt})
         
-        # 生成回复
-        with torch.no_grad():
-            # 准备输入
-            input_text = tokenizer.apply_chat_template(
-                messages, 
-                tokenize=False, 
-                add_generation_prompt=True
-            )
-            
-            # 编码输入
-            inputs = tokenizer(input_text, return_tensors="pt").to("cuda")
-            
-            # 生成回复
-            outputs = model.generate(
-                **inputs,
-                max_length=max_length,
-                temperature=temperature,
-                top_p=top_p,
-                do_sample=True,
-                pad_token_id=tokenizer.eos_token_id
-            )
-            
-            # 解码输出
-            full_response = tokenizer.batch_decode(outputs, skip_special_tokens=True)[0]
-            
-            # 提取模型的回复（去除输入部分）
-            assistant_response = full_response[len(input_text):].strip()
-            
-            # 更新历史
-            new_history = history.copy() if history else []
-            new_history.append({"role": "user", "content": prompt})
-            new_history.append({"role": "assistant", "content": assistant_response})
-            
-            return {
-                "response": assistant_response,
-                "history": new_history
-            }
+        # 配置采样参数，max_length作为生成token数上限
+        sampling_params = SamplingParams(
+            temperature=temperature,
+            top_p=top_p,
+            max_tokens=max_length,
+            skip_special_tokens=True
+        )
+        
+        assistant_response = await _generate(model, tokenizer, messages, sampling_params)
+        
+        # 更新历史
+        new_history = history.copy() if history else []
+        new_history.append({"role": "user", "content": prompt})
+        new_history.append({"role": "assistant", "content": assistant_response})
+        
+        return {
+            "response": assistant_response,
+            "history": new_history
+        }
             
     except Exception as e:
         logger.error(f"对话生成失败: {str(e)}")
@@ -213,13 +222,6 @@ async def chat_with_v30324(
             messages.extend(history)
         messages.append({"role": "user", "content": prompt})
 
-        # 生成对话模板
-        input_text = tokenizer_v3.apply_chat_template(
-            messages,
-            tokenize=False,
-            add_generation_prompt=True
-        )
-
         # 配置采样参数
         sampling_params = SamplingParams(
             temperature=temperature,
@@ -229,47 +231,42 @@ async def chat_with_v30324(
             skip_special_tokens=True
         )
 
-        # 创建异步生成任务
-        result_generator = model_v3.generate(
-            input_text, 
-            sampling_params,
-            request_id=str(uuid.uuid4())
-        )
-
-        # 流式获取结果
-        full_output = ""
-        async for output in result_generator:
-            full_output = output.outputs[0].text
+        response = await _generate(model_v3, tokenizer_v3, messages, sampling_params)
 
         # 构造返回结果
         return {
-            "response": full_output.strip(),
-            "history": messages + [{"role": "assistant", "content": full_output.strip()}]
+            "response": response,
+            "history": messages + [{"role": "assistant", "content": response}]
         }
 
     except Exception as e:
         logger.error(f"vLLM推理失败: {str(e)}\n{traceback.format_exc()}")
         raise HTTPException(status_code=500, detail="推理服务异常")
 
-def get_model_status():
+async def warm_models():
     """
-    获取所有模型状态
+    预加载DeepSeek-R1和DeepSeek-V3模型，在应用启动时调用
     """
-    global model, model_v3
-    # if model is None:
-    #     model = load_model()
-    if model_v3 is None:
-        model_v3 = load_model_v3()
+    await load_model()
+    await load_model_v3()
 
-    print(f"model: {model}, model_v3: {model_v3}")
+def _engine_status(engine, is_loading):
+    """根据全局变量返回单个引擎的状态"""
+    if is_loading:
+        return "loading"
+    return "ready" if engine is not None else "not_loaded"
 
+def get_model_status():
+    """
+    获取所有模型状态，只读取全局变量，不触发模型加载
+    """
     return {
         "deepseek-r1": {
-            "status": "ready" if model else "not_loaded",
+            "status": _engine_status(model, loading),
             "device": device
         },
         "deepseek-v3": {
-            "status": "ready" if model_v3 else "not_loaded",
+            "status": _engine_status(model_v3, loading_v3),
             "device": device
         }
-    }
\ No newline at end of file
+    }
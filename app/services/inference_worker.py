@@ -0,0 +1,118 @@
+"""
+推理任务调度
+同一模型的GPU推理由单个后台任务依次执行，请求处理协程只需提交任务并等待结果
+"""
+import asyncio
+import logging
+from app.config import settings
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+class InferenceWorker:
+    """
+    单消费者推理队列：保证同一模型同一时刻只有一个推理调用占用GPU，
+    推理在线程中执行，不阻塞事件循环，其他请求的音频解码、分词等预处理可以同时进行
+    """
+
+    def __init__(self, name):
+        """初始化推理队列，后台任务在首次提交时启动"""
+        self.name = name
+        self._queue = asyncio.Queue()
+        self._task = None
+
+    async def run(self, fn, *args, **kwargs):
+        """提交推理任务并等待结果"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._serve())
+
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((fn, args, kwargs, future))
+        return await future
+
+    async def _serve(self):
+        """依次取出推理任务，在线程中执行并把结果交给等待方"""
+        while True:
+            fn, args, kwargs, future = await self._queue.get()
+
+            # 等待方已取消（如客户端断开）时跳过
+            if future.cancelled():
+                continue
+
+            try:
+                result = await asyncio.to_thread(fn, *args, **kwargs)
+            except Exception as e:
+                logger.error(f"{self.name}推理任务失败: {str(e)}")
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+
+class BatchInferenceWorker:
+    """
+    动态批处理推理队列：收到第一个请求后最多再等待max_wait_ms，
+    把窗口内到达的请求（最多max_batch_size个）按生成参数分组，每组合并为一次推理调用
+
+    batch_fn(key, items)在线程中执行，需按items的顺序返回每个请求的结果
+    """
+
+    def __init__(self, name, batch_fn, max_batch_size=None, max_wait_ms=None):
+        """初始化批处理队列，后台任务在首次提交时启动"""
+        self.name = name
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size or settings.INFERENCE_MAX_BATCH_SIZE
+        self.max_wait = (settings.INFERENCE_MAX_WAIT_MS if max_wait_ms is None else max_wait_ms) / 1000
+        self._queue = asyncio.Queue()
+        self._task = None
+
+    async def run(self, item, key=None):
+        """提交单个请求并等待结果，只有key相同的请求才会合并到同一批"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._serve())
+
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((key, item, future))
+        return await future
+
+    async def _collect(self):
+        """等待第一个请求，然后在时间窗口内继续收集，直到达到批大小上限"""
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _serve(self):
+        """收集一批请求，按key分组后依次在线程中执行"""
+        while True:
+            batch = await self._collect()
+
+            groups = {}
+            for key, item, future in batch:
+                # 等待方已取消（如客户端断开）时跳过
+                if not future.cancelled():
+                    groups.setdefault(key, []).append((item, future))
+
+            for key, entries in groups.items():
+                try:
+                    results = await asyncio.to_thread(self.batch_fn, key, [item for item, _ in entries])
+                except Exception as e:
+                    logger.error(f"{self.name}批量推理失败(批大小 {len(entries)}): {str(e)}")
+                    for _, future in entries:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+
+                for (_, future), result in zip(entries, results):
+                    if not future.done():
+                        future.set_result(result)
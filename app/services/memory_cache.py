@@ -1,34 +1,60 @@
 import threading
-from collections import deque
+from collections import OrderedDict
 
 class MemoryCache:
     """
     内存缓存类，用于存储和访问聊天模型的历史聊天记录。
-    按照每个聊天会话的session_id为key保存，仅保存最近的20条聊天记录。
+    按照每个聊天会话的session_id为key保存，每个会话最多保留最近的20条聊天记录，且总token数不超过max_tokens，
+    同时保存每条记录的token数，淘汰时无需重新分词；会话数超过max_sessions时淘汰最久未写入的会话。
+    每个会话的记录保存为不可变元组，写入时整体替换（写时复制），读取无需加锁。
     """
+    max_messages = 20  # 每个会话保留的最大记录数
+    max_tokens = 1500  # 每个会话历史记录的最大token数
+    max_sessions = 1000  # 最多保留的会话数
+
     def __init__(self):
-        self.cache = {}  # 使用字典存储聊天记录，key为session_id，value为deque
-        self.lock = threading.Lock()  # 线程锁，确保线程安全
+        # 使用有序字典存储聊天记录，key为session_id，value为(记录元组, token数元组, 总token数)
+        # 写入时原地替换后移到末尾，最前面的即为最久未写入的会话；会话在写入过程中始终存在，不加锁的读取不会看到空记录
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()  # 线程锁，保证并发写入不丢失记录
 
-    def add_message(self, session_id, message):
+    def add_messages(self, session_id, messages, token_counts):
         """
-        添加一条聊天记录到指定会话。
+        添加一轮聊天记录到指定会话，超出条数或token上限时从最早的记录开始淘汰。
         :param session_id: 会话ID
-        :param message: 聊天记录
+        :param messages: 聊天记录列表
+        :param token_counts: 每条聊天记录的token数
         """
         with self.lock:
-            if session_id not in self.cache:
-                self.cache[session_id] = deque(maxlen=20)  # 使用deque限制最大长度为20
-            self.cache[session_id].append(message)
+            history, counts, total = self.cache.get(session_id, ((), (), 0))
+            history += tuple(messages)
+            counts += tuple(token_counts)
+            total += sum(token_counts)
+
+            # 淘汰最早的记录，并保证历史记录以用户消息开头
+            drop = 0
+            while drop < len(history) and (
+                len(history) - drop > self.max_messages
+                or total > self.max_tokens
+                or history[drop].get("role") != "user"
+            ):
+                total -= counts[drop]
+                drop += 1
+
+            self.cache[session_id] = (history[drop:], counts[drop:], total)
+            self.cache.move_to_end(session_id)
+
+            while len(self.cache) > self.max_sessions:
+                self.cache.popitem(last=False)
 
     def get_messages(self, session_id):
         """
         获取指定会话的聊天记录。
         :param session_id: 会话ID
-        :return: 聊天记录列表，如果会话不存在则返回空列表
+        :return: 聊天记录列表（新列表，调用方可直接追加），如果会话不存在则返回空列表
         """
-        with self.lock:
-            return list(self.cache.get(session_id, deque()))
+        # 元组不可变，读取到的引用即为一致的快照，无需加锁
+        return list(self.cache.get(session_id, ((),))[0])
 
     def clear_session(self, session_id):
         """
@@ -36,5 +62,4 @@ class MemoryCache:
         :param session_id: 会话ID
         """
         with self.lock:
-            if session_id in self.cache:
-                del self.cache[session_id] 
\ No newline at end of file
+            self.cache.pop(session_id, None)
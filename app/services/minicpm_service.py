@@ -2,96 +2,128 @@
 MiniCPM模型服务
 负责MiniCPM模型的加载、管理和使用
 """
+import asyncio
 import logging
 import traceback
 import torch
+import soundfile as sf
+import soxr
 from fastapi import HTTPException
 from transformers import AutoModel, AutoTokenizer
-import librosa
 from app.services.memory_cache import MemoryCache
+from app.services.inference_worker import InferenceWorker
+from app.services.model_registry import model_registry
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
-# 全局变量存储MiniCPM模型和相关组件
+# 全局变量存储MiniCPM模型和相关组件，模型和tokenizer由模型注册表加载
 model = None 
 tokenizer = None
-loading = False
 device = "auto" if torch.cuda.is_available() else "cpu"
 
 # 初始化缓存
 cache = MemoryCache()
 
+# GPU推理由单个后台任务依次执行
+inference_worker = InferenceWorker("MiniCPM-o")
+
+# 模型输入音频的采样率
+SAMPLING_RATE = 16000
+
+# 音频编码器每秒音频约产生的token数，用于估算历史记录中语音消息的token数
+AUDIO_TOKENS_PER_SECOND = 25
+
+def load_audio(audio_input, sampling_rate=SAMPLING_RATE):
+    """
+    使用soundfile直接解码音频，混合为单声道，仅在采样率不一致时重采样
+    """
+    data, sr = sf.read(audio_input, dtype="float32", always_2d=False)
+    if data.ndim == 2:
+        data = data.mean(axis=1)
+    if sr != sampling_rate:
+        data = soxr.resample(data, sr, sampling_rate, quality="QQ")
+    return data
+
+def _load_minicpm():
+    """
+    加载MiniCPM-o-2_6模型和tokenizer（由模型注册表调用，只执行一次）
+    """
+    # 加载MiniCPM-o-2_6模型
+    model_name = "openbmb/MiniCPM-o-2_6"
+
+    from accelerate import init_empty_weights, infer_auto_device_map
+    from accelerate.utils import get_balanced_memory
+    # 只在meta设备上构建模型结构用于计算设备映射，不分配实际权重
+    with init_empty_weights():
+        empty_model = AutoModel.from_pretrained(
+            model_name, trust_remote_code=True, 
+            attn_implementation='sdpa', torch_dtype=torch.bfloat16,
+            init_vision=False, init_audio=True, init_tts=True)
+    
+    # 按bf16权重大小计算设备映射，各GPU显存上限相同，由accelerate把各层均衡分配到所有GPU
+    no_split_module_classes = ['SiglipVisionTransformer', 'Qwen2DecoderLayer']
+    max_memory = get_balanced_memory(
+        empty_model, max_memory={i: "10GB" for i in range(torch.cuda.device_count())},
+        no_split_module_classes=no_split_module_classes, dtype=torch.bfloat16)
+    device_map = infer_auto_device_map(empty_model, max_memory=max_memory, dtype=torch.bfloat16,
+        no_split_module_classes=no_split_module_classes)
+    device_id = device_map["llm.model.embed_tokens"]
+    # 多模态嵌入在embed_tokens所在设备上合并，输入输出层、视觉和重采样模块放在同一设备
+    device_map["llm.lm_head"] = device_id
+    device_map["vpm"] = device_id
+    device_map["resampler"] = device_id
+
+    del empty_model
+
+    # 按设备映射一次性加载权重，直接放到目标设备上，不经过先初始化再拷贝的两阶段加载
+    model_path = "./minicpm"
+    model = AutoModel.from_pretrained(
+        model_path, trust_remote_code=True,
+        attn_implementation='sdpa', torch_dtype=torch.bfloat16,
+        low_cpu_mem_usage=True, device_map=device_map,
+        init_vision=False, init_audio=True, init_tts=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
+
+    model.init_tts()
+    model.tts.to(device_id)
+    model.tts.float()
+
+    model.eval()
+
+    logger.info(f"MiniCPM-o模型已加载到{sorted(set(device_map.values()), key=str)}")
+    return model, tokenizer
+
 def load_model():
     """
-    加载MiniCPM-o-2_6模型，只在第一次调用时初始化
+    加载MiniCPM-o-2_6模型，只在第一次调用时初始化，并发调用会等待同一次加载完成
+    （同步版本，供预加载线程使用）
     """
-    global model, tokenizer, loading, device
+    global model, tokenizer
     
-    # 避免并发初始化
-    if loading:
-        return False
-        
-    if model is not None and tokenizer is not None:
+    try:
+        model, tokenizer = model_registry.get_or_load("minicpm", _load_minicpm)
         return True
-        
+    except Exception:
+        return False
+
+async def ensure_model_loaded():
+    """
+    确保MiniCPM-o模型已加载，加载在线程中进行，不阻塞事件循环
+    """
+    global model, tokenizer
+    
     try:
-        loading = True
-        logger.info("开始加载MiniCPM-o模型...")
-        
-        # 加载MiniCPM-o-2_6模型
-        model_name = "openbmb/MiniCPM-o-2_6"
-
-        from accelerate import load_checkpoint_and_dispatch, init_empty_weights, infer_auto_device_map
-        with init_empty_weights():
-            model = AutoModel.from_pretrained(
-                model_name, trust_remote_code=True, 
-                attn_implementation='sdpa', torch_dtype=torch.bfloat16,
-                init_vision=False, init_audio=True, init_tts=True)
-        
-        device_map = infer_auto_device_map(model, max_memory={0: "10GB", 1: "10GB"},
-            no_split_module_classes=['SiglipVisionTransformer', 'Qwen2DecoderLayer'])
-        device_id = device_map["llm.model.embed_tokens"]
-        device_map["llm.lm_head"] = device_id # first and last layer should be in same device
-        device_map["vpm"] = device_id
-        device_map["resampler"] = device_id
-        device_id2 = device_map["llm.model.layers.26"]
-        device_map["llm.model.layers.8"] = device_id2
-        device_map["llm.model.layers.9"] = device_id2
-        device_map["llm.model.layers.10"] = device_id2
-        device_map["llm.model.layers.11"] = device_id2
-        device_map["llm.model.layers.12"] = device_id2
-        device_map["llm.model.layers.13"] = device_id2
-        device_map["llm.model.layers.14"] = device_id2
-        device_map["llm.model.layers.15"] = device_id2
-        device_map["llm.model.layers.16"] = device_id2
-        # print(device_map)
-
-
-        model_path = "./minicpm"
-        model = load_checkpoint_and_dispatch(model, model_path, dtype=torch.bfloat16, device_map=device_map)
-        tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
-
-        model.init_tts()
-        model.tts.to(device_id)
-        model.tts.float()
-
-        model.eval()
-
-        logger.info(f"MiniCPM-o模型已加载到{device_id}, {device_id2}")
-        loading = False
+        model, tokenizer = await model_registry.aget_or_load("minicpm", _load_minicpm)
         return True
-    except Exception as e:
-        logger.error(f"加载MiniCPM-o模型失败: {str(e)}")
-        logger.error(f"错误详情: {traceback.format_exc()}")
-        loading = False
+    except Exception:
         return False
 
 async def voice_chat(audio_input, ref_audio, output_audio_path, session_id, max_new_tokens=128, temperature=0.3):
     """
     使用MiniCPM模型进行语音对话，并保存聊天记录到缓存。
     """
-    if not load_model():
+    if not await ensure_model_loaded():
         raise HTTPException(status_code=500, detail="无法加载MiniCPM-o模型")
     
     try:
@@ -99,13 +131,13 @@ async def voice_chat(audio_input, ref_audio, output_audio_path, session_id, max_
         # sys_prompt = model.get_sys_prompt(ref_audio=None, mode='audio_roleplay', language='zh')
         # print("sys_prompt: ", sys_prompt)
 
-        # 获取历史聊天记录
-        history = cache.get_messages(session_id)
+        # 获取历史聊天记录（返回的是新列表，直接在其后追加当前问题）
+        msgs = cache.get_messages(session_id)
 
-        user_audio, _ = librosa.load(audio_input, sr=16000, mono=True)
+        # 在线程中解码音频，不阻塞事件循环
+        user_audio = await asyncio.to_thread(load_audio, audio_input)
         user_question = {'role': 'user', 'content': [user_audio]}
-        # msgs.extend(history)  # 将历史记录添加到当前消息中
-        msgs = history + [user_question]
+        msgs.append(user_question)
 
         params = {
             'sampling': True,
@@ -115,7 +147,8 @@ async def voice_chat(audio_input, ref_audio, output_audio_path, session_id, max_
             'repetition_penalty': 1.05,
             "max_new_tokens": 2048
         }
-        res = model.chat(
+        res = await inference_worker.run(
+            model.chat,
             image=None,
             msgs=msgs,
             tokenizer=tokenizer,
@@ -125,9 +158,14 @@ async def voice_chat(audio_input, ref_audio, output_audio_path, session_id, max_
             **params
         )
 
-        # 将当前对话添加到缓存
-        cache.add_message(session_id, user_question)
-        cache.add_message(session_id, {'role': 'assistant', 'content': res})
+        # 将当前对话及其token数添加到缓存，缓存按token上限淘汰最早的记录，控制下一轮的预填充长度
+        question_tokens = len(user_audio) * AUDIO_TOKENS_PER_SECOND // SAMPLING_RATE
+        answer_tokens = len(tokenizer.encode(res, add_special_tokens=False))
+        cache.add_messages(
+            session_id,
+            [user_question, {'role': 'assistant', 'content': res}],
+            [question_tokens, answer_tokens]
+        )
         
         return res
     except Exception as e:
@@ -139,17 +177,8 @@ def get_model_status():
     """
     获取MiniCPM模型的加载状态
     """
-    global model, tokenizer, loading
-    
-    if loading:
-        status = "loading"
-    elif model is not None and tokenizer is not None:
-        status = "ready"
-    else:
-        status = "not_loaded"
-    
     return {
-        "status": status,
+        "status": model_registry.status("minicpm"),
         "device": device,
         "gpu_available": torch.cuda.is_available(),
         "model": "openbmb/MiniCPM-o-2_6",
@@ -0,0 +1,79 @@
+"""
+模型注册表
+统一管理各服务加载的模型，保证同一模型在并发请求和启动预加载下只加载一次
+"""
+import asyncio
+import logging
+import threading
+import traceback
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+class ModelRegistry:
+    """
+    按名称保存已加载的模型，加载过程由每个模型各自的锁保护：
+    并发调用时只有第一个调用方执行加载，其余调用方等待并直接拿到同一个结果，
+    加载失败不会被缓存，下次调用会重新尝试
+    """
+
+    def __init__(self):
+        """初始化注册表"""
+        self._models = {}
+        self._loading = set()
+        self._locks = {}
+        self._async_locks = {}
+        self._locks_guard = threading.Lock()
+
+    def _get_lock(self, key):
+        """获取指定模型的线程锁，不存在时创建"""
+        with self._locks_guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def get_or_load(self, key, loader_fn):
+        """
+        获取已加载的模型，未加载时调用loader_fn加载（同步版本，会阻塞当前线程，供后台线程使用）
+        """
+        if key in self._models:
+            return self._models[key]
+
+        with self._get_lock(key):
+            # 等待锁期间可能已被其他调用方加载完成
+            if key in self._models:
+                return self._models[key]
+
+            self._loading.add(key)
+            try:
+                logger.info(f"开始加载模型: {key}")
+                self._models[key] = loader_fn()
+                logger.info(f"模型已加载: {key}")
+            except Exception as e:
+                logger.error(f"加载模型{key}失败: {str(e)}")
+                logger.error(f"错误详情: {traceback.format_exc()}")
+                raise
+            finally:
+                self._loading.discard(key)
+
+        return self._models[key]
+
+    async def aget_or_load(self, key, loader_fn):
+        """
+        获取已加载的模型，未加载时在线程中加载（异步版本，不阻塞事件循环）
+        同一事件循环中的并发调用方先在协程锁上排队，不会各自占用一个线程等待
+        """
+        if key in self._models:
+            return self._models[key]
+
+        async with self._async_locks.setdefault(key, asyncio.Lock()):
+            return await asyncio.to_thread(self.get_or_load, key, loader_fn)
+
+    def status(self, key):
+        """返回模型的加载状态: loading, ready 或 not_loaded"""
+        if key in self._loading:
+            return "loading"
+        if key in self._models:
+            return "ready"
+        return "not_loaded"
+
+# 全局共享的模型注册表
+model_registry = ModelRegistry()
@@ -3,85 +3,237 @@ Qwen模型服务
 负责Qwen模型的加载、管理和使用
 """
 import os
+import asyncio
 import logging
 import traceback
 import torch
 from fastapi import HTTPException
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import AutoModelForCausalLM, AutoTokenizer, StaticCache
+from transformers.utils import is_flash_attn_2_available
 from typing import List, Dict, Any
+from app.config import settings
+from app.services.inference_worker import BatchInferenceWorker
+from app.services.model_registry import model_registry
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
-# 全局变量
+# 全局变量，模型和tokenizer由模型注册表加载
 model = None
 tokenizer = None
-loading = False
 device = "auto" if torch.cuda.is_available() else "cpu"
 
-def load_model():
+# 编译后的模型按输入形状捕获CUDA图：KV缓存只分配一次，大小固定为(INFERENCE_MAX_BATCH_SIZE, 上下文长度)，
+# 每批补齐到INFERENCE_MAX_BATCH_SIZE个请求，提示词补齐到2的幂（最小512），只有少数几种预填充形状和一种解码形状需要编译
+MIN_PROMPT_BUCKET = 512
+
+# 单次生成的最大token数
+MAX_NEW_TOKENS = 8192
+# 生成长度分档：同一档的请求合并为一批，按批内最大的生成长度生成，再按各自的长度截断
+MAX_NEW_TOKENS_BUCKETS = (256, 1024, 2048, 4096, MAX_NEW_TOKENS)
+
+# 编译推理复用的静态KV缓存，首次生成时分配
+_static_cache = None
+
+def select_dtype():
     """
-    加载Qwen-QwQ-32B模型和tokenizer，只在第一次调用时初始化
+    选择模型权重的数据类型：Ampere(sm80)及以上的GPU使用bfloat16，其他GPU使用float16，CPU使用float32
     """
-    global model, tokenizer, loading, device
+    if not torch.cuda.is_available():
+        return torch.float32
+    major, _ = torch.cuda.get_device_capability()
+    if major >= 8 and torch.cuda.is_bf16_supported():
+        return torch.bfloat16
+    return torch.float16
 
+def select_attn_implementation(torch_dtype):
+    """
+    选择注意力实现：安装了flash-attn且为半精度时使用FlashAttention-2，否则使用PyTorch的SDPA
+    """
+    if torch_dtype in (torch.float16, torch.bfloat16) and is_flash_attn_2_available():
+        return "flash_attention_2"
+    return "sdpa"
+
+def _load_qwen():
+    """
+    加载Qwen-QwQ-32B模型和tokenizer（由模型注册表调用，只执行一次）
+    """
     model_name = "Qwen/QwQ-32B"
+    
+    torch_dtype = select_dtype()
+    model = AutoModelForCausalLM.from_pretrained(
+        model_name,
+        torch_dtype=torch_dtype,
+        attn_implementation=select_attn_implementation(torch_dtype),
+        device_map=device
+    )
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    
+    # 使用预分配的静态KV缓存时每步解码的形状固定，编译前向计算以减少每步的内核启动开销（FlashAttention-2不支持静态缓存）
+    if model.config._attn_implementation != "flash_attention_2":
+        model.forward = torch.compile(model.forward, mode="reduce-overhead", dynamic=False)
+    # 批量生成时在左侧补齐，保证所有提示词末尾对齐
+    tokenizer.padding_side = "left"
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
 
-    # 避免并发初始化
-    if loading:
-        return False
-        
-    if model is not None and tokenizer is not None:
-        return True
+    logger.info(f"Qwen-QwQ-32B模型已加载到{device.upper()}, 数据类型: {model.dtype}, 注意力实现: {model.config._attn_implementation}")
+    return model, tokenizer
+
+def load_model():
+    """
+    加载Qwen-QwQ-32B模型和tokenizer，只在第一次调用时初始化，并发调用会等待同一次加载完成
+    （同步版本，供预加载线程使用）
+    """
+    global model, tokenizer
     
     try:
-        loading = True
-        logger.info("开始加载Qwen-QwQ-32B模型...")
-
-        model = AutoModelForCausalLM.from_pretrained(
-            model_name,
-            torch_dtype="auto",
-            device_map=device
-        )
-        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model, tokenizer = model_registry.get_or_load("qwen", _load_qwen)
+        return True
+    except Exception:
+        return False
 
-        logger.info(f"Qwen-QwQ-32B模型已加载到{device.upper()}")
-        loading = False
+async def ensure_model_loaded():
+    """
+    确保Qwen模型已加载，加载在线程中进行，不阻塞事件循环
+    """
+    global model, tokenizer
+    
+    try:
+        model, tokenizer = await model_registry.aget_or_load("qwen", _load_qwen)
         return True
-    except Exception as e:
-        logger.error(f"加载Qwen-QwQ-32B模型失败: {str(e)}")
-        logger.error(f"错误详情: {traceback.format_exc()}")
-        loading = False
+    except Exception:
         return False
 
 def get_model_status():
     """
     获取Qwen模型的加载状态
     """
-    global model, tokenizer, loading
-    
-    if loading:
-        status = "loading"
-    elif model is not None and tokenizer is not None:
-        status = "ready"
-    else:
-        status = "not_loaded"
-    
     return {
-        "status": status,
+        "status": model_registry.status("qwen"),
         "device": device,
         "gpu_available": torch.cuda.is_available(),
         "model": "Qwen/QwQ-32B"
     }
 
+def uses_static_cache() -> bool:
+    """是否使用静态KV缓存和编译后的模型（FlashAttention-2不支持静态缓存，此时按实际长度补齐，不编译）"""
+    return model.config._attn_implementation != "flash_attention_2"
+
+def get_context_limit() -> int:
+    """模型的上下文长度（提示词加生成的token数上限），使用静态缓存时不超过缓存长度"""
+    limit = min(
+        tokenizer.model_max_length,
+        getattr(model.config, "max_position_embeddings", tokenizer.model_max_length)
+    )
+    if uses_static_cache():
+        limit = min(limit, settings.QWEN_STATIC_CACHE_LEN)
+    return limit
+
+def get_static_cache() -> StaticCache:
+    """
+    获取编译推理复用的静态KV缓存，首次调用时按(INFERENCE_MAX_BATCH_SIZE, 上下文长度)分配
+    模型分布在多张GPU上时，每层的缓存放在该层所在的设备
+    """
+    global _static_cache
+    
+    if _static_cache is None:
+        kwargs = {}
+        layer_devices = {index: layer.self_attn.o_proj.weight.device for index, layer in enumerate(model.model.layers)}
+        if len(set(layer_devices.values())) > 1:
+            kwargs["layer_device_map"] = layer_devices
+        _static_cache = StaticCache(
+            config=model.config,
+            max_batch_size=settings.INFERENCE_MAX_BATCH_SIZE,
+            max_cache_len=get_context_limit(),
+            device=model.device,
+            dtype=model.dtype,
+            **kwargs
+        )
+    return _static_cache
+
+def bucket_new_tokens(max_new_tokens: int) -> int:
+    """把生成长度向上取整到MAX_NEW_TOKENS_BUCKETS中的一档"""
+    return next(bucket for bucket in MAX_NEW_TOKENS_BUCKETS if bucket >= max_new_tokens)
+
+def prepare_inputs(messages: List[Dict[str, str]], max_new_tokens: int) -> List[int]:
+    """
+    套用对话模板并直接编码为token（CPU操作，在线程中执行）
+    若编码后的长度加上生成长度超过模型上下文长度，从最早的历史消息开始丢弃，最后一条（当前用户消息）始终保留
+    """
+    prompt_budget = get_context_limit() - max_new_tokens
+    
+    while True:
+        input_ids = tokenizer.apply_chat_template(messages, tokenize=True, add_generation_prompt=True)
+        if len(input_ids) <= prompt_budget or len(messages) == 1:
+            return input_ids
+        messages = messages[1:]
+
+def bucket_length(length, prompt_budget):
+    """
+    把提示词长度向上取整到2的幂，最小为MIN_PROMPT_BUCKET
+    不超过提示词可用的长度（上下文长度减去生成长度），避免补齐后超出上下文或成倍增加预填充计算
+    """
+    return max(length, min(max(MIN_PROMPT_BUCKET, 1 << (length - 1).bit_length()), prompt_budget))
+
+def generate_batch(params, batch):
+    """
+    在GPU上批量生成回复，返回每个请求新生成部分的token（由批处理队列调用）
+    params为同一批共用的(生成长度分档, temperature, top_p)，batch中每项为(input_ids, 该请求的生成长度)
+    """
+    _, temperature, top_p = params
+    batch_input_ids = [input_ids for input_ids, _ in batch]
+    max_new_tokens = max(request_tokens for _, request_tokens in batch)
+    generate_kwargs = {}
+    
+    # 左侧补齐后合并为一个批次
+    if uses_static_cache():
+        # 批次补齐到固定大小（重复第一个提示词，多出的结果丢弃），提示词补齐到分桶长度，
+        # 每次生成复用同一个缓存，输入形状只有少数几种，已编译的图和CUDA图可以复用
+        batch_input_ids = batch_input_ids + [batch_input_ids[0]] * (settings.INFERENCE_MAX_BATCH_SIZE - len(batch_input_ids))
+        max_length = bucket_length(max(len(input_ids) for input_ids in batch_input_ids), get_context_limit() - max_new_tokens)
+        inputs = tokenizer.pad({"input_ids": batch_input_ids}, padding="max_length", max_length=max_length, return_tensors="pt")
+        cache = get_static_cache()
+        cache.reset()
+        generate_kwargs["past_key_values"] = cache
+    else:
+        inputs = tokenizer.pad({"input_ids": batch_input_ids}, padding=True, return_tensors="pt")
+    inputs = inputs.to("cuda")
+    # SDPA只使用flash和memory-efficient内核，不回退到逐元素计算的math实现
+    with torch.inference_mode(), torch.backends.cuda.sdp_kernel(enable_flash=True, enable_mem_efficient=True, enable_math=False):
+        outputs = model.generate(
+            **inputs,
+            max_new_tokens=max_new_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            do_sample=True,
+            use_cache=True,
+            pad_token_id=tokenizer.pad_token_id,
+            **generate_kwargs
+        )
+    
+    # 左侧补齐后所有提示词长度一致，其后即为新生成的部分，按各请求自己的生成长度截断
+    prompt_length = inputs.input_ids.shape[1]
+    return [
+        output_ids[prompt_length:prompt_length + request_tokens].cpu()
+        for output_ids, (_, request_tokens) in zip(outputs, batch)
+    ]
+
+# GPU推理由单个后台任务按批执行
+inference_worker = BatchInferenceWorker("Qwen", generate_batch)
+
 async def chat_with_model(prompt: str, history: List[Dict[str, str]] = None, max_length: int = 2048, 
                          temperature: float = 0.7, top_p: float = 0.9) -> Dict[str, Any]:
     """
     与Qwen模型进行对话
     """
-    if not load_model():
+    if not await ensure_model_loaded():
         raise HTTPException(status_code=500, detail="无法加载Qwen模型")
     
+    # 生成长度超出上限时截断，同一档生成长度的请求合并为一批
+    max_length = max(1, min(max_length, MAX_NEW_TOKENS))
+    new_tokens_bucket = bucket_new_tokens(max_length)
+    
     try:
         # 处理历史记录格式
         messages = []
@@ -95,48 +247,23 @@ async def chat_with_model(prompt: str, history: List[Dict[str, str]] = None, max
         # 添加当前用户的消息
         messages.append({"role": "user", "content": prompt})
         
-        # 生成回复
-        with torch.no_grad():
-            # 准备输入
-            input_text = tokenizer.apply_chat_template(
-                messages, 
-                tokenize=False, 
-                add_generation_prompt=True
-            )
-            
-            # 编码输入
-            inputs = tokenizer(input_text, return_tensors="pt").to("cuda")
-            
-            # 生成回复
-            outputs = model.generate(
-                **inputs,
-                max_length=max_length,
-                temperature=temperature,
-                top_p=top_p,
-                do_sample=True,
-                pad_token_id=tokenizer.eos_token_id
-            )
-
-            generated_ids = [
-                output_ids[len(input_ids):] for input_ids, output_ids in zip(inputs.input_ids, outputs)
-            ]
-
-            
-            # 解码输出
-            full_response = tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0]
-            
-            # 提取模型的回复（去除输入部分）
-            assistant_response = full_response[len(input_text):].strip()
-            
-            # 更新历史
-            new_history = history.copy() if history else []
-            new_history.append({"role": "user", "content": prompt})
-            new_history.append({"role": "assistant", "content": assistant_response})
-            
-            return {
-                "response": assistant_response,
-                "history": new_history
-            }
+        # 在线程中准备输入，在批处理队列中生成回复
+        # 按分档的生成长度预留上下文，同一批按其中最大的生成长度生成时也不会超出缓存
+        input_ids = await asyncio.to_thread(prepare_inputs, messages, new_tokens_bucket)
+        generated_ids = await inference_worker.run((input_ids, max_length), key=(new_tokens_bucket, temperature, top_p))
+        
+        # 只解码新生成的部分即为模型的回复
+        assistant_response = (await asyncio.to_thread(tokenizer.decode, generated_ids, skip_special_tokens=True)).strip()
+        
+        # 更新历史
+        new_history = history.copy() if history else []
+        new_history.append({"role": "user", "content": prompt})
+        new_history.append({"role": "assistant", "content": assistant_response})
+        
+        return {
+            "response": assistant_response,
+            "history": new_history
+        }
             
     except Exception as e:
         logger.error(f"对话生成失败: {str(e)}")
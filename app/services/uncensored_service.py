@@ -1,17 +1,21 @@
+import os
+import asyncio
+import functools
 import logging
-import traceback
 import torch
 from fastapi import HTTPException
 from transformers import AutoTokenizer, LlamaForCausalLM, BitsAndBytesConfig
+from transformers.utils import is_flash_attn_2_available
 import json
+from app.services.inference_worker import BatchInferenceWorker
+from app.services.model_registry import model_registry
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
-# 全局变量
+# 全局变量，模型和tokenizer由模型注册表加载
 model = None
 tokenizer = None
-loading = False
 device = "auto" if torch.cuda.is_available() else "cpu"
 
 # 检查Gryphe/MythoMax-L2-13b模型加载状态
@@ -19,96 +23,92 @@ def get_uncensored_status():
     """
     检查Gryphe/MythoMax-L2-13b模型加载状态
     """
-    global model, tokenizer, loading
-    
-    if loading:
-        status = "loading"
-    elif model is not None and tokenizer is not None:
-        status = "ready"
-    else:
-        status = "not_loaded"
-    
     return {
-        "status": status,
+        "status": model_registry.status("uncensored"),
         "device": device,
         "gpu_available": torch.cuda.is_available(),
         "model": "Gryphe/MythoMax-L2-13b"
     }
 
-def load_uncensored_model():
+def _load_uncensored():
     """
-    加载Gryphe/MythoMax-L2-13b模型
+    加载Gryphe/MythoMax-L2-13b模型和tokenizer（由模型注册表调用，只执行一次）
     """
-    global model, tokenizer, loading, device
-
     # model_name = "Gryphe/MythoMax-L2-13b"
     model_name = "Austism/chronos-hermes-13b"
 
-    # 避免并发初始化
-    if loading:
-        return False
+    # 使用4bit NF4量化减少显存占用，避免8bit逐层反量化带来的生成变慢
+    quantization_config = BitsAndBytesConfig(
+        load_in_4bit=True,
+        bnb_4bit_quant_type="nf4",
+        bnb_4bit_compute_dtype=torch.float16,
+        bnb_4bit_use_double_quant=True
+    )
 
-    if model is not None and tokenizer is not None:
-        return True
+    # 4bit后13B模型可放入单卡，全部权重放在同一GPU上，避免跨卡拷贝
+    model = LlamaForCausalLM.from_pretrained(
+        model_name,
+        trust_remote_code=True,
+        device_map={"": torch.cuda.current_device()} if torch.cuda.is_available() else device,
+        quantization_config=quantization_config,
+        # 安装了flash-attn时使用FlashAttention-2，否则使用PyTorch的SDPA
+        attn_implementation="flash_attention_2" if is_flash_attn_2_available() else "sdpa",
+        low_cpu_mem_usage=True
+    )
+    tokenizer = AutoTokenizer.from_pretrained(
+        model_name,
+        trust_remote_code=True,
+        device_map=device
+    )
+    # 使用预分配的静态KV缓存，避免每步生成重新分配缓存（FlashAttention-2不支持静态缓存）
+    if model.config._attn_implementation != "flash_attention_2":
+        model.generation_config.cache_implementation = "static"
+
+    # 批量生成时在左侧补齐，Llama没有pad token，使用eos代替
+    tokenizer.padding_side = "left"
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
+    logger.info(f"Gryphe/MythoMax-L2-13b模型已加载到{device.upper()}")
+    return model, tokenizer
+
+def load_uncensored_model():
+    """
+    加载Gryphe/MythoMax-L2-13b模型，并发调用会等待同一次加载完成（同步版本，供预加载线程使用）
+    """
+    global model, tokenizer
 
     try:
-        loading = True
-        logger.info("开始加载Gryphe/MythoMax-L2-13b模型...")
-
-        # 使用量化配置减少内存占用
-        quantization_config = BitsAndBytesConfig(
-            load_in_8bit=True,
-            llm_int8_threshold=6.0,
-            llm_int8_has_fp16_weight=False
-        )
+        model, tokenizer = model_registry.get_or_load("uncensored", _load_uncensored)
+        return True
+    except Exception:
+        return False
 
-        model = LlamaForCausalLM.from_pretrained(
-            model_name,
-            trust_remote_code=True,
-            device_map=device,
-            quantization_config=quantization_config
-        )
-        tokenizer = AutoTokenizer.from_pretrained(
-            model_name,
-            trust_remote_code=True,
-            device_map=device
-        )
+async def ensure_model_loaded():
+    """
+    确保Gryphe/MythoMax-L2-13b模型已加载，加载在线程中进行，不阻塞事件循环
+    """
+    global model, tokenizer
 
-        logger.info(f"Gryphe/MythoMax-L2-13b模型已加载到{device.upper()}")
-        loading = False
+    try:
+        model, tokenizer = await model_registry.aget_or_load("uncensored", _load_uncensored)
         return True
-    except Exception as e:
-        logger.error(f"加载Gryphe/MythoMax-L2-13b模型失败: {str(e)}")
-        logger.error(f"错误详情: {traceback.format_exc()}")
-        loading = False
+    except Exception:
         return False
 
 async def chat_with_uncensored(prompt: str):
     """
     与Gryphe/MythoMax-L2-13b模型进行对话（异步版本）
     """
-    global model, tokenizer, device
-
-    if not load_uncensored_model():
+    if not await ensure_model_loaded():
         raise HTTPException(status_code=500, detail="无法加载Gryphe/MythoMax-L2-13b模型")
 
-    # 将输入移动到CUDA设备
-    prompt = generate_prompt(prompt)
-    print("final instruction: ", prompt)
-    inputs = tokenizer(prompt, return_tensors="pt")
-    inputs = inputs.to("cuda")
-    
-    # 生成回复
-    generate_ids = model.generate(
-        inputs.input_ids, 
-        max_new_tokens=350, 
-        do_sample=True, 
-        repetition_penalty=1.4, 
-        temperature=0.35, 
-        top_p=0.75, 
-        top_k=40
+    # 在线程中构建提示词并编码，在批处理队列中生成回复
+    input_ids = await asyncio.to_thread(prepare_inputs, prompt)
+    generate_ids = await inference_worker.run(input_ids)
+    result = await asyncio.to_thread(
+        tokenizer.decode, generate_ids, skip_special_tokens=True, clean_up_tokenization_spaces=False
     )
-    result = tokenizer.batch_decode(generate_ids, skip_special_tokens=True, clean_up_tokenization_spaces=False)[0]
 
     # 只返回### 角色消息:后的内容
     result = result.split("### 角色消息:")[1].strip()
@@ -118,7 +118,47 @@ async def chat_with_uncensored(prompt: str):
         "history": []
     }
 
-def generate_prompt(text, character_json_path="/data/app/character.json"):
+def prepare_inputs(text):
+    """
+    构建角色提示词并编码（CPU操作，在线程中执行）
+    """
+    prompt = generate_prompt(text)
+    logger.debug(f"final instruction: {prompt}")
+    return tokenizer(prompt)["input_ids"]
+
+def generate_batch(_, batch_input_ids):
+    """
+    在GPU上批量生成回复（由批处理队列调用），生成参数固定，所有请求都可合并
+    """
+    # 左侧补齐后合并为一个批次
+    inputs = tokenizer.pad({"input_ids": batch_input_ids}, padding=True, return_tensors="pt").to("cuda")
+    # SDPA只使用flash和memory-efficient内核，不回退到逐元素计算的math实现
+    with torch.inference_mode(), torch.backends.cuda.sdp_kernel(enable_flash=True, enable_mem_efficient=True, enable_math=False):
+        generate_ids = model.generate(
+            **inputs, 
+            max_new_tokens=350, 
+            do_sample=True, 
+            repetition_penalty=1.4, 
+            temperature=0.35, 
+            top_p=0.75, 
+            top_k=40,
+            use_cache=True,
+            pad_token_id=tokenizer.pad_token_id
+        )
+    return list(generate_ids.cpu())
+
+# GPU推理由单个后台任务按批执行
+inference_worker = BatchInferenceWorker("Gryphe/MythoMax-L2-13b", generate_batch)
+
+# 角色配置文件路径
+CHARACTER_JSON_PATH = "/data/app/character.json"
+
+@functools.lru_cache(maxsize=1)
+def load_prompt_template(character_json_path, mtime):
+    """
+    读取角色配置并生成提示词中用户消息前后的固定部分
+    以文件修改时间作为缓存键的一部分，角色配置被修改后会自动重新加载
+    """
     with open(character_json_path, 'r') as f:
         character_data = json.load(f)
 
@@ -130,7 +170,7 @@ def generate_prompt(text, character_json_path="/data/app/character.json"):
     past_dialogue = character_data.get('mes_example', '')
     past_dialogue_formatted = past_dialogue
 
-    return f"""### Instruction:
+    prefix = f"""### Instruction:
 扮演一个角色, 角色描述如下:
 {"你的名字是: " + name + "." if name else ""}
 {"你的背景故事和历史是: " + background if background else ""}
@@ -144,6 +184,15 @@ def generate_prompt(text, character_json_path="/data/app/character.json"):
 
 用中文和你的角色性格相符的话回答以下消息，记住，请使用中文回复:
 ### 用户消息:
-{text}
+"""
+    suffix = f"""
 ### 角色消息:
-{name}:"""
\ No newline at end of file
+{name}:"""
+    return prefix, suffix
+
+def generate_prompt(text, character_json_path=CHARACTER_JSON_PATH):
+    """
+    使用缓存的角色提示词模板构建完整提示词
+    """
+    prefix, suffix = load_prompt_template(character_json_path, os.path.getmtime(character_json_path))
+    return f"{prefix}{text}{suffix}"
@@ -3,142 +3,273 @@ Whisper语音转文字服务
 负责Whisper模型的加载、管理和使用
 """
 import os
+import asyncio
+import hashlib
 import logging
+import multiprocessing
 import traceback
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Union
 import torch
-import librosa
+import torchaudio
 from fastapi import HTTPException
 from transformers import AutoModelForSpeechSeq2Seq, AutoProcessor
+from transformers.modeling_outputs import BaseModelOutput
+from app.services.inference_worker import BatchInferenceWorker
+from app.services.model_registry import model_registry
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
-# 全局变量存储加载的Whisper模型和处理器
+# 全局变量存储加载的Whisper模型和处理器，由模型注册表加载
 whisper_model = None
 whisper_processor = None
-model_loading = False
 
-def load_model():
+# 音频解码和重采样是CPU密集操作，放到进程池中执行，避免阻塞事件循环
+# 模型推理仍在主进程中进行，避免每个工作进程各自加载一份模型
+# 使用spawn启动工作进程：主进程初始化CUDA后fork出的子进程无法使用CUDA，且会继承事件循环和线程状态；
+# load_audio只在CPU上处理，不能引入CUDA调用
+_AUDIO_POOL = ProcessPoolExecutor(
+    max_workers=min(4, os.cpu_count() or 1),
+    mp_context=multiprocessing.get_context("spawn")
+)
+
+# Whisper输入固定为16kHz、30秒
+SAMPLING_RATE = 16000
+N_SAMPLES = SAMPLING_RATE * 30
+
+# 按设备缓存的梅尔频谱变换
+_mel_transforms = {}
+
+# 按设备缓存的锁页内存缓冲区（及最近一次从中发起拷贝的CUDA事件），用于把音频批量拷贝到GPU
+_staging_buffers = {}
+
+# 按音频内容哈希缓存的编码器输出，同一段音频以不同语言重试转录时跳过编码器计算
+# 只在批处理队列的单个后台任务中访问，无需加锁
+ENCODER_CACHE_SIZE = 128
+_encoder_cache = OrderedDict()
+
+def load_audio(audio_source, sampling_rate=SAMPLING_RATE, audio_format=None):
+    """
+    读取音频文件（路径或内存中的文件对象），混合为单声道并重采样，在进程池中执行，只使用CPU
+    """
+    if isinstance(audio_source, str):
+        waveform, orig_sr = torchaudio.load(audio_source)
+    else:
+        waveform, orig_sr = torchaudio.load(audio_source, format=audio_format)
+    waveform = waveform.mean(dim=0)
+    if orig_sr != sampling_rate:
+        waveform = torchaudio.functional.resample(waveform, orig_sr, sampling_rate)
+    return waveform.numpy()
+
+def _get_mel_transform(device):
     """
-    加载Whisper模型和处理器，只在第一次调用时初始化，支持多 GPU
+    获取与Whisper特征提取器参数一致的梅尔频谱变换，按设备缓存
     """
-    global whisper_model, whisper_processor, model_loading
+    if device not in _mel_transforms:
+        feature_extractor = whisper_processor.feature_extractor
+        _mel_transforms[device] = torchaudio.transforms.MelSpectrogram(
+            sample_rate=SAMPLING_RATE,
+            n_fft=feature_extractor.n_fft,
+            hop_length=feature_extractor.hop_length,
+            n_mels=feature_extractor.feature_size,
+            power=2.0,
+            norm="slaney",
+            mel_scale="slaney"
+        ).to(device)
+    return _mel_transforms[device]
+
+def _get_staging_buffer(device, batch_size):
+    """
+    获取用于拷贝音频的缓冲区，GPU设备使用锁页内存以便异步拷贝，按设备缓存，批大小超出时重新分配
+    """
+    buffer, copy_event = _staging_buffers.get(device, (None, None))
+    if buffer is None or buffer.shape[0] < batch_size:
+        buffer = torch.empty((batch_size, N_SAMPLES), dtype=torch.float32, pin_memory=device.type == "cuda")
+    elif copy_event is not None:
+        # 等待上一次从该缓冲区发起的异步拷贝完成后再覆盖
+        copy_event.synchronize()
+    _staging_buffers[device] = (buffer, None)
+    return buffer
+
+def extract_features(audio_arrays, device):
+    """
+    在GPU上批量计算Whisper的对数梅尔频谱特征，结果直接作为模型输入，不经过numpy往返
+    音频先截断或补零到30秒写入锁页缓冲区，整批只做一次异步拷贝
+    """
+    batch_size = len(audio_arrays)
+    buffer = _get_staging_buffer(device, batch_size)
+    staging = buffer[:batch_size]
+    for row, audio_array in zip(staging, audio_arrays):
+        samples = torch.from_numpy(audio_array[:N_SAMPLES])
+        row[:samples.shape[0]].copy_(samples)
+        row[samples.shape[0]:].zero_()
+    
+    waveform = staging.to(device, non_blocking=True)
+    if device.type == "cuda":
+        copy_event = torch.cuda.Event()
+        copy_event.record()
+        _staging_buffers[device] = (buffer, copy_event)
     
-    logger.info("准备加载Whisper模型...")
+    mel_spec = _get_mel_transform(device)(waveform)[..., :-1]
+    log_spec = torch.clamp(mel_spec, min=1e-10).log10()
+    log_spec = torch.maximum(log_spec, log_spec.amax(dim=(-2, -1), keepdim=True) - 8.0)
+    log_spec = (log_spec + 4.0) / 4.0
+    
+    return log_spec.to(whisper_model.dtype)
 
-    # 避免并发初始化
-    if model_loading:
-        return False
-        
-    if whisper_model is not None and whisper_processor is not None:
-        return True
-        
-    try:
-        model_loading = True
-        logger.info("开始加载Whisper模型...")
-        
-        # 加载模型
-        model_id = "openai/whisper-large-v3"
-        
-        # 获取 GPU 信息
-        # n_gpus = torch.cuda.device_count()
-        n_gpus = 1
-        logger.info(f"可用 GPU 数量: {n_gpus}")
+def _load_whisper():
+    """
+    加载Whisper模型和处理器，支持多 GPU（由模型注册表调用，只执行一次）
+    """
+    # 加载模型
+    model_id = "openai/whisper-large-v3"
+    
+    # 获取 GPU 信息
+    # n_gpus = torch.cuda.device_count()
+    n_gpus = 1
+    logger.info(f"可用 GPU 数量: {n_gpus}")
+    
+    # 确定设备和数据类型
+    device_map = "cuda:0" if n_gpus >= 1 else "cpu"
+    torch_dtype = torch.float16 if torch.cuda.is_available() else torch.float32
+    
+    # 加载处理器
+    processor = AutoProcessor.from_pretrained(
+        model_id,
+        local_files_only=False
+    )
+    
+    # 如果有多个 GPU 可用，考虑使用量化配置减少内存占用
+    if n_gpus > 1:
+        from transformers import BitsAndBytesConfig
         
-        # 确定设备和数据类型
-        device_map = "cuda:0" if n_gpus >= 1 else "cpu"
-        torch_dtype = torch.float16 if torch.cuda.is_available() else torch.float32
+        quantization_config = BitsAndBytesConfig(
+            load_in_8bit=True,
+            llm_int8_threshold=6.0,
+            llm_int8_has_fp16_weight=False
+        )
         
-        # 加载处理器
-        whisper_processor = AutoProcessor.from_pretrained(
-            model_id,
+        model = AutoModelForSpeechSeq2Seq.from_pretrained(
+            model_id, 
+            device_map=device_map,
+            quantization_config=quantization_config,
+            low_cpu_mem_usage=True, 
+            use_safetensors=True,
             local_files_only=False
         )
-        
-        # 如果有多个 GPU 可用，考虑使用量化配置减少内存占用
-        if n_gpus > 1:
-            from transformers import BitsAndBytesConfig
-            
-            quantization_config = BitsAndBytesConfig(
-                load_in_8bit=True,
-                llm_int8_threshold=6.0,
-                llm_int8_has_fp16_weight=False
-            )
-            
-            whisper_model = AutoModelForSpeechSeq2Seq.from_pretrained(
-                model_id, 
-                device_map=device_map,
-                quantization_config=quantization_config,
-                low_cpu_mem_usage=True, 
-                use_safetensors=True,
-                local_files_only=False
-            )
-        else:
-            # 单 GPU 或 CPU 加载
-            whisper_model = AutoModelForSpeechSeq2Seq.from_pretrained(
-                model_id, 
-                torch_dtype=torch_dtype,
-                device_map=device_map,
-                low_cpu_mem_usage=True, 
-                use_safetensors=True,
-                local_files_only=False
-            )
-        
-        # 使模型处于评估模式
-        whisper_model.eval()
-        
-        logger.info(f"Whisper模型已加载，设备映射: {device_map}, 数据类型: {torch_dtype}")
-        model_loading = False
+    else:
+        # 单 GPU 或 CPU 加载
+        model = AutoModelForSpeechSeq2Seq.from_pretrained(
+            model_id, 
+            torch_dtype=torch_dtype,
+            device_map=device_map,
+            low_cpu_mem_usage=True, 
+            use_safetensors=True,
+            local_files_only=False
+        )
+    
+    # 使模型处于评估模式
+    model.eval()
+    
+    logger.info(f"Whisper模型已加载，设备映射: {device_map}, 数据类型: {torch_dtype}")
+    return model, processor
+
+def load_model():
+    """
+    加载Whisper模型和处理器，只在第一次调用时初始化，并发调用会等待同一次加载完成
+    （同步版本，供预加载线程使用）
+    """
+    global whisper_model, whisper_processor
+    
+    try:
+        whisper_model, whisper_processor = model_registry.get_or_load("whisper", _load_whisper)
         return True
-    except Exception as e:
-        logger.error(f"加载Whisper模型失败: {str(e)}")
-        # 记录更详细的错误信息
-        logger.error(f"错误详情: {traceback.format_exc()}")
-        model_loading = False
+    except Exception:
         return False
 
-async def transcribe_audio(audio_file_path, language="zh"):
+async def ensure_model_loaded():
+    """
+    确保Whisper模型已加载，加载在线程中进行，不阻塞事件循环
+    """
+    global whisper_model, whisper_processor
+    
+    try:
+        whisper_model, whisper_processor = await model_registry.aget_or_load("whisper", _load_whisper)
+        return True
+    except Exception:
+        return False
+
+def encode_batch(audio_arrays):
+    """
+    返回一批音频的编码器输出，已缓存的音频直接复用，只对未命中的音频提取特征并运行编码器
+    """
+    keys = [hashlib.blake2b(audio_array.tobytes(), digest_size=16).digest() for audio_array in audio_arrays]
+    
+    misses = [i for i, key in enumerate(keys) if key not in _encoder_cache]
+    if misses:
+        # 在模型所在设备上提取特征，每条音频都补齐到30秒，可直接组成一个批次
+        input_features = extract_features([audio_arrays[i] for i in misses], whisper_model.device)
+        with torch.inference_mode():
+            hidden_states = whisper_model.model.encoder(input_features).last_hidden_state
+        # 逐条拷贝保存，缓存条目被淘汰时不会因引用整批张量而占住显存
+        for i, states in zip(misses, hidden_states):
+            _encoder_cache[keys[i]] = states.clone()
+    
+    for key in keys:
+        _encoder_cache.move_to_end(key)
+    encoder_states = torch.stack([_encoder_cache[key] for key in keys])
+    
+    while len(_encoder_cache) > ENCODER_CACHE_SIZE:
+        _encoder_cache.popitem(last=False)
+    
+    return encoder_states
+
+def generate_batch(language, audio_arrays):
+    """
+    编码音频并批量生成转录token（由批处理队列调用），同一批的请求语言相同
+    """
+    encoder_states = encode_batch(audio_arrays)
+    
+    # 使用模型生成转录，直接传入编码器输出，不再重复运行编码器
+    with torch.inference_mode():
+        # 只设置语言，不使用forced_decoder_ids
+        generation_config = {
+            "language": language,  # 设置语言
+            "task": "transcribe"   # 设置任务类型为转录
+        }
+        
+        # 生成转录
+        predicted_ids = whisper_model.generate(
+            encoder_outputs=BaseModelOutput(last_hidden_state=encoder_states),
+            **generation_config
+        )
+    return list(predicted_ids.cpu())
+
+# GPU推理由单个后台任务按批执行
+inference_worker = BatchInferenceWorker("Whisper", generate_batch)
+
+async def transcribe_audio(audio_source: Union[str, BinaryIO], language="zh", audio_format=None):
     """
     使用Whisper模型进行语音转文字
+    audio_source可以是文件路径，也可以是可序列化的内存文件对象（如io.BytesIO），
+    后者需要通过audio_format指明格式（如"wav"）
     """
     # 确保模型已加载
-    if not load_model():
+    if not await ensure_model_loaded():
         raise HTTPException(status_code=500, detail="无法加载Whisper模型")
     
     try:
-        # 读取音频文件
-        audio_array, sampling_rate = librosa.load(audio_file_path, sr=16000)
-        
-        # 处理音频
-        inputs = whisper_processor(
-            audio_array, 
-            sampling_rate=16000, 
-            return_tensors="pt",
-            return_attention_mask=True  # 确保返回注意力掩码
-        )
+        # 在进程池中读取音频文件
+        loop = asyncio.get_running_loop()
+        audio_array = await loop.run_in_executor(_AUDIO_POOL, load_audio, audio_source, SAMPLING_RATE, audio_format)
         
-        # 将输入移至GPU并转换为正确的数据类型（如果可用）
-        if torch.cuda.is_available():
-            # 确保数据类型匹配模型
-            dtype = whisper_model.dtype  # 获取模型的数据类型
-            inputs = {k: v.to("cuda:0").to(dtype) for k, v in inputs.items()}
-        
-        # 使用模型生成转录
-        with torch.no_grad():
-            # 只设置语言，不使用forced_decoder_ids
-            generation_config = {
-                "language": language,  # 设置语言
-                "task": "transcribe"   # 设置任务类型为转录
-            }
-            
-            # 生成转录
-            predicted_ids = whisper_model.generate(
-                **inputs,
-                **generation_config
-            )
+        # 在批处理队列中提取特征并生成转录
+        predicted_ids = await inference_worker.run(audio_array, key=language)
         
         # 解码预测的token为文本
-        transcription = whisper_processor.batch_decode(predicted_ids, skip_special_tokens=True)[0]
+        transcription = whisper_processor.decode(predicted_ids, skip_special_tokens=True)
         
         return transcription
     except Exception as e:
@@ -151,17 +282,8 @@ def get_model_status():
     """
     获取Whisper模型的加载状态
     """
-    global whisper_model, whisper_processor, model_loading
-    
-    if model_loading:
-        status = "loading"
-    elif whisper_model is not None and whisper_processor is not None:
-        status = "ready"
-    else:
-        status = "not_loaded"
-    
     return {
-        "status": status,
+        "status": model_registry.status("whisper"),
         "gpu_available": torch.cuda.is_available(),
         "model": "openai/whisper-large-v3"
     }
\ No newline at end of file
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# app/tools/_api_cache.py
+
+import os
+import time
+import sqlite3
+import logging
+import orjson
+from typing import Any, Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# 未配置REDIS_URL时使用的本地sqlite缓存文件
+CACHE_DB_PATH = "/data/app/jd/api_cache.db"
+
+class _SqliteCache:
+    """sqlite缓存后端，按过期时间判断是否命中"""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS api_cache (key TEXT PRIMARY KEY, value BLOB, expires REAL)"
+        )
+        self.conn.commit()
+
+    async def get(self, key: str) -> Optional[bytes]:
+        row = self.conn.execute(
+            "SELECT value FROM api_cache WHERE key = ? AND expires > ?", (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO api_cache (key, value, expires) VALUES (?, ?, ?)",
+            (key, value, time.time() + ttl)
+        )
+        self.conn.commit()
+
+class _RedisCache:
+    """redis缓存后端，过期由redis处理"""
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis
+        self.client = redis.from_url(url)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.client.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        await self.client.set(key, value, ex=int(ttl))
+
+_cache = None
+
+def _get_cache():
+    """按配置创建缓存后端，只在第一次使用时创建"""
+    global _cache
+    if _cache is None:
+        redis_url = os.getenv("REDIS_URL")
+        if redis_url:
+            _cache = _RedisCache(redis_url)
+            logger.info("接口结果缓存使用redis")
+        else:
+            _cache = _SqliteCache(CACHE_DB_PATH)
+            logger.info(f"接口结果缓存使用sqlite: {CACHE_DB_PATH}")
+    return _cache
+
+async def cache_get(key: str) -> Any:
+    """查询缓存，未命中时返回None"""
+    cached = await _get_cache().get(key)
+    return orjson.loads(cached) if cached is not None else None
+
+async def cache_set(key: str, value: Any, ttl: float):
+    """写入缓存，value为None时不写入"""
+    if value is not None:
+        await _get_cache().set(key, orjson.dumps(value), ttl)
+
+async def get_or_set(key: str, ttl: float, coro_factory: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    先查缓存，命中直接返回；未命中时调用coro_factory()请求接口并写入缓存
+    结果为None（请求失败）时不写入缓存，下次重新请求
+    """
+    cache = _get_cache()
+    cached = await cache.get(key)
+    if cached is not None:
+        return orjson.loads(cached)
+
+    value = await coro_factory()
+    if value is not None:
+        await cache.set(key, orjson.dumps(value), ttl)
+    return value
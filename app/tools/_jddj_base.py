@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# app/tools/_jddj_base.py
+
+import os
+import time
+import asyncio
+import orjson
+import hashlib
+import logging
+import aiohttp
+from typing import Dict, Optional, Set
+from app.tools.rate_limit import TokenBucket, SlidingWindowCounter
+
+logger = logging.getLogger(__name__)
+
+# 接口返回这些状态码时退避后重试
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.5
+
+class _JDDJBase:
+    """
+    京东到家及DeepSeek接口工具的公共部分：请求频率控制、token读取、请求签名和结果文件读写
+    子类只需指定接口地址和每分钟请求上限
+    """
+
+    __slots__ = ('data_dir', 'max_requests_per_minute', 'rate_window', 'bucket',
+                 'app_key', 'app_secret', '_token', '_token_mtime', '_sign_prefix', '_sign_suffix')
+
+    def __init__(self, max_requests_per_minute: int, require_app_key: bool = True):
+        self.data_dir = "/data/app/jd"
+        os.makedirs(self.data_dir, exist_ok=True)
+
+        # 从环境变量加载配置
+        self.app_key = os.getenv("JDDJ_APP_KEY")
+        self.app_secret = os.getenv("JDDJ_APP_SECRET")
+
+        if require_app_key and (not self.app_key or not self.app_secret):
+            raise ValueError("请在.env文件中设置JDDJ_APP_KEY和JDDJ_APP_SECRET")
+
+        # 签名串中每次请求都不变的部分预先编码：参数按名称升序为
+        # app_key, format, jd_param_json, timestamp, token, v，前后各加app_secret
+        if self.app_key and self.app_secret:
+            secret = self.app_secret.encode('utf-8')
+            self._sign_prefix = secret + b"app_key" + self.app_key.encode('utf-8') + b"formatjson"
+            self._sign_suffix = b"v1.0" + secret
+
+        # 请求频率控制：滑动窗口保证每分钟不超过上限，令牌桶允许少量突发并在其后保持均匀间隔
+        self.max_requests_per_minute = max_requests_per_minute
+        self.rate_window = SlidingWindowCounter(max_requests_per_minute)
+        self.bucket = TokenBucket(max_requests_per_minute / 60.0, capacity=5)
+
+        # 缓存的token及token文件的修改时间，文件未变化时不重新读取
+        self._token = None
+        self._token_mtime = None
+
+    async def wait_for_rate_limit(self):
+        """等待直到可以发送下一个请求"""
+        await self.rate_window.acquire()
+        await self.bucket.acquire()
+
+    async def request_json(self, session: aiohttp.ClientSession, method: str, url: str, **kwargs) -> Dict:
+        """
+        经过频率控制发送请求并解析JSON响应
+        遇到429或5xx时按Retry-After或指数退避等待后重试，每次重试同样计入请求频率
+        """
+        for attempt in range(MAX_RETRIES + 1):
+            await self.wait_for_rate_limit()
+            async with session.request(method, url, **kwargs) as response:
+                if response.status not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                    response.raise_for_status()
+                    return await response.json(content_type=None)
+                retry_after = response.headers.get("Retry-After", "")
+                delay = float(retry_after) if retry_after.isdigit() else RETRY_BACKOFF * (2 ** attempt)
+                logger.warning(f"请求返回{response.status}，{delay:.1f}秒后第{attempt + 1}次重试")
+            await asyncio.sleep(delay)
+
+    def load_token(self) -> Optional[str]:
+        """从文件中加载token，文件修改时间未变化时直接返回缓存的token"""
+        token_file = os.path.join(self.data_dir, "jd_auth.json")
+        try:
+            mtime = os.stat(token_file).st_mtime
+        except FileNotFoundError:
+            logger.error("未找到token文件，请先运行授权流程")
+            return None
+
+        if mtime == self._token_mtime:
+            return self._token
+
+        try:
+            with open(token_file, "rb") as f:
+                token_data = orjson.loads(f.read())
+            self._token = token_data.get("token")
+            self._token_mtime = mtime
+            return self._token
+        except Exception as e:
+            logger.error(f"读取token文件失败: {str(e)}")
+            return None
+
+    def generate_sign(self, token: str, timestamp: str, jd_param_json: str) -> str:
+        """生成签名，只编码每次请求变化的参数，逐段送入MD5，不拼接完整的签名串"""
+        h = hashlib.md5(self._sign_prefix)
+        h.update(b"jd_param_json")
+        h.update(jd_param_json.encode('utf-8'))
+        h.update(b"timestamp")
+        h.update(timestamp.encode('utf-8'))
+        h.update(b"token")
+        h.update(token.encode('utf-8'))
+        h.update(self._sign_suffix)
+        return h.hexdigest().upper()
+
+    def build_request_params(self, token: str, jd_param_json: str) -> Dict:
+        """构建带签名的完整请求参数"""
+        t = time.localtime()
+        timestamp = f"{t.tm_year:04d}-{t.tm_mon:02d}-{t.tm_mday:02d} {t.tm_hour:02d}:{t.tm_min:02d}:{t.tm_sec:02d}"
+        return {
+            # 系统级参数
+            "token": token,
+            "app_key": self.app_key,
+            "timestamp": timestamp,
+            "format": "json",
+            "v": "1.0",
+            # 应用级参数
+            "jd_param_json": jd_param_json,
+            "sign": self.generate_sign(token, timestamp, jd_param_json),
+        }
+
+    def load_processed_ids(self, jsonl_file: str) -> Set[str]:
+        """读取已写入JSONL结果文件的商品ID，重新运行时跳过这些商品；失败的结果不计入，会重新处理"""
+        if not os.path.exists(jsonl_file):
+            return set()
+
+        processed_ids = set()
+        with open(jsonl_file, "rb") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    result = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    # 中途退出时最后一行可能不完整
+                    continue
+                if "error" not in result:
+                    processed_ids.add(result.get("_id", ""))
+        logger.info(f"从 {jsonl_file} 读取到 {len(processed_ids)} 个已处理的商品")
+        return processed_ids
+
+    def convert_jsonl_to_json(self, jsonl_file: str, output_file: str):
+        """把逐行追加的JSONL结果转换为完整的JSON数组文件，同一商品有多条结果时保留最后一条"""
+        try:
+            results = {}
+            with open(jsonl_file, "rb") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        result = orjson.loads(line)
+                    except orjson.JSONDecodeError:
+                        continue
+                    results[result.get("_id", "")] = result
+            with open(output_file, "wb") as f:
+                f.write(orjson.dumps(list(results.values()), option=orjson.OPT_INDENT_2))
+            logger.info(f"结果已保存到: {output_file}")
+        except Exception as e:
+            logger.error(f"保存结果失败: {str(e)}")
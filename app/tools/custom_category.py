@@ -3,15 +3,15 @@
 # app/tools/shop_category.py
 
 import os
-import json
-import time
+import orjson
+import asyncio
 import logging
-import hashlib
-import requests
+import aiohttp
+import tempfile
 import argparse
-from typing import Dict, List, Optional, Set
-from datetime import datetime
+from typing import Dict, List, Optional
 from dotenv import load_dotenv
+from app.tools._jddj_base import _JDDJBase
 
 # 加载环境变量
 load_dotenv()
@@ -23,84 +23,46 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-class JDDJShopCategoryManager:
+class JDDJShopCategoryManager(_JDDJBase):
     """京东到家店内分类管理工具"""
 
     def __init__(self):
+        # 请求频率控制 (40次/分钟)
+        super().__init__(max_requests_per_minute=40)
+        
         # API配置
         self.base_url = "https://openapi.jddj.com/djapi/pms/addShopCategory"
-        self.data_dir = "/data/app/jd"
-        os.makedirs(self.data_dir, exist_ok=True)
-        
-        # 从环境变量加载配置
-        self.app_key = os.getenv("JDDJ_APP_KEY")
-        self.app_secret = os.getenv("JDDJ_APP_SECRET")
-        
-        if not self.app_key or not self.app_secret:
-            raise ValueError("请在.env文件中设置JDDJ_APP_KEY和JDDJ_APP_SECRET")
-        
-        # 请求频率控制 (40次/分钟)
-        self.max_requests_per_minute = 40
-        self.request_timestamps = []
-        self.request_interval = 60.0 / self.max_requests_per_minute
         
-        # 分类名称和ID的映射，避免重复创建
-        self.category_id_map = {}
+        # 分类名称和ID的映射，避免重复创建；持久化到磁盘，重新运行时不再重复创建已有分类
+        self.category_map_file = os.path.join(self.data_dir, "category_map.json")
+        self.category_id_map = self.load_category_map()
     
-    def wait_for_rate_limit(self):
-        """等待直到可以发送下一个请求"""
-        current_time = time.time()
+    def load_category_map(self) -> Dict[str, str]:
+        """从文件中加载已创建的分类名称和ID的映射"""
+        if not os.path.exists(self.category_map_file):
+            return {}
         
-        # 清理超过1分钟的时间戳
-        self.request_timestamps = [ts for ts in self.request_timestamps 
-                                  if current_time - ts < 60.0]
-        
-        # 如果已经达到限制，等待
-        if len(self.request_timestamps) >= self.max_requests_per_minute:
-            wait_time = 60.0 - (current_time - self.request_timestamps[0])
-            if wait_time > 0:
-                logger.info(f"达到请求频率限制，等待 {wait_time:.2f} 秒")
-                time.sleep(wait_time)
-                current_time = time.time()
-        
-        # 如果距离上次请求时间太短，等待
-        if self.request_timestamps:
-            time_since_last = current_time - self.request_timestamps[-1]
-            if time_since_last < self.request_interval:
-                wait_time = self.request_interval - time_since_last
-                logger.info(f"请求间隔太短，等待 {wait_time:.2f} 秒")
-                time.sleep(wait_time)
-        
-        # 记录当前请求时间
-        self.request_timestamps.append(time.time())
-    
-    def load_token(self) -> Optional[str]:
-        """从文件中加载token"""
-        token_file = os.path.join(self.data_dir, "jd_auth.json")
-        if not os.path.exists(token_file):
-            logger.error("未找到token文件，请先运行授权流程")
-            return None
-            
         try:
-            with open(token_file, "r", encoding="utf-8") as f:
-                token_data = json.load(f)
-                return token_data.get("token")
+            with open(self.category_map_file, "rb") as f:
+                category_map = orjson.loads(f.read())
+            logger.info(f"从 {self.category_map_file} 加载了 {len(category_map)} 个已创建的分类")
+            return category_map
         except Exception as e:
-            logger.error(f"读取token文件失败: {str(e)}")
-            return None
+            logger.error(f"读取分类映射文件失败: {str(e)}")
+            return {}
     
-    def generate_sign(self, params: Dict) -> str:
-        """生成签名"""
-        # 按参数名升序排列
-        sorted_params = sorted(params.items())
-        # 拼接参数
-        param_str = "".join([f"{k}{v}" for k, v in sorted_params])
-        # 添加app_secret
-        sign_str = f"{self.app_secret}{param_str}{self.app_secret}"
-        # MD5加密
-        return hashlib.md5(sign_str.encode('utf-8')).hexdigest().upper()
+    def save_category_map(self, category_name: str, category_id: str):
+        """记录新创建的分类并写回文件，先写临时文件再替换，中途退出也不会损坏已有映射"""
+        self.category_id_map[category_name] = category_id
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.data_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(orjson.dumps(self.category_id_map))
+            os.replace(tmp_path, self.category_map_file)
+        except Exception as e:
+            logger.error(f"保存分类映射文件失败: {str(e)}")
     
-    def add_shop_category(self, category_name: str, pid: int = 0) -> Optional[str]:
+    async def add_shop_category(self, session: aiohttp.ClientSession, category_name: str, pid: int = 0) -> Optional[str]:
         """添加店内分类"""
         # 如果该分类已经创建过，直接返回ID
         if category_name in self.category_id_map:
@@ -112,47 +74,24 @@ class JDDJShopCategoryManager:
             return None
         
         try:
-            # 等待频率限制
-            self.wait_for_rate_limit()
-            
-            # 系统级参数
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            system_params = {
-                "token": token,
-                "app_key": self.app_key,
-                "timestamp": timestamp,
-                "format": "json",
-                "v": "1.0",
-                # 应用级参数
-                "jd_param_json": json.dumps({"shopCategoryName": category_name, "pid": pid})
-            }
-            
-            # 生成签名（只使用系统级参数）
-            sign = self.generate_sign(system_params)
-            
-            # 完整请求参数
-            params = {
-                **system_params,
-                "sign": sign,
-            }
+            # 完整请求参数（含签名）
+            jd_param_json = orjson.dumps({"shopCategoryName": category_name, "pid": pid}).decode()
+            params = self.build_request_params(token, jd_param_json)
             
             logger.info(f"创建店内分类: {category_name}")
-            response = requests.get(self.base_url, params=params)
-            response.raise_for_status()
-            
-            result = response.json()
+            result = await self.request_json(session, "GET", self.base_url, params=params)
             
             if result.get("code") != "0":
                 logger.error(f"创建店内分类失败: {result.get('msg')}")
                 return None
             
             # 提取分类ID
-            category_id = json.loads(result.get("data", {})).get("result", {}).get("id")
+            category_id = orjson.loads(result.get("data", "{}")).get("result", {}).get("id")
             
             if category_id:
                 logger.info(f"创建店内分类成功, '{category_name}' ID: {category_id}")
-                # 记录分类ID，避免重复创建
-                self.category_id_map[category_name] = category_id
+                # 记录分类ID并持久化，避免重复创建
+                self.save_category_map(category_name, category_id)
                 return category_id
             else:
                 logger.error("创建店内分类成功但未返回ID")
@@ -165,24 +104,15 @@ class JDDJShopCategoryManager:
     def load_products(self, file_path: str) -> List[Dict]:
         """加载商品数据"""
         try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                products = json.load(f)
+            with open(file_path, "rb") as f:
+                products = orjson.loads(f.read())
             logger.info(f"从 {file_path} 加载了 {len(products)} 个商品")
             return products
         except Exception as e:
             logger.error(f"加载商品数据失败: {str(e)}")
             return []
     
-    def save_results(self, results: List[Dict], output_file: str):
-        """保存分类结果到文件"""
-        try:
-            with open(output_file, "w", encoding="utf-8") as f:
-                json.dump(results, f, ensure_ascii=False, indent=2)
-            logger.info(f"分类结果已保存到: {output_file}")
-        except Exception as e:
-            logger.error(f"保存分类结果失败: {str(e)}")
-    
-    def process_products(self, database_file: str, output_file: str):
+    async def process_products(self, database_file: str, output_file: str):
         """处理所有商品的分类"""
         # 加载商品数据
         products = self.load_products(database_file)
@@ -199,43 +129,54 @@ class JDDJShopCategoryManager:
         
         logger.info(f"找到 {len(unique_categories)} 个唯一分类")
         
-        # 首先创建所有分类
-        for category in unique_categories:
-            self.add_shop_category(category)
+        # 首先并发创建所有分类，并发数不超过每分钟请求上限，实际发送速率仍由滑动窗口和令牌桶控制
+        semaphore = asyncio.Semaphore(self.max_requests_per_minute)
+        
+        async def add_category(category_name: str):
+            async with semaphore:
+                await self.add_shop_category(session, category_name)
+        
+        connector = aiohttp.TCPConnector(limit_per_host=20, ttl_dns_cache=300)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            await asyncio.gather(*(add_category(category) for category in unique_categories))
         
-        # 处理每个商品
-        results = []
+        # 处理每个商品，结果逐行追加到JSONL文件，每次只写入新增的一条
+        results_file = os.path.splitext(output_file)[0] + ".jsonl"
+        processed = 0
         total = len(products)
         
-        for i, product in enumerate(products):
-            product_id = product.get("_id", "")
-            category = product.get("category-1", "")
+        with open(results_file, "wb") as results_out:
+            for i, product in enumerate(products):
+                product_id = product.get("_id", "")
+                category = product.get("category-1", "")
             
-            if not category:
-                logger.warning(f"商品 {product_id} 没有分类信息，跳过")
-                continue
+                if not category:
+                    logger.warning(f"商品 {product_id} 没有分类信息，跳过")
+                    continue
             
-            logger.info(f"处理商品 {i+1}/{total}: {product_id}")
+                logger.info(f"处理商品 {i+1}/{total}: {product_id}")
             
-            # 获取分类ID
-            category_id = self.category_id_map.get(category)
+                # 获取分类ID
+                category_id = self.category_id_map.get(category)
             
-            result = {
-                "_id": product_id,
-                "category_name": category,
-                "category_id": category_id
-            }
+                result = {
+                    "_id": product_id,
+                    "category_name": category,
+                    "category_id": category_id
+                }
             
-            results.append(result)
+                results_out.write(orjson.dumps(result) + b"\n")
+                processed += 1
             
-            # 每处理10个商品保存一次结果
-            if (i + 1) % 10 == 0:
-                self.save_results(results, output_file)
-                logger.info(f"已保存 {i+1} 个商品的分类信息")
+                # 每处理100个商品落盘一次
+                if processed % 100 == 0:
+                    results_out.flush()
+                    os.fsync(results_out.fileno())
+                    logger.info(f"已保存 {processed} 个商品的分类信息")
         
-        # 最后保存一次完整结果
-        self.save_results(results, output_file)
-        logger.info(f"商品分类处理完成，共处理 {len(results)} 个商品")
+        # 最后转换为完整的JSON文件
+        self.convert_jsonl_to_json(results_file, output_file)
+        logger.info(f"商品分类处理完成，共处理 {processed} 个商品")
 
 def main():
     """主函数"""
@@ -250,7 +191,7 @@ def main():
     try:
         manager = JDDJShopCategoryManager()
         logger.info("开始创建店内分类信息...")
-        manager.process_products(args.database, args.output)
+        asyncio.run(manager.process_products(args.database, args.output))
     except Exception as e:
         logger.error(f"程序执行出错: {str(e)}")
         return 1
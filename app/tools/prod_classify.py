@@ -1,14 +1,16 @@
 import os
-import json
-import requests
+import re
+import orjson
+import asyncio
+import aiohttp
 import logging
 import hashlib
-import time
 import argparse
 import sys
-from typing import Dict, List, Optional, Any
-from datetime import datetime
+from typing import Dict, List, Any, Tuple
 from dotenv import load_dotenv
+from app.tools._jddj_base import _JDDJBase
+from app.tools._api_cache import cache_get, cache_set
 
 # 加载.env文件
 load_dotenv()
@@ -20,131 +22,61 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-class JDDJCategoryTool:
+# DeepSeek分类结果的缓存时间（秒）
+CLASSIFY_CACHE_TTL = 7 * 24 * 3600
+
+# 每次DeepSeek请求合并分类的产品数
+CLASSIFY_BATCH_SIZE = 20
+
+class JDDJCategoryTool(_JDDJBase):
     def __init__(self):
-        self.base_url = "https://openapi.jddj.com/djapi/api/queryChildCategoriesForOP"
-        self.data_dir = "/data/app/jd"  # 修改为指定目录
-        os.makedirs(self.data_dir, exist_ok=True)
-        self.app_key = os.getenv("JDDJ_APP_KEY")
-        self.app_secret = os.getenv("JDDJ_APP_SECRET")
-        
-        if not self.app_key or not self.app_secret:
-            raise ValueError("请在.env文件中设置JDDJ_APP_KEY和JDDJ_APP_SECRET")
-        
         # 请求频率控制
-        self.max_requests_per_minute = 45
-        self.request_timestamps = []
-        self.request_interval = 60.0 / self.max_requests_per_minute  # 每次请求的最小间隔（秒）
-        
-    def wait_for_rate_limit(self):
-        """等待直到可以发送下一个请求"""
-        current_time = time.time()
-        
-        # 清理超过1分钟的时间戳
-        self.request_timestamps = [ts for ts in self.request_timestamps 
-                                 if current_time - ts < 60.0]
-        
-        # 如果已经达到限制，等待
-        if len(self.request_timestamps) >= self.max_requests_per_minute:
-            wait_time = 60.0 - (current_time - self.request_timestamps[0])
-            if wait_time > 0:
-                logger.info(f"达到请求频率限制，等待 {wait_time:.2f} 秒")
-                time.sleep(wait_time)
-                current_time = time.time()
-        
-        # 如果距离上次请求时间太短，等待
-        if self.request_timestamps:
-            time_since_last = current_time - self.request_timestamps[-1]
-            if time_since_last < self.request_interval:
-                wait_time = self.request_interval - time_since_last
-                logger.info(f"请求间隔太短，等待 {wait_time:.2f} 秒")
-                time.sleep(wait_time)
-        
-        # 记录当前请求时间
-        self.request_timestamps.append(time.time())
-        
-    def load_token(self) -> Optional[str]:
-        """从文件中加载token"""
-        token_file = os.path.join(self.data_dir, "jd_auth.json")
-        if not os.path.exists(token_file):
-            logger.error("未找到token文件，请先运行授权流程")
-            return None
-            
-        try:
-            with open(token_file, "r", encoding="utf-8") as f:
-                token_data = json.load(f)
-                return token_data.get("token")
-        except Exception as e:
-            logger.error(f"读取token文件失败: {str(e)}")
-            return None
-
-    def generate_sign(self, params: Dict) -> str:
-        """生成签名"""
-        # 按参数名升序排列
-        sorted_params = sorted(params.items())
-        # 拼接参数
-        param_str = "".join([f"{k}{v}" for k, v in sorted_params])
-        # 添加app_secret
-        sign_str = f"{self.app_secret}{param_str}{self.app_secret}"
-        # MD5加密
-        return hashlib.md5(sign_str.encode('utf-8')).hexdigest().upper()
+        super().__init__(max_requests_per_minute=45)
+        self.base_url = "https://openapi.jddj.com/djapi/api/queryChildCategoriesForOP"
+    
+    async def get_all_categories(self) -> List[Dict]:
+        """从根类目开始获取全部类目，整个过程共用一个连接池"""
+        connector = aiohttp.TCPConnector(limit_per_host=20, ttl_dns_cache=300)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            return await self.get_categories(session)
 
-    def get_categories(self, parent_id: str = "0", level: int = 1) -> List[Dict]:
+    async def get_categories(self, session: aiohttp.ClientSession, parent_id: str = "0", level: int = 1) -> List[Dict]:
         """获取指定父级ID下的子类目"""
         token = self.load_token()
         if not token:
             return []
 
         try:
-            # 等待直到可以发送请求
-            self.wait_for_rate_limit()
-            
-            # 系统级参数
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            system_params = {
-                "token": token,
-                "app_key": self.app_key,
-                "timestamp": timestamp,
-                "format": "json",
-                "v": "1.0",
-                # 应用级参数
-                "jd_param_json": json.dumps({"id": parent_id, "fields": [
-                    "ID", "CATEGORY_NAME", "CATEGORY_LEVEL",
-                    "CHECK_UPC_STATUS", "WEIGHT_MARK", "PACKAGE_FEE_MARK", "LEAF"
-                ]})
-            }
-            
-            # 生成签名（只使用系统级参数）
-            sign = self.generate_sign(system_params)
-            
-            # 完整的请求参数
-            params = {
-                **system_params,
-                "sign": sign,
-            }
-            
-            logger.info(f"请求参数: {json.dumps(params, ensure_ascii=False)}")
-            response = requests.get(self.base_url, params=params)
-            response.raise_for_status()
+            # 完整的请求参数（含签名）
+            jd_param_json = orjson.dumps({"id": parent_id, "fields": [
+                "ID", "CATEGORY_NAME", "CATEGORY_LEVEL",
+                "CHECK_UPC_STATUS", "WEIGHT_MARK", "PACKAGE_FEE_MARK", "LEAF"
+            ]}).decode()
+            params = self.build_request_params(token, jd_param_json)
             
-            result = response.json()
-            logger.info(f"响应结果: {json.dumps(result, ensure_ascii=False)}")
+            logger.info(f"请求参数: {orjson.dumps(params).decode()}")
+            result = await self.request_json(session, "GET", self.base_url, params=params)
+            logger.info(f"响应结果: {orjson.dumps(result).decode()}")
             
             if result.get("code") != "0":
                 logger.error(f"获取类目失败: {result.get('msg')}")
                 return []
                 
             # 提取类目数据, parse data field for json
-            categories = json.loads(result.get("data", {})).get("result", [])
+            categories = orjson.loads(result.get("data", "{}")).get("result", [])
             logger.info(f"获取到{level}级类目数量: {len(categories)}")
             
-            # 递归获取子类目
-            for category in categories:
-                if level < 5 and category.get("leaf") != 1:  # 最多获取5级类目，且不是末级类目
-                    category["children"] = self.get_categories(
-                        str(category.get("id", "")),
-                        level + 1
-                    )
+            # 并发递归获取子类目，发送速率仍由共用的频率控制限制
+            parents = [
+                category for category in categories
+                if level < 5 and category.get("leaf") != 1  # 最多获取5级类目，且不是末级类目
+            ]
+            children = await asyncio.gather(*(
+                self.get_categories(session, str(category.get("id", "")), level + 1)
+                for category in parents
+            ))
+            for category, sub_categories in zip(parents, children):
+                category["children"] = sub_categories
                     
             return categories
             
@@ -156,21 +88,16 @@ class JDDJCategoryTool:
         """保存类目信息到文件"""
         try:
             output_file = os.path.join(self.data_dir, "category.json")
-            with open(output_file, "w", encoding="utf-8") as f:
-                json.dump(categories, f, ensure_ascii=False, indent=2)
+            with open(output_file, "wb") as f:
+                f.write(orjson.dumps(categories, option=orjson.OPT_INDENT_2))
             logger.info(f"类目信息已保存到: {output_file}")
         except Exception as e:
             logger.error(f"保存类目信息失败: {str(e)}")
 
-class DeepSeekClassifier:
+class DeepSeekClassifier(_JDDJBase):
     def __init__(self):
-        self.data_dir = "/data/app/jd"  # 分类数据目录
-        os.makedirs(self.data_dir, exist_ok=True)
-        
-        # 请求频率控制
-        self.max_requests_per_minute = 50
-        self.request_timestamps = []
-        self.request_interval = 60.0 / self.max_requests_per_minute  # 每次请求的最小间隔（秒）
+        # 请求频率控制，只使用公共部分的频率控制，不需要京东到家的应用密钥
+        super().__init__(max_requests_per_minute=50, require_app_key=False)
         
         # API 配置
         self.api_key = os.getenv("DEEPSEEK_API_KEY")
@@ -178,39 +105,12 @@ class DeepSeekClassifier:
             raise ValueError("请在.env文件中设置DEEPSEEK_API_KEY")
         
         self.api_url = "https://api.deepseek.com/v1/chat/completions"
-        
-    def wait_for_rate_limit(self):
-        """等待直到可以发送下一个请求"""
-        current_time = time.time()
-        
-        # 清理超过1分钟的时间戳
-        self.request_timestamps = [ts for ts in self.request_timestamps 
-                                 if current_time - ts < 60.0]
-        
-        # 如果已经达到限制，等待
-        if len(self.request_timestamps) >= self.max_requests_per_minute:
-            wait_time = 60.0 - (current_time - self.request_timestamps[0])
-            if wait_time > 0:
-                logger.info(f"达到请求频率限制，等待 {wait_time:.2f} 秒")
-                time.sleep(wait_time)
-                current_time = time.time()
-        
-        # 如果距离上次请求时间太短，等待
-        if self.request_timestamps:
-            time_since_last = current_time - self.request_timestamps[-1]
-            if time_since_last < self.request_interval:
-                wait_time = self.request_interval - time_since_last
-                logger.info(f"请求间隔太短，等待 {wait_time:.2f} 秒")
-                time.sleep(wait_time)
-        
-        # 记录当前请求时间
-        self.request_timestamps.append(time.time())
     
     def load_database_products(self, file_path: str) -> List[Dict]:
         """加载数据库导出的产品信息"""
         try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                products = json.load(f)
+            with open(file_path, "rb") as f:
+                products = orjson.loads(f.read())
             logger.info(f"从 {file_path} 加载了 {len(products)} 个产品")
             return products
         except Exception as e:
@@ -220,8 +120,8 @@ class DeepSeekClassifier:
     def load_categories(self, file_path: str) -> List[Dict]:
         """加载分类信息"""
         try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                categories = json.load(f)
+            with open(file_path, "rb") as f:
+                categories = orjson.loads(f.read())
             logger.info(f"从 {file_path} 加载了分类信息")
             return categories
         except Exception as e:
@@ -232,58 +132,28 @@ class DeepSeekClassifier:
         """提取医疗保健下的计生情趣分类及子分类"""
         health_categories = []
         
-        # 递归查找医疗保健类别
-        def find_health_and_jisheng(cats, path=None):
-            if path is None:
-                path = []
+        # 单次深度优先遍历，栈中每项为(分类, 上级路径, 上级中是否有医疗保健, 是否位于医疗保健下的计生情趣分类内)
+        # 子分类逆序入栈，出栈顺序与递归的先序遍历一致
+        stack = [(cat, (), False, False) for cat in reversed(categories)]
+        while stack:
+            cat, parent_path, under_health, in_jisheng = stack.pop()
+            name = cat.get("categoryName", "")
+            path = parent_path + (name,)
             
-            for cat in cats:
-                current_path = path + [cat.get("categoryName", "")]
-                
-                # 检查是否是医疗保健
-                if "医疗保健" in cat.get("categoryName", ""):
-                    # 继续查找计生情趣
-                    if "children" in cat:
-                        find_jisheng(cat["children"], current_path)
-                
-                # 继续向下递归查找医疗保健
-                if "children" in cat:
-                    find_health_and_jisheng(cat["children"], current_path)
-        
-        # 在医疗保健下查找计生情趣
-        def find_jisheng(cats, path):
-            for cat in cats:
-                current_path = path + [cat.get("categoryName", "")]
-                
-                # 检查是否是计生情趣
-                if "计生情趣" in cat.get("categoryName", ""):
-                    # 将这个分类和所有子分类添加到结果中
-                    flat_cat = self.flatten_category(cat, current_path)
-                    health_categories.append(flat_cat)
-                    
-                    # 添加所有子分类
-                    if "children" in cat:
-                        extract_sub_categories(cat["children"], current_path)
-                
-                # 继续向下递归查找计生情趣
-                if "children" in cat:
-                    find_jisheng(cat["children"], current_path)
-        
-        # 提取子分类
-        def extract_sub_categories(cats, path):
-            for cat in cats:
-                current_path = path + [cat.get("categoryName", "")]
-                flat_cat = self.flatten_category(cat, current_path)
-                health_categories.append(flat_cat)
-                
-                if "children" in cat:
-                    extract_sub_categories(cat["children"], current_path)
+            # 医疗保健下的计生情趣分类，及其所有子分类
+            in_jisheng = in_jisheng or (under_health and "计生情趣" in name)
+            if in_jisheng:
+                health_categories.append(self.flatten_category(cat, path))
+            
+            children = cat.get("children")
+            if children:
+                child_under_health = under_health or "医疗保健" in name
+                stack.extend((child, path, child_under_health, in_jisheng) for child in reversed(children))
         
-        find_health_and_jisheng(categories)
         logger.info(f"提取了 {len(health_categories)} 个医疗保健相关分类")
         return health_categories
     
-    def flatten_category(self, category: Dict, path: List[str]) -> Dict:
+    def flatten_category(self, category: Dict, path: Tuple[str, ...]) -> Dict:
         """将分类扁平化，添加路径信息"""
         return {
             "id": category.get("id", ""),
@@ -293,76 +163,130 @@ class DeepSeekClassifier:
             "leaf": category.get("leaf", 0)
         }
     
-    def classify_product(self, product: Dict, categories: List[Dict]) -> Dict:
-        """使用DeepSeek API对产品进行分类"""
-        title = product.get("title", "")
-        if not title:
-            logger.warning(f"产品 {product.get('_id', '未知')} 没有标题，跳过")
-            return {"_id": product.get("_id", ""), "category": None}
-        
-        # 等待频率限制
-        self.wait_for_rate_limit()
-        
-        # 构建分类列表字符串
+    def prepare_categories(self, categories: List[Dict]):
+        """
+        为一次分类运行预先构建包含全部可选分类的提示词、按ID索引的分类信息和提示词的摘要，
+        每批产品分类时直接使用，不再逐批重建
+        """
         categories_text = "\n".join([
             f"ID: {cat['id']}, 名称: {cat['categoryName']}, 路径: {cat['path']}"
             for cat in categories
         ])
-        
-        # 构建提示词
-        prompt = f"""请根据产品标题，选择最合适的京东到家分类ID。只需要返回一个最合适的分类ID，不需要其他解释。
-
-产品标题: {title}
+        # 每次请求都相同的部分放在提示词开头，DeepSeek的前缀缓存可以命中
+        self._categories_prompt = f"""请根据每个产品标题，选择最合适的京东到家分类ID。每个标题只需要一个最合适的分类ID，不需要其他解释。
 
 可选分类:
-{categories_text}
-
-请直接返回最匹配的一个分类ID（只需数字）:"""
+{categories_text}"""
+        self._categories_by_id = {str(cat['id']): cat for cat in categories}
+        self._categories_digest = hashlib.blake2b(self._categories_prompt.encode('utf-8'), digest_size=16).hexdigest()
+    
+    def classify_cache_key(self, title: str) -> str:
+        """分类结果的缓存键，由可选分类的摘要和产品标题决定"""
+        return "classify:" + hashlib.blake2b(
+            f"{self._categories_digest}\n{title}".encode('utf-8'), digest_size=16
+        ).hexdigest()
+    
+    async def classify_batch(self, session: aiohttp.ClientSession, batch: List[Dict]) -> List[Dict]:
+        """
+        使用DeepSeek API对一批产品进行分类，需先调用prepare_categories
+        已缓存的标题直接使用缓存结果，其余标题合并为一次请求
+        """
+        results = []
+        pending = []
+        for product in batch:
+            title = product.get("title", "")
+            if not title:
+                logger.warning(f"产品 {product.get('_id', '未知')} 没有标题，跳过")
+                results.append({"_id": product.get("_id", ""), "category": None})
+                continue
+            
+            # 相同标题和可选分类优先使用缓存的结果，不占用接口调用次数
+            category_id = await cache_get(self.classify_cache_key(title))
+            if category_id is None:
+                pending.append(product)
+            else:
+                results.append(self.build_classify_result(product, category_id))
+        
+        if not pending:
+            return results
         
+        titles = [product.get("title", "") for product in pending]
         try:
-            # 调用DeepSeek API
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {self.api_key}"
-            }
-            
-            data = {
-                "model": "deepseek-chat",
-                "messages": [{"role": "user", "content": prompt}],
-                "temperature": 0.2,
-                "max_tokens": 10
-            }
-            
-            response = requests.post(self.api_url, headers=headers, json=data)
-            response.raise_for_status()
-            
-            result = response.json()
-            category_id = result["choices"][0]["message"]["content"].strip()
-            
+            category_ids = await self.request_category_ids(session, titles)
+        except Exception as e:
+            logger.error(f"批量分类 {len(pending)} 个产品失败: {str(e)}")
+            return results + [
+                {"_id": product.get("_id", ""), "category": None, "error": str(e)}
+                for product in pending
+            ]
+        
+        for i, product in enumerate(pending, 1):
+            category_id = category_ids.get(i)
+            if category_id is None:
+                logger.error(f"分类产品 {product.get('_id', '')} 失败: 返回结果中没有该产品")
+                results.append({"_id": product.get("_id", ""), "category": None, "error": "返回结果中没有该产品"})
+                continue
+            await cache_set(self.classify_cache_key(titles[i - 1]), category_id, CLASSIFY_CACHE_TTL)
+            results.append(self.build_classify_result(product, category_id))
+        
+        return results
+    
+    def build_classify_result(self, product: Dict, category_id: str) -> Dict:
+        """根据模型选择的分类ID生成产品的分类结果"""
+        title = product.get("title", "")
+        logger.info(f"产品 {product.get('_id', '')} ({title}) 分类为: {category_id}")
+        
+        return {
+            "_id": product.get("_id", ""),
+            "title": title,
+            "category_id": category_id,
+            # 查找完整的分类信息
+            "category_info": self._categories_by_id.get(str(category_id))
+        }
+    
+    async def request_category_ids(self, session: aiohttp.ClientSession, titles: List[str]) -> Dict[int, str]:
+        """调用DeepSeek API对多个标题分类，返回标题序号（从1开始）到分类ID的映射"""
+        titles_text = "\n".join(f"{i}. {title}" for i, title in enumerate(titles, 1))
+        prompt = f"""产品标题:
+{titles_text}
+
+请直接返回JSON数组，每个标题一项，i为标题序号，id为分类ID（只需数字），例如: [{{"i": 1, "id": 123}}, {{"i": 2, "id": 456}}]"""
+        
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        }
+        
+        data = {
+            "model": "deepseek-chat",
+            "messages": [
+                {"role": "system", "content": self._categories_prompt},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": 0.2,
+            # 每个标题的结果约需20个token
+            "max_tokens": 20 * len(titles) + 20
+        }
+        
+        result = await self.request_json(session, "POST", self.api_url, headers=headers, json=data)
+        content = result["choices"][0]["message"]["content"]
+        
+        # 模型可能用代码块包裹JSON，只取方括号内的部分
+        start, end = content.find("["), content.rfind("]")
+        if start == -1 or end < start:
+            raise ValueError(f"无法解析分类结果: {content}")
+        
+        category_ids = {}
+        for item in orjson.loads(content[start:end + 1]):
             # 尝试提取数字ID
-            import re
-            id_match = re.search(r'\d+', category_id)
+            id_match = re.search(r'\d+', str(item.get("id", "")))
             if id_match:
-                category_id = id_match.group(0)
-            
-            logger.info(f"产品 {product.get('_id', '')} ({title}) 分类为: {category_id}")
-            
-            # 查找完整的分类信息
-            category_info = next((cat for cat in categories if str(cat['id']) == str(category_id)), None)
-            
-            return {
-                "_id": product.get("_id", ""),
-                "title": title,
-                "category_id": category_id,
-                "category_info": category_info
-            }
-            
-        except Exception as e:
-            logger.error(f"分类产品 {product.get('_id', '')} 失败: {str(e)}")
-            return {"_id": product.get("_id", ""), "category": None, "error": str(e)}
+                category_ids[int(item.get("i", 0))] = id_match.group(0)
+        
+        return category_ids
     
-    def classify_products(self, database_file: str, category_file: str, output_file: str):
-        """对所有产品进行分类并保存结果"""
+    async def classify_products(self, database_file: str, category_file: str, output_file: str):
+        """对所有产品进行分类并保存结果，在请求频率限制内并发请求"""
         # 加载产品数据
         products = self.load_database_products(database_file)
         if not products:
@@ -380,33 +304,44 @@ class DeepSeekClassifier:
         if not health_categories:
             logger.error("没有找到医疗保健相关分类，退出")
             return
+        self.prepare_categories(health_categories)
         
-        # 对每个产品进行分类
-        results = []
+        # 结果逐行追加到JSONL文件，重新运行时跳过已成功分类的产品
+        results_file = os.path.splitext(output_file)[0] + ".jsonl"
+        processed_ids = self.load_processed_ids(results_file)
         total = len(products)
-        
-        for i, product in enumerate(products):
-            logger.info(f"正在处理产品 {i+1}/{total}: {product.get('_id', '')}")
-            result = self.classify_product(product, health_categories)
-            results.append(result)
+        completed = 0
+        
+        # 未处理的产品按批次合并请求，每批一次API调用
+        pending = [product for product in products if product.get("_id", "") not in processed_ids]
+        batches = [pending[i:i + CLASSIFY_BATCH_SIZE] for i in range(0, len(pending), CLASSIFY_BATCH_SIZE)]
+        logger.info(f"待分类产品 {len(pending)}/{total} 个，共 {len(batches)} 批")
+        
+        # 并发数不超过每分钟请求上限，实际发送速率仍由滑动窗口和令牌桶控制
+        semaphore = asyncio.Semaphore(self.max_requests_per_minute)
+        
+        async def process_batch(i: int, batch: List[Dict]):
+            nonlocal completed
+            async with semaphore:
+                logger.info(f"正在处理第 {i+1}/{len(batches)} 批产品")
+                results = await self.classify_batch(session, batch)
+            for result in results:
+                results_out.write(orjson.dumps(result) + b"\n")
             
-            # 每处理10个产品保存一次结果，以防程序中断
-            if (i + 1) % 10 == 0:
-                self.save_results(results, output_file)
-                logger.info(f"已保存 {i+1} 个产品的分类结果")
-        
-        # 最后保存一次完整结果
-        self.save_results(results, output_file)
-        logger.info(f"产品分类完成，共处理 {len(results)} 个产品")
-    
-    def save_results(self, results: List[Dict], output_file: str):
-        """保存分类结果到文件"""
-        try:
-            with open(output_file, "w", encoding="utf-8") as f:
-                json.dump(results, f, ensure_ascii=False, indent=2)
-            logger.info(f"分类结果已保存到: {output_file}")
-        except Exception as e:
-            logger.error(f"保存分类结果失败: {str(e)}")
+            # 每完成一批产品把缓冲区写入文件，以防程序中断
+            completed += len(results)
+            results_out.flush()
+            logger.info(f"已保存 {completed} 个产品的分类结果")
+        
+        # 整个运行期间共用一个连接池
+        connector = aiohttp.TCPConnector(limit_per_host=20, ttl_dns_cache=300)
+        with open(results_file, "ab", buffering=1024 * 1024) as results_out:
+            async with aiohttp.ClientSession(connector=connector) as session:
+                await asyncio.gather(*(process_batch(i, batch) for i, batch in enumerate(batches)))
+        
+        # 最后转换为完整的JSON文件
+        self.convert_jsonl_to_json(results_file, output_file)
+        logger.info(f"产品分类完成，本次处理 {completed} 个产品")
 
 def main():
     """主函数"""
@@ -425,7 +360,7 @@ def main():
         logger.info("开始获取京东到家商品类目...")
         
         # 从根类目开始获取
-        categories = tool.get_categories()
+        categories = asyncio.run(tool.get_all_categories())
         
         if categories:
             tool.save_categories(categories)
@@ -442,7 +377,7 @@ def main():
             sys.exit(1)
         
         logger.info("开始对产品进行分类...")
-        classifier.classify_products(args.database, category_file, args.output)
+        asyncio.run(classifier.classify_products(args.database, category_file, args.output))
 
 if __name__ == "__main__":
     main()
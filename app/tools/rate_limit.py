@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# app/tools/rate_limit.py
+
+import time
+import asyncio
+
+class TokenBucket:
+    """
+    令牌桶限流：令牌按固定速率补充，最多积累capacity个，每个请求消耗一个令牌
+    每次获取只做常数次计算，不需要保存请求时间记录
+    """
+
+    def __init__(self, rate_per_sec: float, capacity: float = 1):
+        self.rate = rate_per_sec
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+        # 并发请求依次获取令牌，避免同时按同一个令牌数计算
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        """获取一个令牌，令牌不足时等待补充"""
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class SlidingWindowCounter:
+    """
+    滑动窗口计数限流：只保存上一个窗口和当前窗口的请求数，
+    按上一个窗口与滑动窗口的重叠比例加权估算最近window秒内的请求数，内存占用为常数
+    """
+
+    def __init__(self, limit: int, window: float = 60.0):
+        self.limit = limit
+        self.window = window
+        self.prev_count = 0
+        self.curr_count = 0
+        self.curr_window_start = time.monotonic()
+        # 并发请求依次检查，避免同时按同一个计数放行
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        """估算的请求数低于上限时计数并返回，否则等待"""
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                elapsed = now - self.curr_window_start
+                if elapsed >= self.window:
+                    # 进入新窗口，若已跨过不止一个窗口，上一个窗口的请求数为0
+                    windows = int(elapsed // self.window)
+                    self.prev_count = self.curr_count if windows == 1 else 0
+                    self.curr_count = 0
+                    self.curr_window_start += windows * self.window
+                    elapsed -= windows * self.window
+
+                estimated = self.prev_count * (self.window - elapsed) / self.window + self.curr_count
+                if estimated < self.limit:
+                    self.curr_count += 1
+                    return
+
+                # 等到上一个窗口的加权部分降到足以放行，当前窗口已满时等到下一个窗口
+                if self.curr_count >= self.limit or self.prev_count == 0:
+                    wait_time = self.window - elapsed
+                else:
+                    wait_time = self.window * (1 - (self.limit - self.curr_count) / self.prev_count) - elapsed
+                await asyncio.sleep(max(wait_time, 0.01))
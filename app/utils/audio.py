@@ -1,29 +1,121 @@
 import os
-import wave
+import uuid
+import mmap
 import random
+import struct
+import hashlib
+import asyncio
 import logging
 
+from app.config import settings
+
 logger = logging.getLogger(__name__)
 
-async def save_raw_to_wav(raw_data, wav_file_path=None):
-    """将原始PCM数据保存为WAV文件"""
+# 保存的WAV固定为16kHz、16位、单声道
+WAV_SAMPLE_RATE = 16000
+WAV_CHANNELS = 1
+
+def create_wav_header(data_length, sample_rate=WAV_SAMPLE_RATE, channels=WAV_CHANNELS):
+    """
+    创建PCM格式的WAV文件头(44字节)
+    
+    参数:
+        data_length: PCM数据长度(字节)
+        sample_rate: 采样率
+        channels: 声道数
+    """
+    return struct.pack('<4sI4s4sIHHIIHH4sI',
+        b'RIFF', 36 + data_length, b'WAVE',
+        b'fmt ', 16, 1, channels, sample_rate,
+        sample_rate * channels * 2,  # 字节率
+        channels * 2,                # 块对齐
+        16,                          # 位深度
+        b'data', data_length)
+
+# 一次writev调用最多可传入的缓冲区数量
+try:
+    _IOV_MAX = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    _IOV_MAX = 1024
+
+def write_buffers(f, buffers):
+    """
+    把多个缓冲区写入文件，支持os.writev时一次写入，否则依次写入
+    
+    Args:
+        f: 以二进制方式打开的文件
+        buffers: bytes/bytearray/memoryview列表
+    """
+    if not hasattr(os, 'writev'):
+        for buf in buffers:
+            f.write(buf)
+        return
+    
+    f.flush()
+    fd = f.fileno()
+    views = [memoryview(buf).cast('B') for buf in buffers]
+    start = 0
+    while start < len(views):
+        # 每次最多传入IOV_MAX个缓冲区；writev可能只写入一部分，跳过已写入的字节后继续
+        written = os.writev(fd, views[start:start + _IOV_MAX])
+        while start < len(views) and written >= len(views[start]):
+            written -= len(views[start])
+            start += 1
+        if written:
+            views[start] = views[start][written:]
+
+def save_raw_to_wav_sync(raw_data, wav_file_path=None):
+    """
+    将原始PCM数据保存为WAV文件（同步版本，会阻塞调用线程）
+    未指定路径时按内容哈希命名临时文件，相同音频已保存过则直接复用
+    """
+    raw_view = memoryview(raw_data).cast('B')
     if wav_file_path is None:
-        # 创建临时文件目录
-        temp_dir = os.environ.get("TEMP_AUDIO_DIR", "/tmp/secretgarden")
-        os.makedirs(temp_dir, exist_ok=True)
-        wav_file_path = f"{temp_dir}/temp_{id(raw_data)}.wav"
+        name = hashlib.blake2b(raw_view, digest_size=8).hexdigest()
+        wav_file_path = f"{settings.TEMP_AUDIO_DIR}/temp_{name}.wav"
+        
+        if os.path.exists(wav_file_path):
+            try:
+                # 更新修改时间，避免复用的文件被过期清理删除
+                os.utime(wav_file_path)
+                return wav_file_path
+            except FileNotFoundError:
+                pass
         
     try:
-        with wave.open(wav_file_path, 'wb') as wav_file:
-            wav_file.setnchannels(1)
-            wav_file.setsampwidth(2)
-            wav_file.setframerate(16000)
-            wav_file.writeframes(raw_data)
+        # 格式固定，直接写入文件头和PCM数据，不经过wave模块的两次写文件头
+        # 先写入临时文件再替换，其他调用只会看到完整的文件
+        tmp_path = f"{wav_file_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as wav_file:
+            write_buffers(wav_file, [create_wav_header(len(raw_view)), raw_view])
+        os.replace(tmp_path, wav_file_path)
         return wav_file_path
     except Exception as e:
         logger.error(f"保存WAV文件失败: {str(e)}")
         return None
 
+async def save_raw_to_wav(raw_data, wav_file_path=None):
+    """将原始PCM数据保存为WAV文件，磁盘写入在线程池中执行，不阻塞事件循环"""
+    return await asyncio.to_thread(save_raw_to_wav_sync, raw_data, wav_file_path)
+
+# 触摸音频目录缓存：目录修改时间不变时复用文件列表，每个文件的PCM数据只读取一次，
+# 按块大小切分后的分块列表同样只生成一次
+_TOUCH_CACHE = {'dir': None, 'mtime': 0, 'files': [], 'data': {}, 'chunks': {}}
+
+def _read_wav_pcm(wav_file_path):
+    """用mmap映射WAV文件，按RIFF块查找data块并返回其中的PCM数据"""
+    with open(wav_file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        # 跳过RIFF头(12字节)，依次查找data块，文件中可能还有LIST等其他块
+        pos = 12
+        while pos + 8 <= len(mm):
+            chunk_id, chunk_size = struct.unpack_from('<4sI', mm, pos)
+            pos += 8
+            if chunk_id == b'data':
+                return mm[pos:pos + chunk_size]
+            # 块长度为奇数时有1字节填充
+            pos += chunk_size + (chunk_size & 1)
+    raise ValueError(f"WAV文件中没有data块: {wav_file_path}")
+
 async def get_touch_audio_data(amount: float = None, touch_dir: str = "/data/app/audio/touch"):
     """
     获取触摸事件音频数据，从指定目录中随机选择一个WAV文件
@@ -36,28 +128,61 @@ async def get_touch_audio_data(amount: float = None, touch_dir: str = "/data/app
         bytes: 音频数据，如果出错则返回None
     """
     try:
-        # 检查目录是否存在
-        if not os.path.exists(touch_dir):
+        try:
+            mtime = os.stat(touch_dir).st_mtime
+        except FileNotFoundError:
             logger.error(f"触摸音频目录不存在: {touch_dir}")
             return None
-            
-        touch_files = [f for f in os.listdir(touch_dir) if f.lower().endswith('.wav')]
+        
+        # 目录内容变化（增删文件会更新目录修改时间）时重新列出文件并清空数据缓存
+        if _TOUCH_CACHE['dir'] != touch_dir or _TOUCH_CACHE['mtime'] != mtime:
+            _TOUCH_CACHE['dir'] = touch_dir
+            _TOUCH_CACHE['mtime'] = mtime
+            _TOUCH_CACHE['files'] = [f for f in os.listdir(touch_dir) if f.lower().endswith('.wav')]
+            _TOUCH_CACHE['data'] = {}
+            _TOUCH_CACHE['chunks'] = {}
+        
+        touch_files = _TOUCH_CACHE['files']
         if not touch_files:
             logger.error(f"触摸音频目录中没有WAV文件: {touch_dir}")
             return None
             
         # 随机选择一个音频文件
         random_file = random.choice(touch_files)
-        touch_file_path = os.path.join(touch_dir, random_file)
-        
-        logger.info(f"选择触摸音频文件: {touch_file_path}")
         
-        # 读取wav音频文件为pcm数据
-        with wave.open(touch_file_path, "rb") as audio_file:
-            audio_data = audio_file.readframes(audio_file.getnframes())
+        audio_data = _TOUCH_CACHE['data'].get(random_file)
+        if audio_data is None:
+            touch_file_path = os.path.join(touch_dir, random_file)
+            logger.info(f"读取触摸音频文件: {touch_file_path}")
+            audio_data = _read_wav_pcm(touch_file_path)
+            _TOUCH_CACHE['data'][random_file] = audio_data
         
         return audio_data
         
     except Exception as e:
         logger.error(f"获取触摸音频数据时出错: {str(e)}")
-        return None 
\ No newline at end of file
+        return None
+
+async def get_touch_audio_chunks(amount: float = None, chunk_size: int = 5120, touch_dir: str = "/data/app/audio/touch"):
+    """
+    获取触摸事件音频数据并按chunk_size分块，同一文件的分块结果缓存复用
+    
+    参数:
+        amount: 触摸压力值（目前未使用）
+        chunk_size: 每块字节数
+        touch_dir: 触摸音频文件目录
+        
+    返回:
+        list[bytes]: 音频分块，如果出错则返回None
+    """
+    audio_data = await get_touch_audio_data(amount, touch_dir)
+    if not audio_data:
+        return None
+    
+    # 以缓存的音频对象作为键，bytes的哈希值计算一次后由对象自身缓存
+    key = (chunk_size, audio_data)
+    chunks = _TOUCH_CACHE['chunks'].get(key)
+    if chunks is None:
+        chunks = [audio_data[i:i + chunk_size] for i in range(0, len(audio_data), chunk_size)]
+        _TOUCH_CACHE['chunks'][key] = chunks
+    return chunks
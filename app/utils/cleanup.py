@@ -0,0 +1,70 @@
+import os
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 扫描和删除文件都是阻塞的文件系统操作，放到独立线程池中执行
+_SWEEP_POOL = ThreadPoolExecutor(max_workers=2)
+
+def _find_expired_files(directory, cutoff):
+    """扫描目录下修改时间早于cutoff的文件（不递归子目录）"""
+    expired = []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False) and entry.stat(follow_symlinks=False).st_mtime < cutoff:
+                    expired.append(entry.path)
+    except FileNotFoundError:
+        pass
+    return expired
+
+def _delete_files(paths):
+    """删除一批文件，返回实际删除的数量"""
+    deleted = 0
+    for path in paths:
+        try:
+            os.unlink(path)
+            deleted += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"删除过期文件失败: {path}, {str(e)}")
+    return deleted
+
+async def sweep_directory(directory, ttl_seconds, batch_size, pause_ms):
+    """分批删除目录中的过期文件，批次之间暂停以免长时间占用文件系统"""
+    loop = asyncio.get_running_loop()
+    cutoff = time.time() - ttl_seconds
+    expired = await loop.run_in_executor(_SWEEP_POOL, _find_expired_files, directory, cutoff)
+    
+    deleted = 0
+    for i in range(0, len(expired), batch_size):
+        deleted += await loop.run_in_executor(_SWEEP_POOL, _delete_files, expired[i:i + batch_size])
+        await asyncio.sleep(pause_ms / 1000)
+    
+    if deleted:
+        logger.info(f"已清理过期文件: {directory}, 数量: {deleted}")
+    return deleted
+
+async def sweep_loop(directories=None):
+    """定期清理音频、处理结果和临时WAV目录中的过期文件"""
+    if directories is None:
+        directories = [settings.AUDIO_DIR, settings.PROCESSED_DIR, settings.TEMP_AUDIO_DIR]
+    
+    while True:
+        for directory in directories:
+            try:
+                await sweep_directory(
+                    directory,
+                    ttl_seconds=settings.CLEANUP_FILE_TTL_HOURS * 3600,
+                    batch_size=settings.CLEANUP_BATCH_SIZE,
+                    pause_ms=settings.CLEANUP_PAUSE_MS
+                )
+            except Exception as e:
+                logger.error(f"清理目录失败: {directory}, {str(e)}")
+        await asyncio.sleep(settings.CLEANUP_INTERVAL_MINUTES * 60)
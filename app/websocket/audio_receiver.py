@@ -10,6 +10,7 @@ import struct
 import logging
 from datetime import datetime
 import os
+from app.utils.audio import create_wav_header, write_buffers
 
 class AudioReceiver:
     def __init__(self, sample_rate=16000, channels=1, output_dir="./audio_output"):
@@ -24,9 +25,14 @@ class AudioReceiver:
         self.sample_rate = sample_rate
         self.channels = channels
         self.output_dir = output_dir
-        self.audio_data = bytearray()
+        # 收到的PCM数据块按顺序保存，保存文件时一次写入，不反复扩容拼接
+        self.audio_chunks = []
+        self.data_length = 0
         self.session_id = None
         
+        # 采样率和声道数固定，WAV文件头只有两个长度字段随数据变化，预先生成模板
+        self._hdr_template = create_wav_header(0, sample_rate, channels)
+        
         # 确保输出目录存在
         os.makedirs(output_dir, exist_ok=True)
         
@@ -36,33 +42,34 @@ class AudioReceiver:
     
     def create_wav_header(self, data_length):
         """
-        创建WAV文件头
+        创建WAV文件头，复制模板后只写入两个长度字段
         
         Args:
             data_length: PCM数据长度(字节)
             
         Returns:
-            bytes: WAV文件头(44字节)
+            bytearray: WAV文件头(44字节)
         """
-        # WAV文件头格式
-        header = struct.pack('<4sI4s', b'RIFF', 36 + data_length, b'WAVE')
-        
-        # fmt子块
-        fmt_chunk = struct.pack('<4sIHHIIHH',
-            b'fmt ',          # 子块ID
-            16,               # 子块大小
-            1,                # 音频格式 (1=PCM)
-            self.channels,    # 声道数
-            self.sample_rate, # 采样率
-            self.sample_rate * self.channels * 2,  # 字节率
-            self.channels * 2,  # 块对齐
-            16                # 位深度
-        )
-        
-        # data子块头
-        data_header = struct.pack('<4sI', b'data', data_length)
+        header = bytearray(self._hdr_template)
+        struct.pack_into('<I', header, 4, 36 + data_length)
+        struct.pack_into('<I', header, 40, data_length)
+        return header
+    
+    def add_audio_chunk(self, data):
+        """
+        追加一块PCM数据
         
-        return header + fmt_chunk + data_header
+        Args:
+            data: PCM数据(bytes)
+        """
+        if data:
+            self.audio_chunks.append(data)
+            self.data_length += len(data)
+    
+    def clear(self):
+        """清空已接收的PCM数据"""
+        self.audio_chunks = []
+        self.data_length = 0
     
     def save_wav_file(self, filename=None):
         """
@@ -71,7 +78,7 @@ class AudioReceiver:
         Args:
             filename: 输出文件名，如果为None则自动生成
         """
-        if not self.audio_data:
+        if not self.data_length:
             self.logger.warning("没有音频数据可保存")
             return
         
@@ -84,16 +91,15 @@ class AudioReceiver:
         
         try:
             # 创建WAV文件头
-            wav_header = self.create_wav_header(len(self.audio_data))
+            wav_header = self.create_wav_header(self.data_length)
             
-            # 写入WAV文件
+            # 写入WAV文件：文件头和音频数据一次系统调用写入，不拼接音频数据
             with open(filepath, 'wb') as f:
-                f.write(wav_header)
-                f.write(self.audio_data)
+                write_buffers(f, [wav_header, *self.audio_chunks])
             
             self.logger.info(f"音频已保存: {filepath}")
-            self.logger.info(f"文件大小: {len(self.audio_data)} bytes")
-            self.logger.info(f"时长: {len(self.audio_data) / (self.sample_rate * self.channels * 2):.2f}秒")
+            self.logger.info(f"文件大小: {self.data_length} bytes")
+            self.logger.info(f"时长: {self.data_length / (self.sample_rate * self.channels * 2):.2f}秒")
             
         except Exception as e:
             self.logger.error(f"保存WAV文件失败: {e}")
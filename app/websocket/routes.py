@@ -1,42 +1,402 @@
-import json
+import orjson
+import os
 import logging
 import base64
+from dataclasses import dataclass, field
 from typing import Dict, Optional
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 import uuid
+import struct
 import asyncio
-from app.utils.audio import save_raw_to_wav, get_touch_audio_data
+from collections import deque
+from app.config import settings
+from app.utils.audio import save_raw_to_wav, get_touch_audio_chunks
 import wave
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# 发往AI后端的音频消息以16字节的会话ID/呼叫ID开头
+UUID_LEN = 16
+
+@dataclass(slots=True)
+class AudioSendBuffer:
+    """
+    发往AI后端的音频缓冲区：按发送块大小预先分配，前16字节预留给消息头，创建时写入会话ID，
+    收到的音频直接复制到其后，发送后从头复用，不再逐块扩容和重新分配
+    """
+    capacity: int
+    id_bytes: bytes
+    buf: bytearray = field(init=False)
+    view: memoryview = field(init=False)
+    start: int = field(init=False, default=0)
+    write_pos: int = field(init=False, default=UUID_LEN)
+    
+    def __post_init__(self):
+        self.buf = bytearray(UUID_LEN + self.capacity)
+        self.view = memoryview(self.buf)
+        self.set_header(self.id_bytes)
+    
+    def set_header(self, header: bytes):
+        """设置消息头（会话ID或短帧编号），紧贴音频数据写入预留区域的末尾"""
+        self.start = UUID_LEN - len(header)
+        self.view[self.start:UUID_LEN] = header
+    
+    def __len__(self):
+        return self.write_pos - UUID_LEN
+    
+    def full(self) -> bool:
+        return self.write_pos == len(self.buf)
+    
+    def write(self, data) -> memoryview:
+        """复制音频数据直到缓冲区写满，返回未能写入的剩余部分"""
+        data = memoryview(data).cast('B')
+        n = min(len(data), len(self.buf) - self.write_pos)
+        self.view[self.write_pos:self.write_pos + n] = data[:n]
+        self.write_pos += n
+        return data[n:]
+    
+    def take(self) -> bytes:
+        """取出消息头加已缓冲的音频作为一条消息，并清空缓冲区"""
+        message = bytes(self.view[self.start:self.write_pos])
+        self.write_pos = UUID_LEN
+        return message
+    
+    def clear(self):
+        self.write_pos = UUID_LEN
+
+# 短帧头：2字节的连接编号
+WS_ID_HEADER = struct.Struct("<H")
+
+class FrameIdAllocator:
+    """
+    为会话分配2字节的连接编号（1-65535）。AI后端在初始化消息中指定short_frames时，
+    音频消息以编号代替16字节的会话ID开头，编号与会话ID的对应关系只在会话建立时发送一次
+    """
+    
+    def __init__(self):
+        self.next_id = 1
+        self.id_to_key: Dict[int, bytes] = {}
+        self.key_to_id: Dict[bytes, int] = {}
+    
+    def assign(self, key: bytes) -> int:
+        """为会话分配编号，已分配时返回原编号"""
+        ws_id = self.key_to_id.get(key)
+        if ws_id is not None:
+            return ws_id
+        if len(self.id_to_key) >= 0xFFFF:
+            raise RuntimeError("连接编号已用完")
+        while True:
+            ws_id = self.next_id
+            self.next_id = ws_id % 0xFFFF + 1
+            if ws_id not in self.id_to_key:
+                break
+        self.id_to_key[ws_id] = key
+        self.key_to_id[key] = ws_id
+        return ws_id
+    
+    def release(self, key: bytes) -> Optional[int]:
+        """释放会话的编号，返回释放的编号，未分配时返回None"""
+        ws_id = self.key_to_id.pop(key, None)
+        if ws_id is not None:
+            del self.id_to_key[ws_id]
+        return ws_id
+    
+    def lookup(self, frame: bytes) -> Optional[bytes]:
+        """按消息开头的编号查找会话ID的16字节形式"""
+        return self.id_to_key.get(WS_ID_HEADER.unpack_from(frame)[0])
+    
+    def clear(self):
+        self.id_to_key.clear()
+        self.key_to_id.clear()
+
+# 发给AI后端的发送队列最多缓存的消息数，超过时发送方等待
+SEND_QUEUE_SIZE = 32
+# 发给前端/FreeSwitch的播放队列最多缓存的字节数，约为20秒24kHz、16位单声道的PCM音频；
+# 对端接收过慢导致积压超过上限时关闭连接，而不是从一句话中间丢弃音频
+SEND_QUEUE_MAX_BYTES = 1024 * 1024
+# 播放队列溢出时关闭连接使用的关闭码（1013: Try Again Later）
+WS_CLOSE_OVERLOADED = 1013
+
+class PeerSender:
+    """
+    一个WebSocket连接的发送队列：由单独的写任务依次发送，其他协程只把消息放入队列，
+    不会因为对端接收缓慢而互相阻塞。两种放入方式：
+    send() 用于发给前端/FreeSwitch的播放音频和控制消息，不丢弃任何消息，排队超过SEND_QUEUE_MAX_BYTES时关闭连接，
+    由连接的处理协程按断开清理会话；
+    put() 用于发给AI后端的会话音频，队列满时等待（背压），不丢弃任何会话的语音
+    """
+    
+    __slots__ = ('ws', 'name', 'pending', 'queued_bytes', 'ready', 'space', 'closed', 'task')
+    
+    def __init__(self, ws: WebSocket, name: str):
+        self.ws = ws
+        self.name = name
+        self.pending = deque()
+        self.queued_bytes = 0
+        self.ready = asyncio.Event()
+        # 队列有空位时置位，唤醒在put()中等待的协程
+        self.space = asyncio.Event()
+        self.closed = False
+        self.task = asyncio.create_task(self._writer())
+    
+    def send(self, message) -> bool:
+        """
+        放入一条消息，str以文本帧发送，其他以二进制帧发送；写任务已退出时丢弃消息并返回False
+        排队的数据超过SEND_QUEUE_MAX_BYTES时停止写任务并关闭连接，同样返回False
+        """
+        if self.closed:
+            return False
+        size = len(message)
+        if self.pending and self.queued_bytes + size > SEND_QUEUE_MAX_BYTES:
+            logger.error(f"{self.name}接收过慢，发送队列积压 {self.queued_bytes} 字节，关闭连接")
+            self.closed = True
+            self.pending.clear()
+            self.queued_bytes = 0
+            self.space.set()
+            # 停止写任务（可能正阻塞在向慢速对端的发送上），由新任务关闭连接，close()会等待该任务
+            self.task.cancel()
+            self.task = asyncio.create_task(self._close_overloaded())
+            return False
+        self.queued_bytes += size
+        self.pending.append(message)
+        self.ready.set()
+        return True
+    
+    async def put(self, message) -> bool:
+        """放入一条消息，队列已满时等待写任务发出消息后再放入；写任务已退出时返回False"""
+        while len(self.pending) >= SEND_QUEUE_SIZE and not self.closed:
+            self.space.clear()
+            await self.space.wait()
+        if self.closed:
+            return False
+        self.queued_bytes += len(message)
+        self.pending.append(message)
+        self.ready.set()
+        return True
+    
+    async def _writer(self):
+        try:
+            while True:
+                if not self.pending:
+                    self.ready.clear()
+                    await self.ready.wait()
+                    continue
+                message = self.pending.popleft()
+                self.queued_bytes -= len(message)
+                self.space.set()
+                if isinstance(message, str):
+                    await self.ws.send_text(message)
+                else:
+                    await self.ws.send_bytes(message)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"{self.name}发送失败: {str(e)}")
+        finally:
+            # 写任务退出后连接已不可用，丢弃排队的消息，之后的消息不再放入队列
+            self.closed = True
+            self.pending.clear()
+            self.queued_bytes = 0
+            # 唤醒所有在put()中等待的协程，它们会看到closed并返回False
+            self.space.set()
+    
+    async def _close_overloaded(self):
+        """播放队列溢出时关闭连接，连接的处理协程收到断开后清理会话"""
+        try:
+            await self.ws.close(code=WS_CLOSE_OVERLOADED)
+        except Exception as e:
+            logger.warning(f"{self.name}关闭连接失败: {str(e)}")
+    
+    async def close(self):
+        """停止写任务，队列中未发送的消息丢弃"""
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+@dataclass(slots=True)
+class SessionState:
+    """
+    一个前端会话或FreeSwitch呼叫的全部状态：连接及其发送队列、发往AI后端的音频缓冲区和配置，
+    收到消息时按会话ID查找一次即可取得
+    """
+    ws: WebSocket
+    client_id: str
+    session_id: str
+    audio_buffer: AudioSendBuffer
+    sender: PeerSender = field(init=False)
+    # 以下只用于/call接口：音频格式配置、AI后端到FreeSwitch的输出缓冲和调试转储文件；
+    # 协商二进制音频帧时输出缓冲开头是帧头，output_start为帧头长度，其后为音频
+    audio_config: dict = field(default_factory=dict)
+    output_buffer: bytearray = field(default_factory=bytearray)
+    output_start: int = 0
+    dump_file: Optional[object] = None
+    
+    def __post_init__(self):
+        self.sender = PeerSender(self.ws, f"客户端{self.client_id}")
+    
+    @property
+    def id_bytes(self) -> bytes:
+        return self.audio_buffer.id_bytes
+    
+    @property
+    def output_len(self) -> int:
+        """输出缓冲中待发送的音频字节数"""
+        return len(self.output_buffer) - self.output_start
+
+class ConnectionRegistry:
+    """
+    一个WebSocket接口的全部连接：唯一的AI后端连接，以及按会话ID的16字节形式索引的会话状态
+    /proxy和/call各使用一个实例。所有修改都在事件循环中完成，检查与修改之间没有await，不需要加锁
+    """
+    
+    def __init__(self, id_field: str):
+        # AI后端消息中会话ID的字段名：/proxy为session_id，/call为call_id
+        self.id_field = id_field
+        self.backend: Optional[WebSocket] = None
+        # 发往AI后端的消息都经过同一个发送队列，会话编号通知与音频消息保持顺序；
+        # 队列满时发送方等待而不是丢弃，AI后端短暂卡顿不会丢失任何会话的语音
+        self.backend_sender: Optional[PeerSender] = None
+        # AI后端是否协商使用短帧头，及会话的连接编号
+        self.short_frames = False
+        self.frame_ids = FrameIdAllocator()
+        self.sessions: Dict[bytes, SessionState] = {}
+    
+    async def attach_backend(self, backend: WebSocket, short_frames: bool):
+        """设置AI后端连接；指定short_frames时为已连接的会话分配编号，音频消息改用2字节编号开头"""
+        self.backend = backend
+        self.backend_sender = PeerSender(backend, "AI后端")
+        self.short_frames = short_frames
+        if short_frames:
+            for state in list(self.sessions.values()):
+                await self.open_short_frames(state)
+    
+    async def detach_backend(self, backend: WebSocket):
+        """
+        清除AI后端连接，新的AI后端连接重新协商帧头，已连接的会话恢复以会话ID开头
+        backend已不是当前的AI后端连接时不做处理，避免旧连接的清理影响新连接
+        """
+        if self.backend is not backend:
+            return
+        backend_sender = self.backend_sender
+        self.backend = None
+        self.backend_sender = None
+        self.short_frames = False
+        self.frame_ids.clear()
+        for state in self.sessions.values():
+            state.audio_buffer.set_header(state.id_bytes)
+        if backend_sender is not None:
+            await backend_sender.close()
+    
+    async def add(self, state: SessionState):
+        self.sessions[state.id_bytes] = state
+        if self.backend is not None and self.short_frames:
+            await self.open_short_frames(state)
+    
+    async def remove(self, state: SessionState):
+        # 同一会话ID已被新的连接使用时不删除新连接的状态
+        if self.sessions.get(state.id_bytes) is state:
+            del self.sessions[state.id_bytes]
+            await self.close_short_frames(state)
+        await state.sender.close()
+    
+    async def send_to_backend(self, message) -> bool:
+        """
+        把消息放入AI后端的发送队列，AI后端未连接时返回False
+        发送已失败（写任务已退出）时清除并关闭该AI后端连接，同样返回False
+        """
+        backend = self.backend
+        backend_sender = self.backend_sender
+        if backend_sender is None:
+            return False
+        if await backend_sender.put(message):
+            return True
+        
+        logger.warning("AI后端发送失败，断开AI后端连接")
+        await self.detach_backend(backend)
+        try:
+            await backend.close()
+        except Exception:
+            pass
+        return False
+    
+    def frame_header_len(self) -> int:
+        """AI后端音频消息的帧头长度"""
+        return WS_ID_HEADER.size if self.short_frames else UUID_LEN
+    
+    def session_for_frame(self, binary_data: bytes) -> Optional[SessionState]:
+        """按AI后端音频消息开头的会话ID或连接编号查找会话，直接按字节查找，不转换为字符串"""
+        if self.short_frames:
+            key = self.frame_ids.lookup(binary_data)
+            return self.sessions.get(key) if key is not None else None
+        return self.sessions.get(binary_data[:UUID_LEN])
+    
+    async def open_short_frames(self, state: SessionState):
+        """为会话分配编号并通知AI后端，之后该会话的音频消息以2字节编号开头"""
+        ws_id = self.frame_ids.assign(state.id_bytes)
+        state.audio_buffer.set_header(WS_ID_HEADER.pack(ws_id))
+        await self.send_to_backend(orjson.dumps({"type": "session_open", self.id_field: state.session_id, "ws_id": ws_id}).decode())
+    
+    async def close_short_frames(self, state: SessionState):
+        """释放会话的编号，AI后端仍连接时通知其删除对应关系"""
+        ws_id = self.frame_ids.release(state.id_bytes)
+        if ws_id is not None:
+            await self.send_to_backend(orjson.dumps({"type": "session_close", self.id_field: state.session_id, "ws_id": ws_id}).decode())
+
 # 音频数据缓冲字典，用于存储每个客户端的音频片段
 audio_buffers = {}
 # 录音会话标识
 recording_sessions = {}
 
-# 前端客户端连接管理
-frontend_clients: Dict[str, WebSocket] = {}
-# AI后端连接管理
-ai_backend: Optional[WebSocket] = None
-# 前端会话ID到客户端映射
-session_to_client: Dict[str, str] = {}
-# 客户端ID到会话ID映射
-client_to_session: Dict[str, str] = {}
-# 会话音频数据缓冲
-session_audio_buffers: Dict[str, bytearray] = {}
-
-# /call接口独立的连接管理
-call_freeswitch_clients: Dict[str, WebSocket] = {}
-call_ai_backend: Optional[WebSocket] = None
-call_to_client: Dict[str, str] = {}
-client_to_call: Dict[str, str] = {}
-call_audio_buffers: Dict[str, bytearray] = {}
-# FreeSwitch客户端音频格式配置
-call_audio_configs: Dict[str, dict] = {}
-# AI后端到前端的音频输出缓冲区（64KB缓冲）
-call_output_buffers: Dict[str, bytearray] = {}
+# /proxy接口的AI后端和前端会话
+proxy_connections = ConnectionRegistry("session_id")
+# /call接口独立的AI后端和FreeSwitch呼叫
+call_connections = ConnectionRegistry("call_id")
+# FreeSwitch音频每16KB发送一次给AI后端
+CALL_SEND_CHUNK_SIZE = 16384
+
+# ===== 固定内容的控制消息，预先序列化避免每次发送时重复序列化 =====
+def _frame(message_type, content):
+    """序列化一条只含type和content的消息"""
+    return orjson.dumps({"type": message_type, "content": content}).decode()
+
+HEARTBEAT_ACK = orjson.dumps({"type": "heartbeat_ack"}).decode()
+ERR_MISSING_CLIENT_TYPE = _frame("error", "缺少客户端类型标识")
+ERR_AI_BACKEND_EXISTS = _frame("error", "已存在AI后端连接")
+
+# 每个FreeSwitch连接建立时发送的欢迎音频，启动时读取、编码并序列化一次
+def _load_welcome_frame(path="welcome.wav"):
+    """读取欢迎音频并生成streamAudio消息，文件不存在时返回None"""
+    try:
+        with open(path, "rb") as f:
+            audio_data = base64.b64encode(f.read()).decode('utf-8')
+    except FileNotFoundError:
+        logger.warning(f"欢迎音频文件不存在: {path}")
+        return None
+    
+    logger.info(f"欢迎音频数据长度: {len(audio_data)}")
+    return orjson.dumps({
+        "type": "streamAudio",
+        "data": {
+            "audioDataType": "wav",
+            "sampleRate": 24000,
+            "channels": 1,
+            "bitDepth": 16,
+            "audioData": audio_data
+        }
+    }).decode()
+
+WELCOME_FRAME = _load_welcome_frame()
+
+# 二进制音频帧头: 呼叫ID(16字节UUID) + 格式编码 + 采样率 + 声道数 + 位深度，后接音频数据
+CALL_AUDIO_HEADER = struct.Struct("<16sBHBB")
+AUDIO_FORMAT_CODES = {"raw": 0, "wav": 1, "mp3": 2, "ogg": 3}
+# AI后端输出的音频格式固定为24kHz、单声道、16位PCM
+CALL_OUTPUT_SAMPLE_RATE = 24000
+CALL_OUTPUT_CHANNELS = 1
+CALL_OUTPUT_BIT_DEPTH = 16
 
 def merge_wav_audio_data(existing_data: bytearray, new_audio_data: bytes) -> bytearray:
     """
@@ -95,6 +455,80 @@ def create_wav_from_frames(audio_frames: bytes, sample_rate: int = 24000, channe
     
     return wav_io.getvalue()
 
+def send_call_audio(state: SessionState):
+    """
+    把输出缓冲中AI后端输出的PCM音频放入FreeSwitch客户端的发送队列，并清空输出缓冲
+    协商了二进制音频帧的呼叫缓冲开头已是帧头，整体作为一条消息发送，不再拼接帧头和音频；
+    否则封装为WAV并base64编码后以JSON发送
+    """
+    if state.output_start:
+        state.sender.send(bytes(state.output_buffer))
+    else:
+        state.sender.send(_stream_audio_frame(state.output_buffer))
+    # 只截断音频部分，帧头保留在缓冲区开头
+    del state.output_buffer[state.output_start:]
+
+def _stream_audio_frame(audio_frames) -> str:
+    """把PCM音频封装为WAV并序列化为streamAudio消息"""
+    complete_wav_data = create_wav_from_frames(
+        audio_frames,
+        sample_rate=CALL_OUTPUT_SAMPLE_RATE,
+        channels=CALL_OUTPUT_CHANNELS,
+        sample_width=CALL_OUTPUT_BIT_DEPTH // 8
+    )
+    audio_message = {
+        "type": "streamAudio",
+        "data": {
+            "audioDataType": "wav",
+            "sampleRate": CALL_OUTPUT_SAMPLE_RATE,
+            "channels": CALL_OUTPUT_CHANNELS,
+            "bitDepth": CALL_OUTPUT_BIT_DEPTH,
+            "audioData": base64.b64encode(complete_wav_data).decode('utf-8')
+        }
+    }
+    return orjson.dumps(audio_message).decode()
+
+async def receive_frame(websocket: WebSocket):
+    """
+    接收一帧消息，二进制帧返回bytes，文本帧返回str，连接断开时抛出WebSocketDisconnect
+    直接取ASGI消息中的数据字段，调用方按返回值类型分支，不再逐个判断"text"/"bytes"是否在消息中
+    """
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    data = message.get("bytes")
+    return data if data is not None else message["text"]
+
+# 触摸音频分块发送：每块约5KB，块之间间隔50毫秒控制发送速率
+TOUCH_CHUNK_SIZE = 5120
+TOUCH_CHUNK_INTERVAL = 0.05
+
+# 正在运行的后台发送任务，保存引用避免任务在完成前被回收
+background_tasks = set()
+
+def start_background_task(coro):
+    """启动后台任务，任务结束后自动移除引用"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def send_paced(sender: PeerSender, chunks, interval: float):
+    """
+    按固定间隔依次把音频块放入发送队列，每块的发送时间按开始时间计算，不会因发送耗时而累积延迟
+    """
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    try:
+        for i, chunk in enumerate(chunks):
+            delay = start + i * interval - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            sender.send(chunk)
+        logger.info(f"触摸音频发送完成，共 {len(chunks)} 块")
+    except Exception as e:
+        logger.warning(f"触摸音频发送中断: {str(e)}")
+
 
 @router.websocket("/proxy")
 async def proxy_websocket_endpoint(websocket: WebSocket):
@@ -108,37 +542,29 @@ async def proxy_websocket_endpoint(websocket: WebSocket):
     
     try:
         frame_size_20ms = 16000 * 2 * 1 * 0.02  # 计算20ms对应的字节数：640 bytes
-        target_chunk_size = frame_size_20ms * 25  # 例如，目标：每1秒（50帧）发送一次
+        target_chunk_size = int(frame_size_20ms * 25)  # 目标：每25帧（0.5秒）发送一次
 
         # 等待连接标识消息
         init_message = await websocket.receive_text()
         logger.info(f"初始化消息: {init_message}")
-        init_data = json.loads(init_message)
+        init_data = orjson.loads(init_message)
         
         if "client_type" not in init_data:
-            await websocket.send_text(json.dumps({
-                "type": "error",
-                "content": "缺少客户端类型标识"
-            }))
+            await websocket.send_text(ERR_MISSING_CLIENT_TYPE)
             await websocket.close()
             return
             
         client_type = init_data["client_type"]
         
         if client_type == "ai_backend":
-            global ai_backend
-            
             # 如果已有AI后端连接，拒绝新连接
-            if ai_backend is not None:
-                await websocket.send_text(json.dumps({
-                    "type": "error",
-                    "content": "已存在AI后端连接"
-                }))
+            if proxy_connections.backend is not None:
+                await websocket.send_text(ERR_AI_BACKEND_EXISTS)
                 await websocket.close()
                 return
                 
-            # 设置全局AI后端连接
-            ai_backend = websocket
+            # 设置AI后端连接，AI后端指定short_frames时音频消息改用2字节编号开头
+            await proxy_connections.attach_backend(websocket, bool(init_data.get("short_frames")))
             logger.info("AI后端已连接")
             
             try:
@@ -147,66 +573,44 @@ async def proxy_websocket_endpoint(websocket: WebSocket):
                     try:
                         # 在接收消息前记录日志
                         # logger.info(f"准备接收来自AI后端的消息")
-                        message = await websocket.receive()
+                        message = await receive_frame(websocket)
                         
                         # 检查消息类型
-                        if "text" in message:
+                        if isinstance(message, str):
                             try:
-                                data = json.loads(message["text"])
+                                data = orjson.loads(message)
                                 
                                 if "type" in data and data.get("type") == "heartbeat":
-                                    await ai_backend.send_text(json.dumps({"type": "heartbeat_ack"}))
+                                    await proxy_connections.send_to_backend(HEARTBEAT_ACK)
                                 elif "session_id" in data and "type" in data and data.get("type") == "text":
-                                    session_id = str(uuid.UUID(data["session_id"]))
-                                    if session_id in session_to_client:
-                                        client_id = session_to_client[session_id]
-                                        
-                                        if client_id in frontend_clients:
-                                            frontend_ws = frontend_clients[client_id]
-                                            await frontend_ws.send_text(json.dumps({
-                                                "type": "text",
-                                                "content": data["content"]
-                                            }))
-                                            logger.info(f"已将AI消息转发至前端客户端 {client_id}")
-                                        else:
-                                            logger.warning(f"找不到客户端ID: {client_id}")
+                                    session_id = uuid.UUID(data["session_id"])
+                                    state = proxy_connections.sessions.get(session_id.bytes)
+                                    if state is not None:
+                                        state.sender.send(_frame("text", data["content"]))
+                                        logger.info(f"已将AI消息转发至前端客户端 {state.client_id}")
                                     else:
                                         logger.warning(f"找不到会话ID: {session_id}")
                                 else:
                                     logger.warning("AI后端消息缺少session_id或type")
                                     
-                            except json.JSONDecodeError:
+                            except orjson.JSONDecodeError:
                                 logger.error("无法解析AI后端发送的JSON消息")
                         
-                        elif "bytes" in message:
-                            binary_data = message["bytes"]
+                        else:
+                            binary_data = message
                             
-                            if len(binary_data) > 16:
-                                # 提取会话ID（会话ID是UUID格式，存储在前16字节）
-                                session_id_bytes = binary_data[:16]
-                                audio_data = binary_data[16:]
+                            # 帧头为16字节的会话ID，或协商短帧头时为2字节的连接编号
+                            header_len = proxy_connections.frame_header_len()
+                            if len(binary_data) > header_len:
+                                audio_data = binary_data[header_len:]
                                 
-                                try:
-                                    session_id = str(uuid.UUID(bytes=session_id_bytes))
-                                    # logger.info(f"接收到AI后端音频数据: {len(audio_data)} 字节, 会话ID: {session_id}")
-                                        
-                                    # 查找对应的前端客户端
-                                    if session_id in session_to_client:
-                                        client_id = session_to_client[session_id]
-                                        
-                                        if client_id in frontend_clients:
-                                            frontend_ws = frontend_clients[client_id]
-                                            try:
-                                                await frontend_ws.send_bytes(audio_data)
-                                                # logger.info(f"已将AI处理的音频数据转发至前端客户端: {len(audio_data)} 字节, 会话ID: {session_id}")
-                                            except Exception as e:
-                                                logger.error(f"转发音频数据到前端客户端失败: {str(e)}, 会话ID: {session_id}")
-                                        else:
-                                            logger.warning(f"找不到客户端ID: {client_id}")
-                                    else:
-                                        logger.warning(f"转发音频数据到前端客户端失败,找不到会话ID: {session_id}")
-                                except ValueError:
-                                    logger.error("无法解析会话ID")
+                                # 查找对应的前端会话
+                                state = proxy_connections.session_for_frame(binary_data)
+                                if state is not None:
+                                    state.sender.send(audio_data)
+                                    # logger.info(f"已将AI处理的音频数据转发至前端客户端: {len(audio_data)} 字节, 会话ID: {state.session_id}")
+                                else:
+                                    logger.warning(f"转发音频数据到前端客户端失败,找不到会话: {binary_data[:header_len].hex()}")
                             else:
                                 logger.error("转发音频数据到前端客户端失败,音频数据格式不正确")
                     except WebSocketDisconnect:
@@ -215,30 +619,25 @@ async def proxy_websocket_endpoint(websocket: WebSocket):
             except Exception as e:
                 logger.error(f"AI后端连接错误: {str(e)}")
             finally:
-                ai_backend = None
+                await proxy_connections.detach_backend(websocket)
                 logger.info("AI后端连接已关闭")
                 
         elif client_type == "frontend":
             client_id = f"client_{id(websocket)}"
-            session_id = str(uuid.uuid4())
-            
-            # 记录映射关系
-            frontend_clients[client_id] = websocket
-            session_to_client[session_id] = client_id
-            client_to_session[client_id] = session_id
+            session_uuid = uuid.uuid4()
+            session_id = str(session_uuid)
             
-            # 初始化音频缓冲区
-            session_audio_buffers[session_id] = bytearray()
+            # 记录会话状态，初始化音频缓冲区
+            state = SessionState(websocket, client_id, session_id, AudioSendBuffer(target_chunk_size, session_uuid.bytes))
+            audio_buffer = state.audio_buffer
+            await proxy_connections.add(state)
             
             logger.info(f"前端客户端已连接: ID={client_id}, 会话ID={session_id}")
             
             # 向前端发送会话信息
-            await websocket.send_text(json.dumps({
-                "type": "session_info",
-                "content": {
-                    "session_id": session_id,
-                    "client_id": client_id
-                }
+            state.sender.send(_frame("session_info", {
+                "session_id": session_id,
+                "client_id": client_id
             }))
             
             try:
@@ -247,7 +646,7 @@ async def proxy_websocket_endpoint(websocket: WebSocket):
                         # logger.debug(f"准备接收来自前端客户端{client_id}的消息")
                         # 使用带超时的接收来防止消息堆积
                         try:
-                            message = await asyncio.wait_for(websocket.receive(), timeout=1.0)  # 1秒超时
+                            message = await asyncio.wait_for(receive_frame(websocket), timeout=1.0)  # 1秒超时
                             
                             # 检查接收队列大小（如果可用）
                             if hasattr(websocket, '_queue') and websocket._queue.qsize() > 100:  # 队列过大警告阈值
@@ -258,35 +657,24 @@ async def proxy_websocket_endpoint(websocket: WebSocket):
                         except asyncio.TimeoutError:
                             logger.debug("接收超时，继续下一次接收")
                             continue
+                        except WebSocketDisconnect:
+                            raise
                         except Exception as e:
                             logger.error(f"接收消息时发生错误: {str(e)}")
                             raise
                         
-                        if "bytes" in message:
-                            audio_data = message["bytes"]
-                            session_audio_buffers[session_id].extend(audio_data)
+                        if not isinstance(message, str):
+                            remaining = audio_buffer.write(message)
                             
-                            # 检查缓冲区大小是否超过32k
-                            if len(session_audio_buffers[session_id]) >= target_chunk_size:  # 16k = 16 * 1024
-                                if ai_backend is not None:
-                                    complete_audio_data = bytes(session_audio_buffers[session_id])
-                                    session_id_bytes = uuid.UUID(session_id).bytes
-                                    data_with_session = session_id_bytes + complete_audio_data
-
-                                    try:
-                                        await ai_backend.send_bytes(data_with_session)
-                                        # logger.info(f"音频数据发送成功: {len(complete_audio_data)} 字节, 会话ID: {session_id}")
-                                    except Exception as e:
-                                        logger.error(f"音频数据发送失败: {str(e)}, 会话ID: {session_id}")
-
-                                    # 清空缓冲区
-                                    session_audio_buffers[session_id] = bytearray()
-                                # else:
-                                #     logger.warning("AI后端未连接，无法发送音频数据")
+                            # 缓冲区写满时发送，一条消息放不下的部分写入清空后的缓冲区
+                            while audio_buffer.full():
+                                # AI后端未连接时不放入队列，已缓冲的音频直接丢弃
+                                await proxy_connections.send_to_backend(audio_buffer.take())
+                                remaining = audio_buffer.write(remaining)
                             
-                        elif "text" in message:
+                        else:
                             try:
-                                data = json.loads(message["text"])
+                                data = orjson.loads(message)
                                 
                                 if "command" in data:
                                     command = data["command"]
@@ -294,37 +682,24 @@ async def proxy_websocket_endpoint(websocket: WebSocket):
                                     if command == "audio_complete":
                                         pass
                                         # 前端发送完所有音频数据
-                                        if len(session_audio_buffers[session_id]) > 0:
-                                            if ai_backend is None:
+                                        if len(audio_buffer) > 0:
+                                            if proxy_connections.backend is None:
                                                 continue
                                             
-                                            complete_audio_data = bytes(session_audio_buffers[session_id])
-                                            session_id_bytes = uuid.UUID(session_id).bytes
-                                            data_with_session = session_id_bytes + complete_audio_data
-
-                                            try:
-                                                await ai_backend.send_bytes(data_with_session)
-                                                # logger.info(f"音频数据发送成功: {len(complete_audio_data)} 字节, 会话ID: {session_id}")
-                                            except Exception as e:
-                                                logger.error(f"音频数据发送失败: {str(e)}, 会话ID: {session_id}")
-                                            
-                                            session_audio_buffers[session_id] = bytearray()
+                                            await proxy_connections.send_to_backend(audio_buffer.take())
+                                            # logger.info(f"音频数据放入发送队列, 会话ID: {session_id}")
                                         else:
                                             logger.warning("没有接收到音频数据")                                            
                                     elif command == "touch":
                                         amount = data.get("amount", 1.0)  # 获取触摸压力值，默认为1.0
-                                        audio_data = await get_touch_audio_data(amount)
+                                        chunks = await get_touch_audio_chunks(amount, TOUCH_CHUNK_SIZE)
                                         
-                                        if audio_data:
-                                            chunk_size = 5120  # 大约5KB
-                                            for i in range(0, len(audio_data), chunk_size):
-                                                audio_chunk = audio_data[i:i+chunk_size]
-                                                await websocket.send_bytes(audio_chunk)
-                                                await asyncio.sleep(0.05)  # 短暂延迟，控制发送速率
-                                            logger.info(f"触摸音频发送完成，总大小: {len(audio_data)} 字节")
+                                        if chunks:
+                                            # 在后台任务中按固定间隔发送，不阻塞当前连接继续接收消息
+                                            start_background_task(send_paced(state.sender, chunks, TOUCH_CHUNK_INTERVAL))
                                         else:
                                             logger.warning("没有接收到音频数据")
-                            except json.JSONDecodeError:
+                            except orjson.JSONDecodeError:
                                 logger.error("无法解析前端发送的JSON消息")
                     except WebSocketDisconnect:
                         logger.info(f"前端客户端断开连接: {client_id}")
@@ -332,31 +707,16 @@ async def proxy_websocket_endpoint(websocket: WebSocket):
             except Exception as e:
                 logger.error(f"前端客户端连接错误: {str(e)}")
             finally:
-                if client_id in frontend_clients:
-                    del frontend_clients[client_id]
-                
-                if client_id in client_to_session:
-                    session_id = client_to_session[client_id]
-                    if session_id in session_to_client:
-                        del session_to_client[session_id]
-                    
-                    if session_id in session_audio_buffers:
-                        del session_audio_buffers[session_id]
-                        
-                    del client_to_session[client_id]
-                
+                await proxy_connections.remove(state)
                 logger.info(f"前端客户端资源已清理: {client_id}")
         else:
             # 未知客户端类型
-            await websocket.send_text(json.dumps({
-                "type": "error",
-                "content": f"未知的客户端类型: {client_type}"
-            }))
+            await websocket.send_text(_frame("error", f"未知的客户端类型: {client_type}"))
             await websocket.close()
             
     except WebSocketDisconnect:
         logger.info("WebSocket连接断开")
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         logger.error("无法解析客户端初始化消息")
         await websocket.close()
     except Exception as e:
@@ -377,29 +737,24 @@ async def call_websocket_endpoint(websocket: WebSocket):
             return
         
         logger.info(f"呼叫初始化消息: {init_message}")
-        init_data = json.loads(init_message["text"])
+        init_data = orjson.loads(init_message["text"])
         
         if "client_type" not in init_data:
-            await websocket.send_text(json.dumps({
-                "type": "error",
-                "content": "缺少客户端类型标识"
-            }))
+            await websocket.send_text(ERR_MISSING_CLIENT_TYPE)
             await websocket.close()
             return
             
         client_type = init_data["client_type"]
         
         if client_type == "ai_backend":
-            global call_ai_backend
-            
             # 如果已有AI后端连接，拒绝新连接
-            if call_ai_backend is not None:
+            if call_connections.backend is not None:
                 logger.info("Error: 呼叫处理AI后端已存在连接")
                 await websocket.close()
                 return
                 
-            # 设置呼叫处理AI后端连接
-            call_ai_backend = websocket
+            # 设置呼叫处理AI后端连接，AI后端指定short_frames时音频消息改用2字节编号开头
+            await call_connections.attach_backend(websocket, bool(init_data.get("short_frames")))
             logger.info("呼叫处理AI后端已连接")
             
             try:
@@ -407,116 +762,65 @@ async def call_websocket_endpoint(websocket: WebSocket):
                 while True:
                     try:
                         logger.debug("准备接收来自呼叫AI后端的消息")
-                        message = await websocket.receive()
+                        message = await receive_frame(websocket)
                         
                         # 检查消息类型
-                        if "text" in message:
+                        if isinstance(message, str):
                             # 解析JSON消息
                             try:
-                                data = json.loads(message["text"])
+                                data = orjson.loads(message)
                                 
                                 if "type" in data and data.get("type") == "heartbeat":
                                     # 回复心跳确认
-                                    await call_ai_backend.send_text(json.dumps({"type": "heartbeat_ack"}))
+                                    await call_connections.send_to_backend(HEARTBEAT_ACK)
                                 elif "call_id" in data and "type" in data and data.get("type") == "text":
-                                    call_id = str(uuid.UUID(data["call_id"]))
+                                    call_uuid = uuid.UUID(data["call_id"])
+                                    call_id = str(call_uuid)
                                     
-                                    # 查找对应的FreeSwitch客户端
-                                    if call_id in call_to_client:
-                                        client_id = call_to_client[call_id]
-                                        
-                                        if client_id in call_freeswitch_clients:
-                                            freeswitch_ws = call_freeswitch_clients[client_id]
-                                            
-                                            # 转发消息给FreeSwitch
-                                            await freeswitch_ws.send_text(json.dumps({
-                                                "type": "text",
-                                                "call_id": call_id,
-                                                "content": data["content"]
-                                            }))
-                                            logger.info(f"已将AI消息转发至FreeSwitch客户端 {client_id}")
-                                        else:
-                                            logger.warning(f"找不到FreeSwitch客户端ID: {client_id}")
+                                    # 查找对应的FreeSwitch呼叫
+                                    state = call_connections.sessions.get(call_uuid.bytes)
+                                    if state is not None:
+                                        # 转发消息给FreeSwitch
+                                        state.sender.send(orjson.dumps({
+                                            "type": "text",
+                                            "call_id": call_id,
+                                            "content": data["content"]
+                                        }).decode())
+                                        logger.info(f"已将AI消息转发至FreeSwitch客户端 {state.client_id}")
                                     else:
                                         logger.warning(f"找不到呼叫ID: {call_id}")
                                 else:
                                     logger.warning("呼叫AI后端消息缺少call_id或type")
                                     
-                            except json.JSONDecodeError:
+                            except orjson.JSONDecodeError:
                                 logger.error("无法解析呼叫AI后端发送的JSON消息")
                         
-                        elif "bytes" in message:
+                        else:
                             # 处理二进制数据（音频）
-                            binary_data = message["bytes"]
+                            binary_data = message
                             
-                            # 从二进制数据中提取呼叫ID（前16字节）
-                            if len(binary_data) > 16:
-                                # 提取呼叫ID（呼叫ID是UUID格式，存储在前16字节）
-                                call_id_bytes = binary_data[:16]
-                                audio_data = binary_data[16:]
+                            # 帧头为16字节的呼叫ID，或协商短帧头时为2字节的连接编号
+                            header_len = call_connections.frame_header_len()
+                            if len(binary_data) > header_len:
+                                audio_data = binary_data[header_len:]
                                 
-                                try:
-                                    # 将字节转换为UUID字符串
-                                    call_id = str(uuid.UUID(bytes=call_id_bytes))
-                                    logger.info(f"接收到呼叫AI后端音频数据: {len(audio_data)} 字节, 呼叫ID: {call_id}")
-                                        
-                                    # 查找对应的FreeSwitch客户端
-                                    if call_id in call_to_client:
-                                        client_id = call_to_client[call_id]
-                                        
-                                        if client_id in call_freeswitch_clients:
-                                            freeswitch_ws = call_freeswitch_clients[client_id]
-                                            
-                                            # 初始化输出缓冲区（如果不存在）
-                                            if call_id not in call_output_buffers:
-                                                call_output_buffers[call_id] = bytearray()
-                                            
-                                            # 使用WAV合并函数将音频数据添加到输出缓冲区
-                                            call_output_buffers[call_id] = merge_wav_audio_data(call_output_buffers[call_id], audio_data)
-                                            logger.debug(f"缓冲AI音频数据: {len(audio_data)} 字节, 累计: {len(call_output_buffers[call_id])} 字节")
-                                            
-                                            # 检查缓冲区大小是否超过64KB
-                                            if len(call_output_buffers[call_id]) >= 12880:  # 64KB = 64 * 1024
-                                                # 获取该呼叫的音频配置
-                                                audio_config = {
-                                                    "audioDataType": "wav",
-                                                    "sampleRate": 24000,
-                                                    "channels": 1,
-                                                    "bitDepth": 16
-                                                }
-                                                
-                                                # 从合并的音频帧数据创建完整的WAV文件
-                                                merged_audio_frames = bytes(call_output_buffers[call_id])
-                                                complete_wav_data = create_wav_from_frames(
-                                                    merged_audio_frames,
-                                                    sample_rate=audio_config.get("sampleRate", 24000),
-                                                    channels=audio_config.get("channels", 1),
-                                                    sample_width=audio_config.get("bitDepth", 16) // 8
-                                                )
-                                                
-                                                audio_message = {
-                                                    "type": "streamAudio",
-                                                    "data": {
-                                                        "audioDataType": "wav",
-                                                        "sampleRate": audio_config.get("sampleRate", 24000),
-                                                        "channels": audio_config.get("channels", 1),
-                                                        "bitDepth": audio_config.get("bitDepth", 16),
-                                                        "audioData": base64.b64encode(complete_wav_data).decode('utf-8')
-                                                    }
-                                                }
-                                                                                            
-                                                await freeswitch_ws.send_text(json.dumps(audio_message))
-                                                logger.info(f"已将AI处理的音频数据转发至FreeSwitch客户端 {client_id} (合并音频帧: {len(merged_audio_frames)} 字节, 完整WAV: {len(complete_wav_data)} 字节, 格式: {audio_config.get('audioDataType', 'wav')}, {audio_config.get('sampleRate', 24000)}Hz)")
-                                                
-                                                # 清空输出缓冲区
-                                                call_output_buffers[call_id] = bytearray()
-                                            
-                                        else:
-                                            logger.warning(f"找不到FreeSwitch客户端ID: {client_id}")
-                                    else:
-                                        logger.warning(f"转发音频数据失败,找不到呼叫ID: {call_id}")
-                                except ValueError:
-                                    logger.error("无法解析呼叫ID")
+                                # 查找对应的FreeSwitch呼叫
+                                state = call_connections.session_for_frame(binary_data)
+                                if state is not None:
+                                    logger.info(f"接收到呼叫AI后端音频数据: {len(audio_data)} 字节, 呼叫ID: {state.session_id}")
+                                    
+                                    # 使用WAV合并函数将音频数据添加到输出缓冲区
+                                    state.output_buffer = merge_wav_audio_data(state.output_buffer, audio_data)
+                                    output_len = state.output_len
+                                    logger.debug(f"缓冲AI音频数据: {len(audio_data)} 字节, 累计: {output_len} 字节")
+                                    
+                                    # 检查缓冲区大小是否超过64KB
+                                    if output_len >= 12880:  # 64KB = 64 * 1024
+                                        # 发送后清空输出缓冲区
+                                        send_call_audio(state)
+                                        logger.info(f"已将AI处理的音频数据转发至FreeSwitch客户端 {state.client_id} (合并音频帧: {output_len} 字节, {CALL_OUTPUT_SAMPLE_RATE}Hz, 二进制帧: {state.output_start > 0})")
+                                else:
+                                    logger.warning(f"转发音频数据失败,找不到呼叫: {binary_data[:header_len].hex()}")
                             else:
                                 logger.error("呼叫音频数据格式不正确")
                     except WebSocketDisconnect:
@@ -526,7 +830,7 @@ async def call_websocket_endpoint(websocket: WebSocket):
                 logger.error(f"呼叫AI后端连接错误: {str(e)}")
             finally:
                 # 清理AI后端连接
-                call_ai_backend = None
+                await call_connections.detach_backend(websocket)
                 logger.info("呼叫AI后端连接已关闭")
                 
         elif client_type == "freeswitch":
@@ -536,6 +840,16 @@ async def call_websocket_endpoint(websocket: WebSocket):
             # 获取呼叫ID，如果没有提供则生成一个
             call_id = init_data.get("call_id", str(uuid.uuid4()))
             
+            # 发往AI后端的音频以呼叫ID的16字节形式开头，连接建立时转换一次；
+            # 统一为标准格式，与AI后端消息中解析出的呼叫ID一致
+            try:
+                call_uuid = uuid.UUID(call_id)
+            except (ValueError, TypeError, AttributeError):
+                await websocket.send_text(_frame("error", f"呼叫ID不是UUID格式: {call_id}"))
+                await websocket.close()
+                return
+            call_id = str(call_uuid)
+            
             # 获取音频格式配置，设置默认值
             audio_config = init_data.get("audio_config", {})
             default_config = {
@@ -550,45 +864,38 @@ async def call_websocket_endpoint(websocket: WebSocket):
             # 验证音频格式
             supported_formats = ["raw", "wav", "mp3", "ogg"]
             if final_audio_config["audioDataType"] not in supported_formats:
-                await websocket.send_text(json.dumps({
-                    "type": "error",
-                    "content": f"不支持的音频格式: {final_audio_config['audioDataType']}，支持的格式: {supported_formats}"
-                }))
+                await websocket.send_text(_frame("error", f"不支持的音频格式: {final_audio_config['audioDataType']}，支持的格式: {supported_formats}"))
                 await websocket.close()
                 return
             
-            # 记录映射关系
-            call_freeswitch_clients[client_id] = websocket
-            call_to_client[call_id] = client_id
-            client_to_call[client_id] = call_id
+            # 记录呼叫状态：音频缓冲区和音频配置
+            state = SessionState(websocket, client_id, call_id, AudioSendBuffer(CALL_SEND_CHUNK_SIZE, call_uuid.bytes),
+                                 audio_config=final_audio_config)
+            audio_buffer = state.audio_buffer
+            
+            # 客户端在audio_config中指定binary_audio时，AI音频以二进制帧发送，不再base64编码；
+            # 帧头内容固定，连接建立时写入一次输出缓冲开头，AI音频直接追加在其后
+            if final_audio_config.get("binary_audio"):
+                state.output_buffer = bytearray(CALL_AUDIO_HEADER.size)
+                CALL_AUDIO_HEADER.pack_into(
+                    state.output_buffer, 0, call_uuid.bytes, AUDIO_FORMAT_CODES["raw"],
+                    CALL_OUTPUT_SAMPLE_RATE, CALL_OUTPUT_CHANNELS, CALL_OUTPUT_BIT_DEPTH
+                )
+                state.output_start = CALL_AUDIO_HEADER.size
             
-            # 保存音频配置
-            call_audio_configs[call_id] = final_audio_config
+            # 调试时在连接建立时打开一次转储文件，之后追加写入
+            if settings.DEBUG_DUMP_AUDIO:
+                os.makedirs("./input", exist_ok=True)
+                state.dump_file = await asyncio.to_thread(open, f"./input/{call_id}.pcm", "ab")
             
-            # 初始化音频缓冲区
-            call_audio_buffers[call_id] = bytearray()
+            await call_connections.add(state)
             
             logger.info(f"FreeSwitch客户端已连接: ID={client_id}, 呼叫ID={call_id}, 音频格式={final_audio_config['audioDataType']}")
             
-            # 发送欢迎音频，读取目录下的welcome.wav
-            with open("welcome.wav", "rb") as f:
-                audio_data = f.read()
-                audio_data = base64.b64encode(audio_data).decode('utf-8')
-                
-            logger.info(f"欢迎音频数据长度: {len(audio_data)}")
-
-            welcome_message = {
-                "type": "streamAudio",
-                "data": {
-                    "audioDataType": "wav",
-                    "sampleRate": 24000,
-                    "channels": 1,
-                    "bitDepth": 16,
-                    "audioData": audio_data
-                }
-            }
-            await websocket.send_text(json.dumps(welcome_message))
-            logger.info(f"发送欢迎音频: {len(audio_data)} 字节")
+            # 发送欢迎音频
+            if WELCOME_FRAME is not None:
+                state.sender.send(WELCOME_FRAME)
+                logger.info(f"发送欢迎音频: {len(WELCOME_FRAME)} 字节")
             await asyncio.sleep(1)
             
             try:
@@ -596,42 +903,32 @@ async def call_websocket_endpoint(websocket: WebSocket):
                 while True:
                     try:
                         logger.debug(f"准备接收来自FreeSwitch客户端{client_id}的消息")
-                        message = await websocket.receive()
+                        message = await receive_frame(websocket)
                         
                         # 检查消息类型
-                        if "bytes" in message:
-                            audio_data = message["bytes"]
-                            call_audio_buffers[call_id].extend(audio_data)
-
-                            # 检查缓冲区大小是否超过32k
-                            if len(call_audio_buffers[call_id]) >= 16384:  # 32k = 32 * 1024
-                                tmp_audio_file = f"./input/{uuid.uuid4().hex}.wav"
-                                with wave.open(tmp_audio_file, 'wb') as wav_file:
-                                    wav_file.setnchannels(1)
-                                    wav_file.setsampwidth(2)
-                                    wav_file.setframerate(16000)
-                                    wav_file.writeframes(call_audio_buffers[call_id])
-                                logger.info(f"保存音频数据到文件: {tmp_audio_file}")
-
-                                if call_ai_backend is not None:
-                                    complete_audio_data = bytes(call_audio_buffers[call_id])
-                                    call_id_bytes = uuid.UUID(call_id).bytes
-                                    data_with_call_id = call_id_bytes + complete_audio_data
-
-                                    await call_ai_backend.send_bytes(data_with_call_id)
-                                    
-                                    # 清空缓冲区
-                                    call_audio_buffers[call_id] = bytearray()
-                                    logger.info(f"发送呼叫音频数据: {len(complete_audio_data)} 字节, 呼叫ID: {call_id}")
+                        if not isinstance(message, str):
+                            audio_data = message
+                            remaining = audio_buffer.write(audio_data)
+
+                            if state.dump_file is not None:
+                                await asyncio.to_thread(state.dump_file.write, audio_data)
+
+                            # 缓冲区写满时发送，一条消息放不下的部分写入清空后的缓冲区
+                            while audio_buffer.full():
+                                if await call_connections.send_to_backend(audio_buffer.take()):
+                                    logger.info(f"发送呼叫音频数据: {CALL_SEND_CHUNK_SIZE} 字节, 呼叫ID: {call_id}")
                                 else:
+                                    # AI后端未连接，丢弃已缓冲的音频
+                                    audio_buffer.clear()
                                     logger.warning("呼叫AI后端未连接，无法发送呼叫音频数据")
+                                remaining = audio_buffer.write(remaining)
                             
-                        elif "text" in message:
+                        else:
                             try:
-                                data = json.loads(message["text"])
+                                data = orjson.loads(message)
                                 logger.debug(f"接收到FreeSwitch消息: {data}")
                                         
-                            except json.JSONDecodeError:
+                            except orjson.JSONDecodeError:
                                 logger.error("无法解析FreeSwitch发送的JSON消息")
                     except WebSocketDisconnect:
                         logger.info(f"FreeSwitch客户端断开连接: {client_id}")
@@ -639,83 +936,22 @@ async def call_websocket_endpoint(websocket: WebSocket):
             except Exception as e:
                 logger.error(f"FreeSwitch客户端连接错误: {str(e)}")
             finally:
-                # 清理FreeSwitch客户端资源
-                if client_id in call_freeswitch_clients:
-                    del call_freeswitch_clients[client_id]
-                
-                if client_id in client_to_call:
-                    call_id = client_to_call[client_id]
-                    
-                    # 清理呼叫相关资源
-                    if call_id in call_to_client:
-                        del call_to_client[call_id]
-                    
-                    if call_id in call_audio_buffers:
-                        del call_audio_buffers[call_id]
-                    
-                    # 在清理前发送剩余的输出缓冲数据（如果有的话）
-                    if call_id in call_output_buffers and len(call_output_buffers[call_id]) > 0:
-                        try:
-                            # 获取该呼叫的音频配置
-                            audio_config = call_audio_configs.get(call_id, {
-                                "audioDataType": "wav",
-                                "sampleRate": 24000,
-                                "channels": 1,
-                                "bitDepth": 16
-                            })
-                            
-                            # 从剩余的音频帧数据创建完整的WAV文件
-                            remaining_audio_frames = bytes(call_output_buffers[call_id])
-                            complete_wav_data = create_wav_from_frames(
-                                remaining_audio_frames,
-                                sample_rate=audio_config.get("sampleRate", 24000),
-                                channels=audio_config.get("channels", 1),
-                                sample_width=audio_config.get("bitDepth", 16) // 8
-                            )
-                            
-                            audio_message = {
-                                "type": "streamAudio",
-                                "data": {
-                                    "audioDataType": "wav",
-                                    "sampleRate": audio_config.get("sampleRate", 24000),
-                                    "channels": audio_config.get("channels", 1),
-                                    "bitDepth": audio_config.get("bitDepth", 16),
-                                    "audioData": base64.b64encode(complete_wav_data).decode('utf-8')
-                                }
-                            }
-                            
-                            # 如果FreeSwitch连接仍然有效，发送剩余数据
-                            if client_id in call_freeswitch_clients:
-                                freeswitch_ws = call_freeswitch_clients[client_id]
-                                await freeswitch_ws.send_text(json.dumps(audio_message))
-                                logger.info(f"已发送剩余缓冲音频数据至FreeSwitch客户端 {client_id} (音频帧: {len(remaining_audio_frames)} 字节, 完整WAV: {len(complete_wav_data)} 字节)")
-                        except Exception as e:
-                            logger.warning(f"发送剩余音频数据失败: {str(e)}")
-                    
-                    # 清理输出缓冲区
-                    if call_id in call_output_buffers:
-                        del call_output_buffers[call_id]
-                    
-                    # 清理音频配置
-                    if call_id in call_audio_configs:
-                        del call_audio_configs[call_id]
-                        
-                    del client_to_call[client_id]
+                # 清理FreeSwitch客户端资源，缓冲区和音频配置随呼叫状态一起删除
+                await call_connections.remove(state)
+                if state.dump_file is not None:
+                    await asyncio.to_thread(state.dump_file.close)
                 
                 logger.info(f"FreeSwitch客户端资源已清理: {client_id}")
                 logger.debug(f"删除呼叫映射: 呼叫ID={call_id}")
                 
         else:
             # 未知客户端类型
-            await websocket.send_text(json.dumps({
-                "type": "error", 
-                "content": f"呼叫接口不支持的客户端类型: {client_type}，支持的类型: ai_backend, freeswitch"
-            }))
+            await websocket.send_text(_frame("error", f"呼叫接口不支持的客户端类型: {client_type}，支持的类型: ai_backend, freeswitch"))
             await websocket.close()
             
     except WebSocketDisconnect:
         logger.info("呼叫WebSocket连接断开")
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         logger.error("无法解析呼叫客户端初始化消息")
         await websocket.close()
     except Exception as e:
@@ -731,6 +967,9 @@ async def get_call_status():
     """
     获取呼叫接口的连接状态
     """
+    call_ai_backend = call_connections.backend
+    calls = list(call_connections.sessions.values())
+    output_buffers = [state for state in calls if state.output_len]
     return {
         "status": "ok",
         "connections": {
@@ -739,24 +978,24 @@ async def get_call_status():
                 "connection_id": id(call_ai_backend) if call_ai_backend else None
             },
             "freeswitch_clients": {
-                "count": len(call_freeswitch_clients),
-                "clients": list(call_freeswitch_clients.keys())
+                "count": len(calls),
+                "clients": [state.client_id for state in calls]
             },
             "active_calls": {
-                "count": len(call_to_client),
-                "calls": list(call_to_client.keys())
+                "count": len(calls),
+                "calls": [state.session_id for state in calls]
             },
             "audio_buffers": {
-                "count": len(call_audio_buffers),
-                "buffer_sizes": {call_id: len(buffer) for call_id, buffer in call_audio_buffers.items()}
+                "count": len(calls),
+                "buffer_sizes": {state.session_id: len(state.audio_buffer) for state in calls}
             },
             "output_buffers": {
-                "count": len(call_output_buffers),
-                "buffer_sizes": {call_id: len(buffer) for call_id, buffer in call_output_buffers.items()}
+                "count": len(output_buffers),
+                "buffer_sizes": {state.session_id: state.output_len for state in output_buffers}
             },
             "audio_configs": {
-                "count": len(call_audio_configs),
-                "configurations": {call_id: config for call_id, config in call_audio_configs.items()}
+                "count": len(calls),
+                "configurations": {state.session_id: state.audio_config for state in calls}
             }
         }
     }
@@ -768,74 +1007,19 @@ async def cleanup_call_resources():
     """
     cleaned_items = []
     
-    # 清理孤立的音频缓冲区
-    orphaned_buffers = []
-    for call_id in list(call_audio_buffers.keys()):
-        if call_id not in call_to_client:
-            orphaned_buffers.append(call_id)
-            del call_audio_buffers[call_id]
-    
-    # 清理孤立的输出缓冲区
-    orphaned_output_buffers = []
-    for call_id in list(call_output_buffers.keys()):
-        if call_id not in call_to_client:
-            orphaned_output_buffers.append(call_id)
-            del call_output_buffers[call_id]
-    
-    # 清理孤立的音频配置
-    orphaned_configs = []
-    for call_id in list(call_audio_configs.keys()):
-        if call_id not in call_to_client:
-            orphaned_configs.append(call_id)
-            del call_audio_configs[call_id]
-    
-    if orphaned_buffers:
-        cleaned_items.append(f"清理了 {len(orphaned_buffers)} 个孤立的音频缓冲区")
-    
-    if orphaned_configs:
-        cleaned_items.append(f"清理了 {len(orphaned_configs)} 个孤立的音频配置")
-    
-    # 检查并清理不一致的映射关系
-    inconsistent_mappings = []
-    
-    # 检查 call_to_client 中的映射是否在 client_to_call 中存在
-    for call_id, client_id in list(call_to_client.items()):
-        if client_id not in client_to_call or client_to_call[client_id] != call_id:
-            inconsistent_mappings.append(f"call_to_client: {call_id} -> {client_id}")
-            del call_to_client[call_id]
-    
-    # 检查 client_to_call 中的映射是否在 call_to_client 中存在
-    for client_id, call_id in list(client_to_call.items()):
-        if call_id not in call_to_client or call_to_client[call_id] != client_id:
-            inconsistent_mappings.append(f"client_to_call: {client_id} -> {call_id}")
-            del client_to_call[client_id]
-    
-    if inconsistent_mappings:
-        cleaned_items.append(f"修复了 {len(inconsistent_mappings)} 个不一致的映射关系")
-    
-    # 检查是否有断开连接但未清理的客户端
+    # 缓冲区、音频配置和映射关系都保存在呼叫状态中，随呼叫一起删除，不会单独残留；
+    # 只需检查是否有断开连接但未清理的客户端
     disconnected_clients = []
-    for client_id, ws in list(call_freeswitch_clients.items()):
+    for state in list(call_connections.sessions.values()):
         try:
             # 尝试发送ping来检查连接状态
-            await ws.ping()
+            await state.ws.ping()
         except:
             # 连接已断开，清理相关资源
-            disconnected_clients.append(client_id)
-            del call_freeswitch_clients[client_id]
-            
-            # 清理相关映射
-            if client_id in client_to_call:
-                call_id = client_to_call[client_id]
-                if call_id in call_to_client:
-                    del call_to_client[call_id]
-                if call_id in call_audio_buffers:
-                    del call_audio_buffers[call_id]
-                if call_id in call_output_buffers:
-                    del call_output_buffers[call_id]
-                if call_id in call_audio_configs:
-                    del call_audio_configs[call_id]
-                del client_to_call[client_id]
+            disconnected_clients.append(state.client_id)
+            await call_connections.remove(state)
+            if state.dump_file is not None:
+                state.dump_file.close()
     
     if disconnected_clients:
         cleaned_items.append(f"清理了 {len(disconnected_clients)} 个断开的FreeSwitch客户端")
@@ -843,15 +1027,16 @@ async def cleanup_call_resources():
     if not cleaned_items:
         cleaned_items.append("没有发现需要清理的资源")
     
+    calls = call_connections.sessions.values()
     return {
         "status": "cleanup_completed",
         "cleaned_items": cleaned_items,
         "current_status": {
-            "ai_backend_connected": call_ai_backend is not None,
-            "freeswitch_clients": len(call_freeswitch_clients),
-            "active_calls": len(call_to_client),
-            "audio_buffers": len(call_audio_buffers),
-            "output_buffers": len(call_output_buffers),
-            "audio_configs": len(call_audio_configs)
+            "ai_backend_connected": call_connections.backend is not None,
+            "freeswitch_clients": len(calls),
+            "active_calls": len(calls),
+            "audio_buffers": len(calls),
+            "output_buffers": sum(1 for state in calls if state.output_len),
+            "audio_configs": len(calls)
          }
      }
\ No newline at end of file
@@ -15,6 +15,7 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=settings.WEBSOCKET_PORT,
         reload=settings.APP_ENV == "development",
+        ws_per_message_deflate=settings.WS_PER_MESSAGE_DEFLATE,  # 音频帧不压缩，避免对PCM数据做无效的zlib压缩
         # timeout_keep_alive=120,        # 将保持连接活跃的超时时间设为120秒
         # ws_ping_interval=30,           # 将WebSocket ping间隔设为30秒
         # ws_ping_timeout=30,            # 将WebSocket ping超时设为30秒